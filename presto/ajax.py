@@ -77,9 +77,10 @@ import traceback
 
 # presto modules
 from presto.badge import verify_certified_image
+from presto.cache import profile_roles
 from presto.generic import authenticated_user
 from presto.history_view import set_history_properties
-from presto.plag_scan import scan_assignment
+from presto.plag_scan import fingerprint_text, scan_assignment
 from presto.teams import current_team, things_to_do, team_user_downloads
 from presto.utils import (
     DATE_FORMAT,
@@ -231,7 +232,7 @@ def ajax(request, **kwargs):
                 user=presto_user,
                 session_key=key
                 )
-            user_roles = [r.name for r in presto_user.profile.roles.all()]
+            user_roles = [r.name for r in profile_roles(presto_user.profile)]
         except Exception as e:
             # TO DO: Remove detailed error message str(e) in production version
             jd['error'] = 'No access -- ' + str(e)
@@ -325,6 +326,7 @@ def ajax(request, **kwargs):
             ia.rating = request.POST.get('r', '')
             ia.comment = request.POST.get('c', '')
             ia.save()
+            fingerprint_text(ia)
             log_message('Assignment item saved: ' + str(ia), presto_user)
             # Calculate minutes since the assignment was assigned.
             m = int((timezone.now() - ua.time_assigned).total_seconds() / 60) + 1
@@ -350,6 +352,7 @@ def ajax(request, **kwargs):
                 pr.grade_motivation = request.POST.get('r', '')
                 # NOTE: time_submitted is not set => saved, but not submitted yet
                 pr.save()
+                fingerprint_text(pr)
                 log_message('Review saved: ' + str(pr), presto_user)
             elif a == 'save review item':
                 i = pr.assignment.leg.review_items.get(number=request.POST.get('i', ''))
@@ -877,7 +880,12 @@ def ajax(request, **kwargs):
                     )
             et.last_editor = presto_user
             et.time_last_edit = timezone.now()
-            et.save()
+            if a == 'modify step':
+                # NOTE: the leg count of the template may have changed since it was read,
+                #       so only the fields that have been modified are saved
+                et.save(update_fields=['last_editor', 'time_last_edit'])
+            else:
+                et.save()
             jd['te'] = EDIT_STRING.format(
                 name=prefixed_user_name(et.last_editor),
                 time=timezone.localtime(et.time_last_edit).strftime(DATE_TIME_FORMAT)
@@ -1001,7 +1009,8 @@ def ajax(request, **kwargs):
             # now add data on each step for which there exists an assignment for this participant
             # (excluding clones and rejected assignments)
             a_list = Assignment.objects.filter(participant=p
-                ).filter(clone_of__isnull=True).exclude(is_rejected=True).order_by('leg__number')
+                ).filter(clone_of__isnull=True).exclude(is_rejected=True).exclude(is_retired=True
+                ).order_by('leg__number')
             for a in a_list:
                 step = a.leg.number - 1
                 step_list[step]['letter'] = a.case.letter
@@ -37,6 +37,7 @@ from .models import PrestoBadge, DEFAULT_DATE
 from binascii import hexlify
 from datetime import datetime
 from hashlib import pbkdf2_hmac
+from io import BytesIO
 
 import json
 import math
@@ -47,6 +48,7 @@ from tempfile import mkstemp
 from time import sleep
 
 # presto modules
+from presto.cache import cached_image
 from presto.generic import change_role, generic_context, has_role
 from presto.utils import decode, encode, log_message, prefixed_user_name
 
@@ -126,6 +128,18 @@ def star_polygon(m, n, radius):
 
 # returns a PIL image for an n-star participant badge image with color bc
 def participant_badge_image(n, bc):
+    return Image.open(BytesIO(cached_image('badge', ['participant', n, bc],
+        lambda: draw_participant_badge(n, bc))))
+
+
+# returns a PIL image for a level n referee badge image with color bc
+def referee_badge_image(n, bc):
+    return Image.open(BytesIO(cached_image('badge', ['referee', n, bc],
+        lambda: draw_referee_badge(n, bc))))
+
+
+# draws the image for an n-star participant badge image with color bc
+def draw_participant_badge(n, bc):
     # convert badge color (integer) to disc image file and RGBA tuple
     d, c = disc_and_color(bc)
     # start with the disc image
@@ -160,8 +174,8 @@ def participant_badge_image(n, bc):
     return img
 
 
-# returns a PIL image for a level n referee badge image with color bc
-def referee_badge_image(n, bc):
+# draws the image for a level n referee badge image with color bc
+def draw_referee_badge(n, bc):
     # convert badge color (integer) to disc image file and RGBA tuple
     d, c = disc_and_color(bc)
     # start with the disc image
@@ -0,0 +1,159 @@
+"""
+Software developed by Pieter W.G. Bots for the PrESTO project
+Code repository: https://github.com/pwgbots/presto
+Project wiki: http://presto.tudelft.nl/wiki
+
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Screening of review texts for improper language.
+"""
+
+from django.utils.html import strip_tags
+
+from langdetect import DetectorFactory, detect
+import re
+
+from presto.uiphrases import UI_BLACKDICT, UI_STOPWORDS
+
+# make language detection deterministic (langdetect samples at random)
+DetectorFactory.seed = 0
+
+# a text is considered to be in a language when at least this share of its
+# words are frequent function words of that language ...
+MIN_STOPWORD_SHARE = 0.15
+# ... and this share is at least this many times the share for other languages
+MIN_STOPWORD_RATIO = 2
+
+WORD_RE = re.compile(r'\w+')
+
+STOPWORD_SETS = {lc: set(sw) for lc, sw in UI_STOPWORDS.items()}
+
+
+# returns list of regular expression tokens for blacklist entry
+# NOTE: leading and trailing spaces in an entry mean that it should match only at the
+#       start (or end) of a word; other entries match anywhere, as they typically are
+#       stems of words
+def entry_tokens(entry):
+    tl = [re.escape(c) for c in entry.strip()]
+    if entry[:1] == ' ':
+        tl.insert(0, r'(?<!\w)')
+    if entry[-1:] == ' ':
+        tl.append(r'(?!\w)')
+    return tl
+
+
+# returns regular expression pattern for the (sub)trie node
+# NOTE: factoring out common prefixes makes that the regular expression engine needs
+#       to try only few alternatives at each position in a text
+def trie_pattern(node):
+    alts = [t + trie_pattern(sub) for t, sub in sorted(node.items()) if t]
+    if not alts:
+        return ''
+    p = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+    # an empty key marks the end of an entry, so the rest is optional
+    if '' in node:
+        p = '(?:' + p + ')?'
+    return p
+
+
+# returns tuple (regex, candidate dict, pattern dict) for the list of entries
+# NOTE: the regex finds all positions in a text where some entry matches in a single
+#       pass; as it is a lookahead, these matches may overlap; the candidate dict maps
+#       the first character of an entry to the list of entries starting with it, and
+#       the pattern dict maps each entry to its own compiled pattern (in list order)
+def compile_blacklist(entries):
+    entries = [e for e in entries if e.strip()]
+    if not entries:
+        return (None, {}, {})
+    trie = {}
+    c_dict = {}
+    p_dict = {}
+    for e in entries:
+        tl = entry_tokens(e)
+        node = trie
+        for t in tl:
+            node = node.setdefault(t, {})
+        node[''] = {}
+        c_dict.setdefault(e.strip()[0], []).append(e)
+        p_dict[e] = re.compile(''.join(tl))
+    return (re.compile('(?=' + trie_pattern(trie) + ')'), c_dict, p_dict)
+
+
+# compile the blacklist for each language only once
+BLACKLIST_RE = {lc: compile_blacklist(bl) for lc, bl in UI_BLACKDICT.items()}
+
+
+# returns text in lower case without HTML tags and punctuation
+def normalized_text(text):
+    return strip_tags(
+        text.lower().replace('.', ' ').replace(',', ' ').replace(
+            ';', ' ').replace('!', ' ').replace('?', ' ')
+        )
+
+
+# returns list of blacklist entries for the language found in text (in blacklist order)
+# NOTE: the regex matches only one entry at a position, while entries may be prefixes
+#       of one another, so all entries starting with the character at a position where
+#       the regex matches are checked
+def blacklisted_words(text, lang_code):
+    rx, c_dict, p_dict = BLACKLIST_RE.get(lang_code, (None, {}, {}))
+    if not rx:
+        return []
+    found = set()
+    for m in rx.finditer(text):
+        pos = m.start()
+        for e in c_dict[text[pos]]:
+            if not e in found and p_dict[e].match(text, pos):
+                found.add(e)
+    return [e for e in p_dict if e in found]
+
+
+# returns the blacklisted words that do not occur in text
+def words_not_in(words, text, lang_code):
+    p_dict = BLACKLIST_RE.get(lang_code, (None, {}, {}))[2]
+    return [w for w in words if not p_dict[w].search(text)]
+
+
+# returns True if text evidently is in the language having this code
+# NOTE: this is the case if a sufficient share of its words are frequent function words
+#       of that language, and not of the other languages
+def evident_language(text, lang_code):
+    words = WORD_RE.findall(text)
+    if not words:
+        return False
+    lang_share = 0
+    other_share = 0
+    for lc, sw in STOPWORD_SETS.items():
+        share = len([w for w in words if w in sw]) / len(words)
+        if lc == lang_code:
+            lang_share = share
+        else:
+            other_share = max(other_share, share)
+    return (lang_share >= MIN_STOPWORD_SHARE
+        and lang_share >= MIN_STOPWORD_RATIO * other_share)
+
+
+# returns the two-letter code of the language of text
+# NOTE: the language is detected only when the text is not evidently in the language
+#       having this code; raises an exception if the language cannot be detected
+def detected_language(text, lang_code):
+    if evident_language(text, lang_code):
+        return lang_code.split('-')[0]
+    return detect(text)
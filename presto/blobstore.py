@@ -0,0 +1,214 @@
+"""
+Software developed by Pieter W.G. Bots for the PrESTO project
+Code repository: https://github.com/pwgbots/presto
+Project wiki: http://presto.tudelft.nl/wiki
+
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F, Sum
+
+# python modules
+from hashlib import sha256
+import os
+from shutil import copyfile
+from tempfile import mkstemp
+
+# presto modules
+from presto.utils import file_digest, log_message
+
+# all blobs are stored in this subdirectory of MEDIA_ROOT
+BLOB_DIR = 'blobs'
+
+
+# returns the name (relative to MEDIA_ROOT) of the blob having the given digest
+# NOTE: blobs are "fanned out" over two levels of subdirectories to keep directories small
+def blob_name(sha):
+    return os.path.join(BLOB_DIR, sha[:2], sha[2:4], sha)
+
+
+# returns size in bytes as a short human-readable string (as "du -sh" would)
+def short_size(n):
+    for unit in ['', 'K', 'M', 'G']:
+        if n < 1024:
+            break
+        n /= 1024.0
+    else:
+        unit = 'T'
+    if unit and n < 10:
+        return '{:.1f}{}'.format(n, unit)
+    return '{}{}'.format(int(round(n)), unit)
+
+
+class BlobStorage(FileSystemStorage):
+    """
+    File system storage that stores each distinct file content only once.
+
+    The content is stored as a "blob" named by its sha256 digest. The file
+    itself is saved as a hard link to this blob, so the file paths that Presto
+    uses (upload directory plus file name) keep resolving as before. The Blob
+    model counts the number of files that refer to each blob, so that a blob
+    is removed when its last file is deleted.
+
+    NOTE: if the file system does not support hard links, the blob is copied,
+          so nothing is saved, but nothing breaks either.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # digests of the files saved by this storage, so that callers can look up
+        # the blob without reading the file again
+        self.digests = {}
+
+    def _save(self, name, content):
+        # write the content to a temporary file in the blob directory, computing its digest
+        blob_dir = self.path(BLOB_DIR)
+        os.makedirs(blob_dir, exist_ok=True)
+        fd, tmp_path = mkstemp(dir=blob_dir)
+        h = sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for data in content.chunks():
+                    h.update(data)
+                    size += len(data)
+                    f.write(data)
+            sha = h.hexdigest()
+            blob_path = self.path(blob_name(sha))
+            if os.path.exists(blob_path):
+                # same content has been stored before
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(tmp_path, blob_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # link the file to the blob (with an available name, as other processes may save too)
+        while True:
+            try:
+                link_to_blob(blob_path, self.path(name))
+                break
+            except FileExistsError:
+                name = self.get_available_name(name)
+        register_blob(sha, size)
+        self.digests[name] = sha
+        return name.replace('\\', '/')
+
+    def delete(self, name):
+        path = self.path(name)
+        if not os.path.isfile(path):
+            return
+        sha = file_digest(path)[0]
+        super().delete(name)
+        release_blob(self, sha)
+
+    # makes the existing file name refer to a blob, and returns the number of bytes saved
+    # NOTE: used to deduplicate files that were uploaded before the blob store existed
+    def adopt(self, name):
+        path = self.path(name)
+        sha, size = file_digest(path)
+        blob_path = self.path(blob_name(sha))
+        saved = 0
+        if not os.path.exists(blob_path):
+            # the file becomes the blob
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            link_to_blob(path, blob_path)
+        elif not os.path.samefile(path, blob_path):
+            # replace the file by a link to the blob (via a temporary link, so that
+            # the path never stops resolving)
+            tmp_path = path + '.blob'
+            link_to_blob(blob_path, tmp_path)
+            os.replace(tmp_path, path)
+            saved = size
+        else:
+            # the file already refers to the blob, so it has been counted before
+            self.digests[name] = sha
+            return 0
+        register_blob(sha, size)
+        self.digests[name] = sha
+        return saved
+
+    # returns the Blob object for the file name (computing its digest if needed)
+    def blob(self, name):
+        sha = self.digests.pop(name, None)
+        if not sha:
+            sha = file_digest(self.path(name))[0]
+        return apps.get_model('presto', 'Blob').objects.filter(sha256=sha).first()
+
+
+# creates a hard link at path to the blob (or a copy if hard links are not supported)
+def link_to_blob(blob_path, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(blob_path, path)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        log_message('WARNING: cannot link to blob ({}) -- copying it'.format(str(e)))
+        if os.path.exists(path):
+            raise FileExistsError(path)
+        copyfile(blob_path, path)
+
+
+# increments the reference count of the blob, creating it if needed
+def register_blob(sha, size):
+    Blob = apps.get_model('presto', 'Blob')
+    with transaction.atomic():
+        b, created = Blob.objects.get_or_create(sha256=sha, defaults={'size': size})
+        Blob.objects.filter(pk=b.pk).update(ref_count=F('ref_count') + 1)
+
+
+# decrements the reference count of the blob, and removes it when no longer referred to
+def release_blob(storage, sha):
+    Blob = apps.get_model('presto', 'Blob')
+    with transaction.atomic():
+        Blob.objects.filter(sha256=sha).update(ref_count=F('ref_count') - 1)
+        if Blob.objects.filter(sha256=sha, ref_count__lte=0).delete()[0]:
+            FileSystemStorage.delete(storage, blob_name(sha))
+
+
+BLOB_STORAGE = BlobStorage()
+
+
+# returns the storage for participant uploads
+# NOTE: a callable, so that migrations do not depend on the storage settings
+def blob_storage():
+    return BLOB_STORAGE
+
+
+# returns the disk space used by uploads as a short string (as "du -sh" would)
+# NOTE: computed from the Blob table, so it does not need to traverse directories
+def disk_usage(upload_dir=None):
+    if upload_dir:
+        # size of the uploads of one participant (blobs shared with others included)
+        qs = apps.get_model('presto', 'ParticipantUpload').objects.filter(
+            assignment__participant__upload_dir=upload_dir)
+        n = qs.aggregate(n=Sum('blob__size'))['n']
+    else:
+        # size of all stored blobs (i.e., actual disk usage)
+        n = apps.get_model('presto', 'Blob').objects.aggregate(n=Sum('size'))['n']
+    return short_size(n or 0)
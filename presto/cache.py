@@ -0,0 +1,171 @@
+"""
+Software developed by Pieter W.G. Bots for the PrESTO project
+Code repository: https://github.com/pwgbots/presto
+Project wiki: http://presto.tudelft.nl/wiki
+
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Data that is looked up on (nearly) every page but rarely changes is kept in the
+cache that is configured in settings.CACHES.
+
+Cached values depend on model objects. Each such object has a version number in
+the cache, and the key of a cached value comprises the versions of the objects
+it depends on. When an object is saved or deleted, the signal receivers in
+models.py call invalidate(), which changes the version of the object, so the
+values that depend on it are no longer found (and eventually expire).
+
+NOTE: version numbers are initialized with the current time (in nanoseconds),
+      so when a version is evicted from the cache, its new version differs
+      from all versions used before.
+"""
+
+from django.apps import apps
+from django.core.cache import cache
+
+# python modules
+from io import BytesIO
+from threading import Lock
+import time
+
+# default time-out (in seconds) for cached values
+CACHE_TIMEOUT = 24 * 3600
+
+# hits and misses per kind of cached value (counted per server process)
+CACHE_STATS = {}
+CACHE_STATS_LOCK = Lock()
+
+# used to distinguish "not in cache" from a cached None
+MISSING = object()
+
+
+# returns the cache key for the version of the object of the named model
+def version_key(model_name, pk):
+    return 'version:{}:{}'.format(model_name, pk)
+
+
+# returns list of versions of the objects in list deps of tuples (model name, primary key)
+def versions(deps):
+    keys = [version_key(m, pk) for m, pk in deps]
+    found = cache.get_many(keys) if keys else {}
+    for k in keys:
+        if k not in found:
+            # NOTE: if another process initializes the version first, add() has no effect
+            cache.add(k, time.time_ns(), None)
+            found[k] = cache.get(k)
+    return [found[k] for k in keys]
+
+
+# makes values cached for the object of the named model unreachable
+def invalidate(model_name, pk):
+    key = version_key(model_name, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+# records a cache hit (or miss) for the named kind of value
+def count(name, hit):
+    with CACHE_STATS_LOCK:
+        s = CACHE_STATS.setdefault(name, [0, 0])
+        s[0 if hit else 1] += 1
+
+
+# returns the value computed by function f, cached under the given name and arguments
+# as long as the objects in deps do not change
+def cached(name, args, deps, f, timeout=CACHE_TIMEOUT):
+    key = ':'.join([name] + [str(a) for a in args] + [str(v) for v in versions(deps)])
+    value = cache.get(key, MISSING)
+    count(name, value is not MISSING)
+    if value is MISSING:
+        value = f()
+        cache.set(key, value, timeout)
+    return value
+
+
+# returns list of dicts with hit statistics per kind of cached value
+def cache_statistics():
+    with CACHE_STATS_LOCK:
+        stats = sorted(CACHE_STATS.items())
+    return [{
+        'name': k,
+        'hits': h,
+        'misses': m,
+        'hit_rate': '{:.1f}%'.format(100.0 * h / (h + m)) if h + m else '-'
+        } for k, (h, m) in stats]
+
+
+# returns dict with the properties of course estafette (relay) with ID ceid
+# that are needed to look up its template, legs and cases
+def relay_metadata(ceid):
+    def f():
+        ce = apps.get_model('presto', 'CourseEstafette').objects.select_related(
+            'estafette').get(pk=ceid)
+        return {
+            'course_id': ce.course_id,
+            'estafette_id': ce.estafette_id,
+            'template_id': ce.estafette.template_id,
+            'final_reviews': ce.final_reviews,
+            'participant_count': apps.get_model('presto', 'Participant').objects.filter(
+                estafette_id=ceid).count()
+            }
+    return cached('relay', [ceid], [('CourseEstafette', ceid)], f)
+
+
+# returns list of legs of the estafette template with ID etid (ordered by number)
+def template_legs(etid):
+    return cached('legs', [etid], [('EstafetteTemplate', etid)], lambda: list(
+        apps.get_model('presto', 'EstafetteLeg').objects.filter(
+            template_id=etid).order_by('number')))
+
+
+# returns list of cases of the estafette with ID eid
+def estafette_cases(eid):
+    return cached('cases', [eid], [('Estafette', eid)], lambda: list(
+        apps.get_model('presto', 'EstafetteCase').objects.filter(estafette_id=eid)))
+
+
+# returns the number of legs of course estafette (relay) with ID ceid
+# NOTE: avoids fetching the relay, its estafette and its template from the database
+def relay_leg_count(ceid):
+    return len(template_legs(relay_metadata(ceid)['template_id']))
+
+
+# returns list of all roles
+def all_roles():
+    return cached('all_roles', [], [('Role', 0)], lambda: list(
+        apps.get_model('presto', 'Role').objects.all()))
+
+
+# returns list of roles of the user having the given profile
+def profile_roles(profile):
+    # NOTE: all roles have version ('Role', 0), as changing a role affects all users
+    return cached('roles', [profile.id], [('Profile', profile.id), ('Role', 0)],
+        lambda: list(profile.roles.all()))
+
+
+# returns PNG data of the image produced by function f, cached under the given arguments
+# NOTE: used for badge base images, which depend only on their arguments
+def cached_image(name, args, f):
+    def png():
+        buf = BytesIO()
+        f().save(buf, 'PNG')
+        return buf.getvalue()
+    return cached(name, args, [], png, None)
@@ -38,7 +38,8 @@ from .models import (
     Language,
     Participant, Profile,
     Role,
-    QuestionnaireTemplate
+    QuestionnaireTemplate,
+    relay_participant_counts
 )
 
 # python modules
@@ -162,19 +163,19 @@ def course(request, **kwargs):
     context['course']['students'] = CourseStudent.objects.filter(course=c, dummy_index=0).count()
 
     # add list of run(ning) estafettes
-    context['course']['estafettes'] = [{
+    # NOTE: participant counts for all relays are obtained with one (grouped) query
+    ce_list = list(CourseEstafette.objects.filter(course=c, is_deleted=False
+        ).select_related('course__language', 'estafette'))
+    counts = relay_participant_counts([ce.id for ce in ce_list])
+    context['course']['estafettes'] = [dict({
         'object': ce,
         'start_time': c.language.ftime(ce.start_time),
         'end_time': c.language.ftime(ce.end_time),
         'next_deadline': ce.next_deadline(),
-        'participant_count': Participant.objects.filter(
-            estafette=ce, student__dummy_index__gt=-1).count(),
-        'active_count': Participant.objects.filter(estafette=ce, student__dummy_index__gt=-1
-            ).filter(time_last_action__gte=timezone.now() - timedelta(days=1)).count(),
         'demo_code': ce.demonstration_code(),
         'consumer_secret': ce.LTI_consumer_secret(),
         'hex': encode(ce.id, context['user_session'].encoder)
-        } for ce in CourseEstafette.objects.filter(course=c, is_deleted=False)
+        }, **counts[ce.id]) for ce in ce_list
     ]
     context['page_title'] = 'Presto Course' 
     return render(request, 'presto/course.html', context)
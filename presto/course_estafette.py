@@ -39,9 +39,8 @@ from .models import (
     CourseEstafette,
     CourseStudent,
     DEFAULT_DATE,
+    DemoAlias,
     Estafette,
-    EstafetteCase,
-    EstafetteLeg,
     EstafetteTemplate,
     ItemReview,
     Objection,
@@ -49,18 +48,19 @@ from .models import (
     PeerReview,
     QuestionnaireTemplate,
     Referee,
-    SHORT_DATE_TIME,
-    UserSession
+    SESSION_TIMEOUT,
+    SHORT_DATE_TIME
 )
 
 # python modules
 from datetime import datetime, timedelta
 from hashlib import md5
-from json import dumps, loads
+from json import dumps
 from math import floor
 import os
 
 # presto modules
+from presto.cache import estafette_cases, relay_metadata, template_legs
 from presto.generic import (
     change_role,
     generic_context,
@@ -83,6 +83,7 @@ from presto.utils import (
     DATE_TIME_FORMAT,
     decode,
     encode,
+    encode_many,
     FACES,
     GRACE_MINUTE,
     log_message,
@@ -1085,25 +1086,26 @@ def course_estafette(request, **kwargs):
 
     # get the cases for this estafette
     global case_letters
-    q_set = EstafetteCase.objects.filter(estafette=ce.estafette)
-    case_letters = [c.letter for c in q_set]
+    rm = relay_metadata(ce.id)
+    case_letters = [c.letter for c in estafette_cases(rm['estafette_id'])]
     context['case_letters'] = case_letters
     
     # get the legs for this estafette
     global nr_of_legs
-    q_set = EstafetteLeg.objects.filter(template=ce.estafette.template)
-    nr_of_legs = len(q_set)
+    el_list = template_legs(rm['template_id'])
+    nr_of_legs = len(el_list)
     context['leg_numbers'] = range(1, nr_of_legs + 1)
     
     # add list of estafette legs to the context
     context['legs'] = [{
         'object': el,
-        'hex': encode(el.id, context['user_session'].encoder)
-        } for el in q_set
+        'hex': h
+        } for el, h in zip(el_list, encode_many(
+            [el.id for el in el_list], context['user_session'].encoder))
     ]
     
     # make a list of leg IDs (for identifying qualified referees later on)
-    leg_ids = q_set.values_list('id', flat=True)
+    leg_ids = [el.id for el in el_list]
     
     # add appraisal icon lists to context
     context['face_list'] = ['hand point up outline', 'smile', 'meh', 'frown']
@@ -1237,7 +1239,7 @@ def course_estafette(request, **kwargs):
     
     # (3) s/he must be made referee for this estafette (if not already)
     n = 0
-    for l in q_set:
+    for l in el_list:
         r, created = Referee.objects.get_or_create(user=context['user'], estafette_leg=l)
         if created:
             n += 1
@@ -1286,12 +1288,10 @@ def course_estafette(request, **kwargs):
 
     # to display aliases of "focused" demo-users, collect aliases of related course students
     # as a dictionary with course student ID as key and alias as value
-    demo_aliases = {}
-    usl = UserSession.objects.all()
-    for us in usl:
-        uss = loads(us.state)
-        if 'alias' in uss:
-            demo_aliases[uss['course_student_id']] = uss['alias']
+    # NOTE: sessions that have expired but have not been pruned yet are ignored
+    demo_aliases = dict(DemoAlias.objects.filter(course_student__course=ce.course_id,
+        session__last_action__gt=timezone.now() - SESSION_TIMEOUT
+        ).values_list('course_student_id', 'alias'))
     
     # create a dict with all referees qualified for this course estafette, idexed by their ID
     q_set = Referee.objects.filter(estafette_leg__id__in=leg_ids)
@@ -1318,7 +1318,10 @@ def course_estafette(request, **kwargs):
     p_dict = {}
     # and also make a list of IDs of "instructor participants"
     ipids = []
-    for p in q_set:
+    # encode all participant IDs at once
+    p_list = list(q_set)
+    p_hex = encode_many([p.id for p in p_list], context['user_session'].encoder)
+    for p, ph in zip(p_list, p_hex):
         # do not use function dummy_name() so as not to access the database 
         if p.student.dummy_index > 0:
             if p.student.id in demo_aliases:
@@ -1336,7 +1339,7 @@ def course_estafette(request, **kwargs):
             p,
             p.student.user.username,
             prefixed_user_name(p.student.user) + di,
-            encode(p.id, context['user_session'].encoder)
+            ph
             )
 
     # get the team lookup dict
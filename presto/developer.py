@@ -30,7 +30,7 @@ from django.db.models import Q
 from django.shortcuts import render
 from django.utils import timezone
 
-from .models import EstafetteLeg, EstafetteTemplate, QuestionnaireTemplate
+from .models import EstafetteTemplate, QuestionnaireTemplate
 
 # presto modules
 from presto.generic import change_role, generic_context, report_error
@@ -66,7 +66,7 @@ def developer(request, **kwargs):
             name=prefixed_user_name(t.last_editor),
             time=timezone.localtime(t.time_last_edit).strftime(DATE_TIME_FORMAT)
             ),
-        'leg_count': EstafetteLeg.objects.filter(template=t).count()
+        'leg_count': t.leg_count
         } for t in EstafetteTemplate.objects.filter(
             Q(editors=context['user']) | Q(creator=context['user'])).distinct()
     ]
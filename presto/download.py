@@ -26,7 +26,7 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils import timezone
 from wsgiref.util import FileWrapper
@@ -42,13 +42,12 @@ from .models import (
 
 # python modules
 from docx import Document
+from io import BytesIO
 import os
 from pptx import Presentation
 from PyPDF2 import PdfFileWriter, PdfFileReader
 from PyPDF2.generic import createStringObject, NameObject
 import re
-from shutil import copy2, copyfile, make_archive, rmtree
-from tempfile import mkstemp
 from xml.etree import ElementTree
 from zipfile import ZipFile, ZIP_DEFLATED
 
@@ -60,7 +59,6 @@ from presto.utils import (
     encode,
     EDIT_STRING,
     log_message,
-    os_path,
     random_hex
     )
 
@@ -124,48 +122,30 @@ def download(request, **kwargs):
             pul = ParticipantUpload.objects.filter(assignment=a)
             upl_dir = os.path.join(settings.MEDIA_ROOT, a.participant.upload_dir)
         log_message('Upload dir = ' + upl_dir, context['user'])
-        # create an empty temporary dir to hold copies of uploaded files
-        temp_dir = os.path.join(upl_dir, 'temp')
-        try:
-            rmtree(temp_dir)
-        except:
-            pass
-        os.mkdir(temp_dir)
-        log_message('TEMP dir: ' + temp_dir, context['user'])
+        # NOTE: files are anonymized in memory, so no (temporary) files are written in the
+        #       upload directory; this also means that simultaneous downloads of the same
+        #       work (e.g., by reviewer and referee) cannot interfere with each other
         if file_name == 'all-zipped':
             pr_work = 'pr-step{}{}'.format(a.leg.number, a.case.letter)
-            zip_dir = os.path.join(temp_dir, pr_work)
-            os.mkdir(zip_dir)
-            # copy the upladed files to the temporary dir ...
+            members = []
             for pu in pul:
                 real_name = os.path.join(upl_dir, os.path.basename(pu.upload_file.name))
-                # ... under their formal name, not their actual
+                # add the uploaded files under their formal name, not their actual
                 ext = os.path.splitext(pu.upload_file.name)[1].lower()
-                formal_name = os_path(os.path.join(zip_dir, pu.file_name) + ext)
-                if is_instructor:
-                    log_message(
-                        'Copying {} "as is" to ZIP as {}'.format(
-                            real_name,
-                            formal_name
-                            ),
-                        context['user']
-                        )
-                    # NOTE: for instructors, do NOT anonymize the document
-                    copy2(real_name, settings.LEADING_SLASH + formal_name)
-                else:
-                    log_message(
-                        'Copy-cleaning {} to ZIP as {}'.format(
-                            real_name,
-                            formal_name
-                            ),
-                        context['user']
-                        )
-                    # strip author data from file and write it to the "work" dir
-                    clear_metadata(real_name, formal_name)
-            # compress the files into a single zip file
-            zip_file = make_archive(zip_dir,'zip', temp_dir, pr_work)
-            response = HttpResponse(
-                FileWrapper(open(zip_file,'rb')),
+                formal_name = pr_work + '/' + pu.file_name + ext
+                log_message(
+                    '{} {} to ZIP as {}'.format(
+                        'Adding' if is_instructor else 'Cleaning',
+                        real_name,
+                        formal_name
+                        ),
+                    context['user']
+                    )
+                # NOTE: for instructors, do NOT anonymize the document
+                members.append((real_name, formal_name, not is_instructor))
+            # stream the ZIP file while it is being compressed
+            response = StreamingHttpResponse(
+                zip_stream(members),
                 content_type='application/zip'
                 )
             response['Content-Disposition'] = (
@@ -196,28 +176,17 @@ def download(request, **kwargs):
             # the real file name should not be known to the user
             real_name = os.path.join(upl_dir, os.path.basename(pu.upload_file.name))
             ext = os.path.splitext(pu.upload_file.name)[1]
-            # the formal name is the requested file field plus the document's extension
-            formal_name = os_path(os.path.join(temp_dir, pu.file_name) + ext)
             if is_instructor:
-                log_message(
-                    'Copying {} "as is" to temp dir as {}'.format(
-                        real_name,
-                        formal_name
-                        ),
-                    context['user']
-                    )
+                log_message('Sending {} "as is"'.format(real_name), context['user'])
                 # NOTE: for instructors, do NOT anonymize the document
-                copy2(real_name, settings.LEADING_SLASH + formal_name)
+                w = FileWrapper(open(real_name, 'rb'))
             else:
                 # strip author data from the file
-                log_message(
-                    'Copy-cleaning {} to {}'.format(
-                        real_name,
-                        formal_name
-                        ),
-                    context['user']
-                    )
-                clear_metadata(real_name, formal_name)
+                log_message('Sending {} cleaned'.format(real_name), context['user'])
+                data = cleared_data(real_name, ext.lower())
+                if data is None:
+                    raise ValueError('Failed to remove metadata from file')
+                w = [data]
             od = 'application/vnd.openxmlformats-officedocument.'
             mime = {
                 '.pdf': 'application/pdf',
@@ -226,7 +195,6 @@ def download(request, **kwargs):
                 '.xlsx': od + 'spreadsheetml.sheet',
                 '.pptx': od + 'presentationml.presentation'
                 }
-            w = FileWrapper(open(settings.LEADING_SLASH + formal_name, 'rb'))
             response = HttpResponse(w, content_type=mime[ext])
             response['Content-Disposition'] = (
                 'attachment; filename="{}-{}{}{}"'.format(
@@ -262,71 +230,109 @@ def download(request, **kwargs):
         return render(request, 'presto/error.html', context)
 
 
-# auxiliary function: removes language tags from XML files in the ZIP file
-def clean_xml_in_zip(zip_name):
-    # construct a list (name, data) for all XML files in the ZIP
-    xml_list = []
-    xml_names = []
-    zf = ZipFile(zip_name, 'r')
-    zl = zf.infolist()
+class ZipBuffer(object):
+    """
+    Write-only file-like object that buffers what ZipFile writes to it until
+    this data is taken out to be streamed to the browser.
+
+    NOTE: as this buffer cannot seek, ZipFile writes a data descriptor after
+          each member instead of updating its header afterwards.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+    # returns the data written since the previous call, and empties the buffer
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# auxiliary function: yields a ZIP archive in chunks, adding files as they are needed
+# NOTE: members is a list of tuples (real file name, name in ZIP, anonymize)
+def zip_stream(members, chunk_size=1048576):
+    buf = ZipBuffer()
+    with ZipFile(buf, 'w', ZIP_DEFLATED) as zf:
+        for src, arc_name, anonymize in members:
+            if anonymize:
+                data = cleared_data(src)
+                # NOTE: documents that could not be cleaned are omitted
+                if data is not None:
+                    zf.writestr(arc_name, data)
+                    yield buf.take()
+            else:
+                # copy the file in chunks, so that large files are never read as a whole
+                with open(src, 'rb') as f:
+                    with zf.open(arc_name, 'w', force_zip64=True) as zm:
+                        for data in iter(lambda: f.read(chunk_size), b''):
+                            zm.write(data)
+                            yield buf.take()
+                yield buf.take()
+    # finally, yield the central directory that is written when the ZIP file is closed
+    yield buf.take()
+
+
+# auxiliary function: removes language tags from XML files in ZIP data
+def clean_xml_in_zip(data):
     word_re = re.compile(
         r'<w:lang( w:[a-zA-Z]{1,16}="[a-zA-Z\-]{1,10}"){1,5}/>',
         re.UNICODE
         )
     ppt_re = re.compile(r' lang="[a-zA-Z\-]{1,10}"', re.UNICODE)
-    for x in zl:
-        if x.filename[-4:] == '.xml':
-            xml_names.append(x.filename)
-            xml = zf.open(x, 'r').read().decode('utf-8')
-            # MS Word: completely remove tags with language codes
-            xml = word_re.sub('', xml)
-            # MS PowerPoint: strip language attribute from tags with language codes
-            xml = ppt_re.sub('', xml)
-            #  xml_list.append((x.filename, xml.encode('utf-8')))
-            xml_list.append((x.filename, xml))
-    zf.close()
-    # create a temporary file
-    tmp_fd, tmp_name = mkstemp(dir=os.path.dirname(zip_name))
-    os.close(tmp_fd)
-    # create a copy of the archive without XML files
-    with ZipFile(zip_name, 'r') as src_zip:
-        with ZipFile(tmp_name, 'w') as dst_zip:
+    out = BytesIO()
+    # copy the archive member by member, cleaning only the XML files
+    with ZipFile(BytesIO(data), 'r') as src_zip:
+        with ZipFile(out, 'w', ZIP_DEFLATED) as dst_zip:
             dst_zip.comment = src_zip.comment # preserve the comment (if any)
             for item in src_zip.infolist():
-                if not (item.filename in xml_names):
-                    dst_zip.writestr(item, src_zip.read(item.filename))
-    # replace the original with the temporary archive
-    os.remove(zip_name)
-    os.rename(tmp_name, zip_name)
-    # add XML files with their new data
-    with ZipFile(zip_name, mode='a', compression=ZIP_DEFLATED) as zf:
-        for x in xml_list:
-            zf.writestr(x[0], x[1])
+                if item.filename[-4:] == '.xml':
+                    xml = src_zip.read(item).decode('utf-8')
+                    # MS Word: completely remove tags with language codes
+                    xml = word_re.sub('', xml)
+                    # MS PowerPoint: strip language attribute from tags with language codes
+                    xml = ppt_re.sub('', xml)
+                    dst_zip.writestr(item.filename, xml)
+                else:
+                    dst_zip.writestr(item, src_zip.read(item))
+    return out.getvalue()
 
 
-# auxiliary function: reads document src, removes metadata, and writes it to dst
+# auxiliary function: reads document src and returns its data with metadata removed
 # NOTE: works only for .docx, .pptx and .pdf and now also .xlsx
-# NOTE: catches all exceptions; logs them without user name
-def clear_metadata(src, dst):
+# NOTE: catches all exceptions; logs them without user name, and then returns None
+def cleared_data(src, ext=''):
     src = settings.LEADING_SLASH + src
-    dst = settings.LEADING_SLASH + dst
-    ext = os.path.splitext(dst)[1]  # assumed to be in lower case!
+    if not ext:
+        ext = os.path.splitext(src)[1].lower()
     meta_fields= ['author', 'category', 'comments', 'content_status',
                   'identifier', 'keywords', 'last_modified_by',
                   'language', 'subject', 'title', 'version']
     try:
+        out = BytesIO()
         if ext in ['.docx']:
-            f = open(src, 'rb')
-            doc = Document(f)
-            f.close()
+            with open(src, 'rb') as f:
+                doc = Document(f)
             for meta_field in meta_fields:
                 setattr(doc.core_properties, meta_field, '')
             setattr(doc.core_properties, 'created', DEFAULT_DATE)
             setattr(doc.core_properties, 'modified', DEFAULT_DATE)
             setattr(doc.core_properties, 'last_printed', DEFAULT_DATE)
             setattr(doc.core_properties, 'revision', 1)
-            doc.save(dst)
-            clean_xml_in_zip(dst)
+            doc.save(out)
+            return clean_xml_in_zip(out.getvalue())
         elif ext in ['.pptx']:
             prs = Presentation(src)
             for meta_field in meta_fields:
@@ -335,35 +341,33 @@ def clear_metadata(src, dst):
             setattr(prs.core_properties, 'modified', DEFAULT_DATE)
             setattr(prs.core_properties, 'last_printed', DEFAULT_DATE)
             setattr(prs.core_properties, 'revision', 1)
-            prs.save(dst)
-            clean_xml_in_zip(dst)
+            prs.save(out)
+            return clean_xml_in_zip(out.getvalue())
         elif ext == '.pdf':
-            fin = open(src, 'rb')
-            inp = PdfFileReader(fin)
-            outp = PdfFileWriter()
-            for page in range(inp.getNumPages()):
-                outp.addPage(inp.getPage(page))
-            infoDict = outp._info.getObject()
-            infoDict.update({
-                NameObject('/Title'): createStringObject(u''),
-                NameObject('/Author'): createStringObject(u''),
-                NameObject('/Subject'): createStringObject(u''),
-                NameObject('/Creator'): createStringObject(u'')
-            })
-            fout = open(dst, 'wb')
-            outp.write(fout)
-            fin.close()
-            fout.close()
+            with open(src, 'rb') as fin:
+                inp = PdfFileReader(fin)
+                outp = PdfFileWriter()
+                for page in range(inp.getNumPages()):
+                    outp.addPage(inp.getPage(page))
+                infoDict = outp._info.getObject()
+                infoDict.update({
+                    NameObject('/Title'): createStringObject(u''),
+                    NameObject('/Author'): createStringObject(u''),
+                    NameObject('/Subject'): createStringObject(u''),
+                    NameObject('/Creator'): createStringObject(u'')
+                })
+                outp.write(out)
+            return out.getvalue()
         elif ext == '.xlsx':
             file_to_clear = 'docProps/core.xml'
             # create a copy of the Excel file while "cleaning" docProps/core.xml
             with ZipFile(src, 'r') as src_zip:
-                with ZipFile(dst, 'w') as dst_zip:
+                with ZipFile(out, 'w') as dst_zip:
                     dst_zip.comment = src_zip.comment # preserve the comment (if any)
                     for item in src_zip.infolist():
                         if item.filename == file_to_clear:
                             # read the XML tree from the file
-                            xml = src_zip.read(item.filename)
+                            xml = src_zip.read(item.filename).decode('utf-8')
                             xml = re.sub(r'<dc:title>[^<]{1,1000}</dc:title>', '<dc:title></dc:title>', xml)
                             xml = re.sub(r'<dc:subject>[^<]{1,500}</dc:subject>', '<dc:subject></dc:subject>', xml)
                             xml = re.sub(r'<dc:creator>[^<]{1,300}</dc:creator>', '<dc:creator></dc:creator>', xml)
@@ -372,15 +376,17 @@ def clear_metadata(src, dst):
                             xml = re.sub(r'<cp:lastModifiedBy>[^<]{1,300}</cp:lastModifiedBy>', '<cp:lastModifiedBy></cp:lastModifiedBy>', xml)
                             xml = re.sub(r'<cp:category>[^<]{1,300}</cp:category>', '<cp:category></cp:category>', xml)
                             xml = re.sub(r'<cp:contentStatus>[^<]{1,100}</cp:contentStatus>', '<cp:contentStatus></cp:contentStatus>', xml)
-                            xml = re.sub(r'<cp:revision>[^<]{1,10}</cp:revision>', '<cp:revision></cp:revision', xml)
+                            xml = re.sub(r'<cp:revision>[^<]{1,10}</cp:revision>', '<cp:revision></cp:revision>', xml)
                             # replace all date-time fields with the default date
                             xml = re.sub(r':W3CDTF">[^<]{1,25}</dcterms:', ':W3CDTF">2001-01-01T00:00:00Z</dcterms:', xml)
                             dst_zip.writestr(item, xml)
                         else:
                             dst_zip.writestr(item, src_zip.read(item.filename))
+            return out.getvalue()
         else:
             # fall-through: any other file type is simply copied
-            copy2(src, dst)
+            with open(src, 'rb') as f:
+                return f.read()
 
     except Exception as e:
         log_message(
@@ -389,4 +395,5 @@ def clear_metadata(src, dst):
                 str(e)
                 )
             )
-    return
+    # NOTE: documents that could not be cleaned are NOT sent
+    return None
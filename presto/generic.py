@@ -27,21 +27,21 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import MultipleObjectsReturned
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.shortcuts import render
 from django.utils import timezone
 
-from .models import NO_SESSION_KEY, Participant, Role, UserSession
+from .models import DemoAlias, NO_SESSION_KEY, Participant, SESSION_TIMEOUT, UserSession
 
 # python modules
-from datetime import timedelta
 from json import dumps, loads
 from re import match, sub
 import sys
 import traceback
 
 # presto modules
+from presto.cache import all_roles, profile_roles
 from presto.utils import (
     decode,
     encode,
@@ -105,25 +105,16 @@ def generic_context(request, test_code=None):
         user_name = prefixed_user_name(presto_user)
         
         # get current user roles
-        ur_list = user_profile.roles.all().values_list('id', flat=True)
+        user_roles = profile_roles(user_profile)
 
         # ensure that superusers have all roles
-        if presto_user.is_superuser:
-            for r in Role.objects.exclude(id__in=ur_list):
-                user_profile.roles.add(r)
-            user_profile.save()
-
-        # ensure that staff (employees) have instructor and developer roles
-        if presto_user.is_superuser:
-            ur_list = [r.id for r in user_profile.roles.all()]
-            for r in Role.objects.filter(name__in=['Instructor', 'Developer']).exclude(id__in=ur_list):
-                user_profile.roles.add(r)
-            user_profile.save()
-
-        user_roles = user_profile.roles.all()
+        if presto_user.is_superuser and len(user_roles) < len(all_roles()):
+            user_profile.roles.add(*[r for r in all_roles() if r not in user_roles])
+            # NOTE: adding roles makes the cached role list of this user unreachable
+            user_roles = profile_roles(user_profile)
         
-        # CLEANUP: delete all Presto sessions that have been inactive for 24 hours or more
-        UserSession.objects.exclude(last_action__gt=timezone.now() - timedelta(days=1)).delete()
+        # NOTE: expired sessions are deleted by the prune_sessions command, so
+        #       no longer on each page request
 
         # create a session if none exists yet
         # NOTE: In principle, each user can have only ONE session so as to prevent
@@ -151,6 +142,11 @@ def generic_context(request, test_code=None):
                 UserSession.objects.filter(id__in=del_ids).delete()
             except Exception as e:
                 log_message('ERROR: failed to delete session objects -- {}'.format(str(e)))
+        # an expired session that has not been pruned yet is replaced by a new one
+        # (as if it had been deleted on time)
+        if user_session.last_action <= timezone.now() - SESSION_TIMEOUT:
+            user_session.delete()
+            user_session = UserSession.objects.create(user=presto_user, session_key=key)
                 
                      
 
@@ -182,7 +178,7 @@ def generic_context(request, test_code=None):
             
         user_session.last_action = timezone.now()
         if not user_session.active_role:
-            user_session.active_role = user_profile.roles.all().first()
+            user_session.active_role = user_roles[0] if user_roles else None
         user_session.save()
                 
     # create the context dictionary
@@ -251,26 +247,37 @@ def set_focus_and_alias(context, csid, alias, clear_sessions=False):
     if not validate_alias(context, alias):
         return False
     # also warn user if alias is already in use
-    if 'user' in context.keys() and context['user']:
-        u_name = context['user'].username
-    else:
-        u_name = settings.DEMO_USER_NAME
-    usl = UserSession.objects.filter(user__username=u_name)
-    for us in usl:
-        uss = loads(us.state)
-        if 'alias' in uss and uss['alias'] == alias:
-            # remove user "same alias" session records if told to do so 
-            if clear_sessions:
-                us.delete()
-            else:
-                warn_user(context, 'Alias "{}" already in use'.format(alias))
-                return False
+    # NOTE: a single-row lookup, as aliases are registered in the DemoAlias table
+    us = context['user_session']
+    da = DemoAlias.objects.filter(user_id=us.user_id, alias=alias
+        ).select_related('session').first()
+    if da:
+        # NOTE: the alias of an expired session is no longer in use, even when the
+        #       prune_sessions command has not deleted this session yet
+        expired = da.session.last_action <= timezone.now() - SESSION_TIMEOUT
+        # remove user "same alias" session record if told to do so (or if it has expired)
+        if clear_sessions or expired:
+            if da.session_id != us.id:
+                # NOTE: this also deletes the alias record
+                da.session.delete()
+        else:
+            warn_user(context, 'Alias "{}" already in use'.format(alias))
+            return False
+    # register the alias for this session (replacing the one it may already have)
+    try:
+        with transaction.atomic():
+            DemoAlias.objects.update_or_create(session=us,
+                defaults={'user_id': us.user_id, 'course_student_id': csid, 'alias': alias})
+    except IntegrityError:
+        # another session has just taken this alias
+        warn_user(context, 'Alias "{}" already in use'.format(alias))
+        return False
     # update user session state
-    uss = loads(context['user_session'].state)
+    uss = loads(us.state)
     uss['course_student_id'] = csid
     uss['alias'] = alias
-    context['user_session'].state = dumps(uss)
-    context['user_session'].save()
+    us.state = dumps(uss)
+    us.save()
     # also add alias-related entries to context dictionary
     context.update({
         'csid': uss['course_student_id'],
@@ -284,6 +291,7 @@ def set_focus_and_alias(context, csid, alias, clear_sessions=False):
 
 # removes course student ID and alias from user's session state
 def remove_focus_and_alias(context, csid):
+    DemoAlias.objects.filter(session=context['user_session']).delete()
     # update user session state
     uss = loads(context['user_session'].state)
     del uss['course_student_id']
@@ -47,6 +47,7 @@ from .models import (
     )
 
 # presto modules
+from presto.cache import relay_leg_count
 from presto.generic import (
     change_role,
     generic_context,
@@ -127,7 +128,7 @@ def history_view(request, **kwargs):
         # for each participation, create a context entry with properties to be displayed
         for p in pl:
             lang = p.estafette.course.language  # estafettes "speak" the language of their course
-            steps = p.estafette.estafette.template.nr_of_legs()
+            steps = relay_leg_count(p.estafette_id)
             part = {'object': p,
                     'lang': lang,
                     'start': lang.ftime(p.estafette.start_time),
@@ -27,7 +27,7 @@ from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.mail import EmailMessage
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.shortcuts import render
 from django.utils import timezone
 from django.utils.decorators import method_decorator
@@ -42,6 +42,8 @@ from .models import (
     EstafetteTemplate,
     Participant,
     Profile,
+    relay_decision_counts,
+    relay_participant_counts
     )
 
 # python modules
@@ -164,6 +166,9 @@ def instructor(request, **kwargs):
     context['closed_courses'] = []
     c_set = Course.objects.filter(
         Q(instructors=context['user']) | Q(manager=context['user'])).distinct()
+    # NOTE: relay counts for all courses are obtained with one (grouped) query
+    ce_counts = dict(CourseEstafette.objects.filter(course__in=c_set
+        ).values_list('course').order_by().annotate(n=Count('id')))
     for c in c_set:
         # keep running and closed courses separate
         if c.end_date < date.today():
@@ -175,7 +180,7 @@ def instructor(request, **kwargs):
             'start': c.start_date.strftime(DATE_FORMAT),
             'end': c.end_date.strftime(DATE_FORMAT),
             'manager': prefixed_user_name(c.manager),
-            'estafette_count': CourseEstafette.objects.filter(course=c).count(),
+            'estafette_count': ce_counts.get(c.id, 0),
             'hex': encode(c.id, context['user_session'].encoder)
         })
     # also pass closed course count (with plural s)
@@ -183,6 +188,11 @@ def instructor(request, **kwargs):
         context['closed_course_count'] = plural_s(len(context['closed_courses']), 'course')
 
     # create list of estafettes of which the user is creator/editor
+    e_list = list(Estafette.objects.filter(
+        Q(editors=context['user']) | Q(creator=context['user'])
+        ).distinct().select_related('last_editor', 'template'))
+    case_counts = dict(EstafetteCase.objects.filter(estafette__in=e_list
+        ).values_list('estafette').order_by().annotate(n=Count('id')))
     context['estafettes'] = [{
         'object': e,
         'edits': EDIT_STRING.format(
@@ -190,30 +200,30 @@ def instructor(request, **kwargs):
             time=timezone.localtime(e.time_last_edit).strftime(DATE_TIME_FORMAT)
             ),
         'template': e.template.name,
-        'case_count': EstafetteCase.objects.filter(estafette=e).count(),
+        'case_count': case_counts.get(e.id, 0),
         'hex': encode(e.id, context['user_session'].encoder)
-        } for e in Estafette.objects.filter(
-            Q(editors=context['user']) | Q(creator=context['user'])).distinct()
+        } for e in e_list
     ]
 
     # create list of active project relays in which the user is instructor
-    ce_list = []
-    ce_set = CourseEstafette.objects.filter(course__in=c_set, is_deleted=False, start_time__lt=timezone.now())
-    for ce in ce_set:
-        # NOTE: relays remain active until 90 days after their end time IF there still are pending decisions
-        if ce.end_time >= timezone.now() or ce.pending_decisions():
-            ce_list.append({
-                'object': ce,
-                'start_time': c.language.ftime(ce.start_time),
-                'end_time': c.language.ftime(ce.end_time),
-                'next_deadline': ce.next_deadline(),
-                'participant_count': Participant.objects.filter(
-                    estafette=ce, student__dummy_index__gt=-1).count(),
-                'active_count': Participant.objects.filter(estafette=ce, student__dummy_index__gt=-1
-                    ).filter(time_last_action__gte=timezone.now() - timedelta(days=1)).count(),
-                'demo_code': ce.demonstration_code(),
-                'hex': encode(ce.id, context['user_session'].encoder)
-                })
+    # NOTE: counts for all relays are obtained with one (grouped) query per model
+    now = timezone.now()
+    ce_set = list(CourseEstafette.objects.filter(course__in=c_set, is_deleted=False,
+        start_time__lt=now).select_related('course__language', 'estafette'))
+    # relays remain active until 90 days after their end time IF there still are pending decisions
+    ended = [ce.id for ce in ce_set if ce.end_time < now]
+    decisions = relay_decision_counts(ended) if ended else {}
+    ce_set = [ce for ce in ce_set
+        if ce.end_time >= now or ce.pending_decisions(decisions[ce.id])]
+    counts = relay_participant_counts([ce.id for ce in ce_set])
+    ce_list = [dict({
+        'object': ce,
+        'start_time': ce.course.language.ftime(ce.start_time),
+        'end_time': ce.course.language.ftime(ce.end_time),
+        'next_deadline': ce.next_deadline(),
+        'demo_code': ce.demonstration_code(),
+        'hex': encode(ce.id, context['user_session'].encoder)
+        }, **counts[ce.id]) for ce in ce_set]
     context['running_relays'] = ce_list
 
 
@@ -0,0 +1,251 @@
+"""
+Software developed by Pieter W.G. Bots for the PrESTO project
+Code repository: https://github.com/pwgbots/presto
+Project wiki: http://presto.tudelft.nl/wiki
+
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+The daily log files (see utils.log_message) are indexed in a separate SQLite
+database in the log directory. For each log entry, this index holds the
+position of the entry in its log file, plus its date, time, user and level,
+so that log entries can be selected without reading entire log files. If the
+SQLite library supports FTS5 with the trigram tokenizer, entries are also
+indexed for full text (substring) search.
+
+Indexing is incremental: for each log file, the index records up to where the
+file has been indexed, so new entries are added by reading only the "tail" of
+the file. The "index_logs" command does this in the background (and can keep
+doing so with --follow), while the log file view catches up on the log file it
+shows before querying the index.
+"""
+
+from django.conf import settings
+
+# python modules
+import os
+import re
+import sqlite3
+
+INDEX_NAME = 'log-index.sqlite3'
+
+LOG_FILE_RE = re.compile(r'^presto-([0-9]{8})\.log$')
+
+# each log entry starts with date, time, IP address and user name
+ENTRY_RE = re.compile(
+    r'^\d{4}-\d{2}-\d{2}  (\d{2}:\d{2}:\d{2}) \[[^\]]*\] \[([^\]]*)\] (.*)'
+    )
+
+LOG_LEVELS = ['error', 'warning', 'trace', 'info']
+
+# maximum number of log entries per page
+PAGE_SIZE = 500
+# maximum size (in bytes) of a page
+MAX_PAGE_BYTES = 512 * 1024
+# maximum number of entries inspected per page when the index cannot be used for searching
+MAX_SCAN_ENTRIES = 50000
+
+
+# returns the level (error, warning, trace or info) of a log message
+def log_level(msg):
+    m = msg[:12].upper()
+    if m.startswith('ERROR'):
+        return 'error'
+    if m.startswith('WARNING') or m.startswith('[WARNING]'):
+        return 'warning'
+    if m.startswith('TRACE'):
+        return 'trace'
+    return 'info'
+
+
+# returns a connection to the log index database (creating its tables if needed)
+def log_index():
+    db = sqlite3.connect(os.path.join(settings.LOG_DIR, INDEX_NAME), timeout=30)
+    db.execute("""CREATE TABLE IF NOT EXISTS log_files (
+        ymd TEXT PRIMARY KEY, indexed_size INTEGER NOT NULL)""")
+    db.execute("""CREATE TABLE IF NOT EXISTS log_entries (
+        id INTEGER PRIMARY KEY, ymd TEXT NOT NULL, time TEXT NOT NULL,
+        user TEXT NOT NULL, level TEXT NOT NULL,
+        offset INTEGER NOT NULL, length INTEGER NOT NULL, lines INTEGER NOT NULL)""")
+    db.execute("""CREATE INDEX IF NOT EXISTS log_entries_ymd_idx
+        ON log_entries (ymd, id)""")
+    db.execute("""CREATE INDEX IF NOT EXISTS log_entries_user_idx
+        ON log_entries (ymd, user, id)""")
+    db.execute("""CREATE INDEX IF NOT EXISTS log_entries_level_idx
+        ON log_entries (ymd, level, id)""")
+    try:
+        # NOTE: a "contentless" table, as the text is read from the log file itself;
+        #       its row ID is 1000 x entry ID + line number within the entry
+        db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS log_text
+            USING fts5(msg, content='', tokenize='trigram case_sensitive 1')""")
+    except sqlite3.OperationalError:
+        # FTS5 (or its trigram tokenizer) is not available
+        pass
+    db.commit()
+    return db
+
+
+# returns True iff the log index supports full text search
+def has_text_index(db):
+    return bool(db.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'log_text'").fetchone())
+
+
+# adds new entries in log file for date ymd to the index
+def index_log_file(db, ymd):
+    path = os.path.join(settings.LOG_DIR, 'presto-{}.log'.format(ymd))
+    if not os.path.isfile(path):
+        return 0
+    row = db.execute('SELECT indexed_size FROM log_files WHERE ymd = ?', (ymd, )).fetchone()
+    start = row[0] if row else 0
+    if os.path.getsize(path) <= start:
+        return 0
+    fts = has_text_index(db)
+    n = 0
+    # NOTE: an exclusive transaction, so that concurrent indexers do not add entries twice
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # re-read the indexed size, as another indexer may have been busy
+        row = db.execute('SELECT indexed_size FROM log_files WHERE ymd = ?', (ymd, )).fetchone()
+        start = row[0] if row else 0
+        last = db.execute(
+            'SELECT id, offset, lines FROM log_entries WHERE ymd = ? ORDER BY id DESC LIMIT 1',
+            (ymd, )
+            ).fetchone()
+        pos = start
+        with open(path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                # NOTE: a line without newline is still being written, and is indexed later
+                if not line.endswith(b'\n'):
+                    break
+                txt = line.decode('utf-8', 'replace')
+                m = ENTRY_RE.match(txt)
+                if m:
+                    cur = db.execute(
+                        """INSERT INTO log_entries (ymd, time, user, level, offset, length, lines)
+                        VALUES (?, ?, ?, ?, ?, ?, 1)""",
+                        (ymd, m.group(1), m.group(2), log_level(m.group(3)), pos, len(line))
+                        )
+                    last = (cur.lastrowid, pos, 1)
+                    n += 1
+                    # NOTE: the entire line is indexed, so that searches also match the
+                    #       time, IP address and user name, as they do without text index
+                    if fts:
+                        db.execute('INSERT INTO log_text (rowid, msg) VALUES (?, ?)',
+                            (cur.lastrowid * 1000, txt))
+                elif last:
+                    # lines that do not start with a time stamp (e.g., tracebacks)
+                    # are part of the preceding entry
+                    db.execute('UPDATE log_entries SET length = ?, lines = ? WHERE id = ?',
+                        (pos + len(line) - last[1], last[2] + 1, last[0]))
+                    if fts and last[2] < 1000:
+                        db.execute('INSERT INTO log_text (rowid, msg) VALUES (?, ?)',
+                            (last[0] * 1000 + last[2], txt))
+                    last = (last[0], last[1], last[2] + 1)
+                pos += len(line)
+        db.execute('INSERT OR REPLACE INTO log_files (ymd, indexed_size) VALUES (?, ?)',
+            (ymd, pos))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return n
+
+
+# indexes the new entries of all log files, and returns the number of entries added
+def index_logs():
+    db = log_index()
+    n = 0
+    try:
+        for fn in sorted(os.listdir(settings.LOG_DIR)):
+            m = LOG_FILE_RE.match(fn)
+            if m:
+                n += index_log_file(db, m.group(1))
+    finally:
+        db.close()
+    return n
+
+
+# returns tuple (list of log entry texts, cursor of previous page, cursor of next page)
+# for log file of date ymd, filtered by user, level and text pattern
+# NOTE: a cursor is the ID of an entry; after=c selects entries following entry c, and
+#       before=c selects entries preceding entry c; tail=True selects the last entries
+def log_page(ymd, user='', level='', pattern='', after=0, before=0, tail=False,
+        size=PAGE_SIZE):
+    db = log_index()
+    try:
+        index_log_file(db, ymd)
+        size = max(1, min(size, PAGE_SIZE))
+        where = ['e.ymd = ?']
+        params = [ymd]
+        if user:
+            where.append('e.user = ?')
+            params.append(user)
+        if level:
+            where.append('e.level = ?')
+            params.append(level)
+        # use the full text index for patterns of at least 3 characters (trigrams)
+        use_fts = pattern and len(pattern) >= 3 and has_text_index(db)
+        if use_fts:
+            where.append(
+                'e.id IN (SELECT rowid / 1000 FROM log_text WHERE log_text MATCH ?)')
+            params.append('"' + pattern.replace('"', '""') + '"')
+        descending = bool(before) or tail
+        if before:
+            where.append('e.id < ?')
+            params.append(before)
+        elif after:
+            where.append('e.id > ?')
+            params.append(after)
+        # without text index, more entries are inspected than are shown
+        limit = size if use_fts or not pattern else MAX_SCAN_ENTRIES
+        rows = db.execute(
+            'SELECT e.id, e.offset, e.length FROM log_entries e WHERE {} ORDER BY e.id {} LIMIT ?'
+                .format(' AND '.join(where), 'DESC' if descending else 'ASC'),
+            params + [limit]
+            ).fetchall()
+    finally:
+        db.close()
+    # read the entries from the log file
+    entries = []
+    ids = []
+    total = 0
+    path = os.path.join(settings.LOG_DIR, 'presto-{}.log'.format(ymd))
+    with open(path, 'rb') as f:
+        # NOTE: when paging backwards, the entries closest to the cursor are kept
+        for eid, offset, length in rows:
+            f.seek(offset)
+            # NOTE: a single (very long) entry is truncated to the maximum page size
+            txt = f.read(min(length, MAX_PAGE_BYTES)).decode('utf-8', 'replace').rstrip('\n')
+            if pattern and not use_fts and not (pattern in txt):
+                # NOTE: the ID of the last inspected entry becomes the cursor
+                ids.append(eid)
+                continue
+            total += len(txt) + 2
+            if len(entries) >= size or (entries and total > MAX_PAGE_BYTES):
+                break
+            entries.append(txt)
+            ids.append(eid)
+    if descending:
+        entries.reverse()
+        ids.reverse()
+    if not ids:
+        return ([], 0, 0)
+    return (entries, ids[0], ids[-1])
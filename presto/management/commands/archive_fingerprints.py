@@ -0,0 +1,60 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+
+from presto.models import Assignment, DEFAULT_DATE
+from presto.plag_scan import archive_assignment
+
+# python modules
+import time
+
+
+# archives the fingerprints of the uploaded files of scanned assignments (optionally only
+# for the relay with the specified ID), so that later relays of the same template are
+# scanned for matches with these files
+# NOTE: needed once for files that were scanned before the archive existed, as from then
+#       on files are archived when they are scanned
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--relay',
+            type=int,
+            default=0,
+            help='ID of the course relay (default: all relays)'
+            )
+
+    def handle(self, *args, **options):
+        t = time.time()
+        a_list = Assignment.objects.exclude(time_uploaded=DEFAULT_DATE).filter(
+            clone_of__isnull=True
+            ).select_related('case', 'leg', 'participant__estafette')
+        if options['relay']:
+            a_list = a_list.filter(participant__estafette_id=options['relay'])
+        n = 0
+        for a in a_list.iterator():
+            n += archive_assignment(a)
+        print(n, ' files archived ({:4.3f} seconds)'.format(time.time() - t))
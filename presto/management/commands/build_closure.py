@@ -0,0 +1,67 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from presto.models import Assignment, AssignmentAncestor
+
+# python modules
+import time
+
+
+# (re)builds the closure table of the "builds on" relation between assignments
+# NOTE: needed once before settings.ASSIGNMENT_CLOSURE_TABLE is switched on, as from then
+#       on the table is kept up-to-date when assignments are saved or deleted
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='number of records inserted per query (default: 5000)'
+            )
+
+    def handle(self, *args, **options):
+        t = time.time()
+        # the parent of an assignment is its original (for clones) or its predecessor
+        parent = {}
+        for aid, cid, pid in Assignment.objects.values_list('id', 'clone_of_id', 'predecessor_id'):
+            parent[aid] = cid or pid
+        links = []
+        for aid in parent:
+            pid = parent[aid]
+            depth = 1
+            # NOTE: the depth limit guards against cycles
+            while pid and depth <= len(parent):
+                links.append(AssignmentAncestor(descendant_id=aid, ancestor_id=pid, depth=depth))
+                pid = parent.get(pid)
+                depth += 1
+        with transaction.atomic():
+            AssignmentAncestor.objects.all().delete()
+            AssignmentAncestor.objects.bulk_create(links, batch_size=options['batch_size'])
+        print(len(links), ' links for {} assignments ({:4.3f} seconds)'.format(
+            len(parent), time.time() - t))
@@ -0,0 +1,52 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+
+from presto.models import Participant
+
+
+# verify the progress fields of participants, and repair them where they have drifted
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='only report drift, do not repair it'
+            )
+
+    def handle(self, *args, **options):
+        n = 0
+        for p in Participant.objects.all().iterator():
+            drift = p.repair_progress(not options['dry_run'])
+            if drift:
+                n += 1
+                print('{}: {}'.format(str(p), ', '.join(
+                    ['{} {} => {}'.format(k, v[0], v[1]) for k, v in drift.items()])))
+        if options['dry_run']:
+            print(n, ' participants with drifted progress fields')
+        else:
+            print(n, ' participants repaired')
@@ -0,0 +1,78 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+
+from presto.blobstore import disk_usage, short_size
+from presto.models import ParticipantUpload
+from presto.utils import file_digest
+
+# python modules
+import os
+
+
+# move participant uploads that were stored before the blob store existed into this store,
+# so that files having the same content are stored only once, and report the space saved
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='only report the space that would be saved'
+            )
+
+    def handle(self, *args, **options):
+        dry = options['dry_run']
+        n = 0
+        missing = 0
+        saved = 0
+        seen = set()
+        # blobs of the files that have been deduplicated
+        # NOTE: several uploads may refer to the same file
+        path_blobs = {}
+        for pu in ParticipantUpload.objects.filter(blob__isnull=True).iterator():
+            f = pu.upload_file
+            if not os.path.isfile(f.path):
+                missing += 1
+                continue
+            n += 1
+            if f.path not in path_blobs:
+                if dry:
+                    sha, size = file_digest(f.path)
+                    if sha in seen:
+                        saved += size
+                    seen.add(sha)
+                    path_blobs[f.path] = None
+                else:
+                    saved += f.storage.adopt(f.name)
+                    path_blobs[f.path] = f.storage.blob(f.name)
+            if not dry:
+                ParticipantUpload.objects.filter(pk=pu.pk).update(blob=path_blobs[f.path])
+        print('{} uploads {}'.format(n, 'to deduplicate' if dry else 'deduplicated'))
+        if missing:
+            print('{} uploads without file'.format(missing))
+        print('{} saved{}'.format(short_size(saved), ' (estimate)' if dry else ''))
+        print('{} now stored in blobs'.format(disk_usage()))
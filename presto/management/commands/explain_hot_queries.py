@@ -0,0 +1,153 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from presto.models import (
+    Assignment,
+    DEFAULT_DATE,
+    DemoAlias,
+    PeerReview,
+    UploadFingerprint,
+    UserDownload,
+    UserSession
+    )
+
+# python modules
+from datetime import timedelta
+import re
+
+# full scans of these (large) tables are not acceptable
+# NOTE: small tables such as those for legs and cases may be scanned
+LARGE_TABLES = [
+    'presto_assignment',
+    'presto_peerreview',
+    'presto_uploadfingerprint',
+    'presto_userdownload',
+    'presto_usersession'
+    ]
+
+
+# returns list of tuples (description, query set) with the query shapes that are executed
+# most frequently; the values used in the filters are arbitrary
+def hot_queries():
+    now = timezone.now()
+    return [
+        ('student.py: eligible predecessors', Assignment.objects.filter(
+            participant__estafette__id=1, leg__number=2, is_rejected=False,
+            is_retired=False, clone_of__isnull=True, time_uploaded__gt=DEFAULT_DATE
+            )),
+        ('student.py: work for final review', Assignment.objects.filter(
+            participant__estafette__id=1, leg__id=1, time_uploaded__gt=DEFAULT_DATE
+            ).exclude(participant__id=1)),
+        ('student.py: submitted final reviews', PeerReview.objects.filter(
+            reviewer__id=1, assignment__leg__id=1, time_submitted__gt=DEFAULT_DATE
+            )),
+        ('teams.py: team assignments', Assignment.objects.filter(
+            participant__id=1, is_rejected=False, is_retired=False, clone_of__isnull=True
+            )),
+        ('teams.py: team reviews', PeerReview.objects.filter(
+            reviewer__id=1, final_review_index__gt=0
+            )),
+        ('teams.py: team downloads', UserDownload.objects.filter(
+            user__id=1, assignment__id__in=[1, 2]
+            )),
+        ('teams.py: first reviews', PeerReview.objects.filter(
+            assignment__id__in=[1, 2]
+            ).order_by('id')),
+        ('course_estafette.py: relay assignments', Assignment.objects.filter(
+            participant__in=[1, 2]
+            ).order_by('time_assigned')),
+        ('course_estafette.py: relay reviews', PeerReview.objects.filter(
+            reviewer__in=[1, 2]
+            )),
+        ('plag_scan.py: related assignments', Assignment.objects.filter(
+            participant__id=1, case__letter='A', time_uploaded__lte=now
+            )),
+        ('plag_scan.py: unscanned assignments', Assignment.objects.exclude(
+            time_uploaded__lte=DEFAULT_DATE
+            ).filter(time_scanned__lte=DEFAULT_DATE, clone_of=None)),
+        ('plag_scan.py: archived files sharing fingerprints', UploadFingerprint.objects.filter(
+            template_id=1,
+            value__in=UploadFingerprint.objects.filter(upload_id=1).values('value'),
+            upload__time_uploaded__lt=now
+            ).exclude(estafette_id=1).values('upload_id').annotate(n=Count('id')).filter(
+            n__gte=5
+            ).order_by('-n')),
+        ('generic.py: user session', UserSession.objects.filter(
+            user__id=1, session_key=''
+            )),
+        ('generic.py: demo alias', DemoAlias.objects.filter(
+            user__id=1, alias='Alias'
+            )),
+        ('prune_sessions: expired sessions', UserSession.objects.filter(
+            last_action__lte=now - timedelta(days=1)
+            )),
+        ]
+
+
+# returns tuple (query plan as text, list of large tables that are fully scanned)
+def explain(qs):
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            # NOTE: the plan detail is the last column, e.g., "SCAN presto_assignment"
+            #       or "SEARCH presto_assignment USING INDEX a_leg_upl_idx (leg_id=?)"
+            lines = [row[-1] for row in cursor.fetchall()]
+            scans = [m.group(1) for m in
+                [re.match(r'SCAN (?:TABLE )?(\w+)(?: AS \w+)?$', l) for l in lines] if m]
+        elif connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            cols = [c[0] for c in cursor.description]
+            rows = [dict(zip(cols, row)) for row in cursor.fetchall()]
+            lines = ['{} {} {}'.format(r['table'], r['type'], r['key']) for r in rows]
+            # NOTE: access type ALL denotes a full table scan
+            scans = [r['table'] for r in rows if r['type'] == 'ALL']
+        else:
+            raise CommandError('Unsupported database: ' + connection.vendor)
+    return ('\n'.join(lines), [t for t in scans if t in LARGE_TABLES])
+
+
+# runs EXPLAIN on the most frequent query shapes, and fails if a large table is fully scanned
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        failed = []
+        for d, qs in hot_queries():
+            plan, scans = explain(qs)
+            print('{}{}\n    {}'.format(
+                d,
+                ' -- FULL SCAN OF ' + ', '.join(scans) if scans else '',
+                plan.replace('\n', '\n    ')
+                ))
+            if scans:
+                failed.append(d)
+        if failed:
+            raise CommandError('Full table scan in: ' + '; '.join(failed))
+        print('No full table scans')
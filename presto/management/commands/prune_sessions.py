@@ -0,0 +1,87 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from presto.models import SESSION_TIMEOUT, UserSession
+
+# python modules
+from datetime import timedelta
+import time
+
+
+# delete user sessions that have expired, in small batches so that the table is never
+# locked for long; meant to be scheduled (e.g., hourly with cron)
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=int(SESSION_TIMEOUT.total_seconds() // 3600),
+            help='delete sessions inactive for this many hours (default: {})'.format(
+                int(SESSION_TIMEOUT.total_seconds() // 3600))
+            )
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=0,
+            help='also delete sessions created more than this many days ago (default: 0 = never)'
+            )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='number of sessions deleted per transaction (default: 1000)'
+            )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='only report how many sessions would be deleted'
+            )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # NOTE: both fields are indexed, so selecting expired sessions does not scan the table
+        qs = UserSession.objects.filter(last_action__lte=now - timedelta(hours=options['hours']))
+        if options['max_age'] > 0:
+            qs = qs | UserSession.objects.filter(
+                start_time__lte=now - timedelta(days=options['max_age']))
+        if options['dry_run']:
+            print(qs.count(), ' sessions would be deleted')
+            return
+        t = time.time()
+        n = 0
+        size = max(1, options['batch_size'])
+        while True:
+            # NOTE: deleted sessions no longer match, so each batch is a fresh index lookup
+            ids = list(qs.values_list('id', flat=True)[:size])
+            if not ids:
+                break
+            # NOTE: deleting a session also deletes its demo alias (if any)
+            UserSession.objects.filter(id__in=ids).delete()
+            n += len(ids)
+        print(n, ' sessions deleted in {:.2f} seconds'.format(time.time() - t))
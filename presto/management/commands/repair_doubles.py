@@ -0,0 +1,96 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from presto.models import Assignment, ParticipantUpload
+
+
+# resolves duplicate assignments (same participant and step) that were created by racing
+# "proceed" actions before the unique constraint on active assignments existed: of each
+# set of doubles, the one that has been built on (else the one having uploads, else the
+# first) is kept; the others are deleted if they have no uploads and have not been built
+# on, and otherwise "retired", so that no work is lost
+# NOTE: this used to be done by a "watchdog" after each scan (see views.scan)
+# NOTE: migration 0007 retires all doubles, so after migrating this command should find
+#       doubles only in databases restored from an earlier backup
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='only list the duplicate assignments'
+            )
+
+    def handle(self, *args, **options):
+        doubles = Assignment.objects.filter(is_rejected=False, is_retired=False,
+            clone_of__isnull=True).values('participant__id', 'leg__id'
+            ).annotate(same_leg_cnt=Count('id')
+            ).order_by().filter(same_leg_cnt__gt=1)
+        retired = 0
+        for d in doubles:
+            a_set = list(Assignment.objects.filter(participant__id=d['participant__id'],
+                leg__id=d['leg__id'], is_rejected=False, is_retired=False,
+                clone_of__isnull=True))
+            uploaded = set(ParticipantUpload.objects.filter(assignment__in=a_set
+                ).values_list('assignment_id', flat=True))
+            a_set.sort(key=lambda a: (a.successor_id is None, a.id not in uploaded, a.id))
+            b = a_set[0]
+            print('Relay {}: assignment {} is duplicated'.format(
+                b.participant.estafette.title_text(), b))
+            for a in a_set[1:]:
+                print('-- duplicate: {}'.format(a))
+                if options['dry_run']:
+                    continue
+                deleted = False
+                # NOTE: uploads would CASCADE delete, and successors would lose their predecessor
+                if a.id not in uploaded and not a.successor_id:
+                    try:
+                        with transaction.atomic():
+                            # NOTE: deleting the duplicate sets its predecessor's successor to NULL
+                            a.delete()
+                        print('-- duplicate now deleted')
+                        deleted = True
+                    except Exception as e:
+                        # signal that assignment ID is a foreign key of some other record
+                        print('-- NOT deleted ({})'.format(str(e)))
+                if not deleted:
+                    a.is_retired = True
+                    a.save()
+                    print('-- duplicate retired')
+                    retired += 1
+                # restore the predecessor's successor field
+                if b.predecessor:
+                    b.predecessor.refresh_from_db()
+                    if not b.predecessor.successor:
+                        b.predecessor.successor = b
+                        b.predecessor.save()
+                        print('-- predecessor-successor restored')
+        print(len(doubles), ' duplicated assignments')
+        if retired:
+            print(retired, ' duplicates retired')
@@ -0,0 +1,188 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from presto.models import (
+    Assignment,
+    CourseEstafette,
+    DEFAULT_DATE,
+    ParticipantUpload
+    )
+from presto.plag_scan import (
+    ascii_from_doc,
+    matching_blocks,
+    MATCH_THRESHOLD,
+    open_corpus,
+    scan_assignment,
+    upload_path,
+    write_corpus
+    )
+
+# python modules
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+import multiprocessing
+import os
+import tempfile
+import time
+
+# extensions of the files that are scanned (see plag_scan.scan_assignment)
+SCANNED_EXTENSIONS = ['.docx', '.pdf', '.pptx', '.xlsx']
+
+# number of (randomly chosen) files and comparisons timed for the cost estimate
+SAMPLE_SIZE = 5
+
+
+# returns a process pool
+# NOTE: the worker processes are forked, so that they inherit the Django setup; database
+#       connections are closed first, as a forked process must open connections of its own
+def process_pool(workers, **kwargs):
+    connections.close_all()
+    return ProcessPoolExecutor(max_workers=workers,
+        mp_context=multiprocessing.get_context('fork'), **kwargs)
+
+
+# scans all unscanned assignments of a relay, using several processes that share a corpus
+# of the texts extracted from the relay's uploads
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('relay', type=int, help='ID of the course relay')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='number of worker processes (default: number of CPUs)'
+            )
+        parser.add_argument(
+            '--since',
+            type=lambda s: datetime.strptime(s, '%Y-%m-%d'),
+            help='scan only assignments uploaded on or after this date (YYYY-MM-DD)'
+            )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='only estimate the number of comparisons and the time needed'
+            )
+
+    def handle(self, *args, **options):
+        t = time.time()
+        ce = CourseEstafette.objects.filter(pk=options['relay']).first()
+        if not ce:
+            raise CommandError('Unknown relay #{}'.format(options['relay']))
+        workers = max(1, options['workers'])
+        # all uploaded work of the relay (as this work may be compared)
+        assignments = {}
+        for aid, cid, nr, tu, ts in Assignment.objects.filter(
+                participant__estafette=ce, clone_of__isnull=True
+                ).exclude(time_uploaded=DEFAULT_DATE
+                ).values_list('id', 'case_id', 'leg__number', 'time_uploaded', 'time_scanned'):
+            assignments[aid] = (cid, nr, tu, ts)
+        to_scan = [aid for aid in assignments if assignments[aid][3] <= DEFAULT_DATE and (
+            not options['since'] or assignments[aid][2].date() >= options['since'].date())]
+        to_scan.sort(key=lambda aid: assignments[aid][2])
+        uploads = [(aid, fn, upload_path(uf))
+            for aid, fn, uf in ParticipantUpload.objects.filter(
+                assignment__participant__estafette=ce
+                ).values_list('assignment_id', 'file_name', 'upload_file')
+            if os.path.splitext(uf)[1].lower() in SCANNED_EXTENSIONS]
+        print('Relay {}: {} assignments to scan; {} files to extract'.format(
+            ce.title_text(), len(to_scan), len(uploads)))
+        if not to_scan:
+            return
+        if options['dry_run']:
+            self.estimate(assignments, to_scan, uploads, workers)
+            return
+        fd, corpus_path = tempfile.mkstemp(prefix='presto-corpus-', suffix='.txt')
+        os.close(fd)
+        try:
+            # extract the texts in parallel, and write them to the corpus file
+            paths = sorted(set(p for aid, fn, p in uploads))
+            with process_pool(workers) as pool:
+                texts = list(zip(paths, pool.map(ascii_from_doc, paths, chunksize=8)))
+            index = write_corpus(corpus_path, texts)
+            print('Corpus of {} bytes written ({:4.3f} seconds)'.format(
+                os.path.getsize(corpus_path), time.time() - t))
+            # scan the assignments in parallel, without time limit per assignment
+            # NOTE: each scan saves its own result (see plag_scan.scan_assignment)
+            n = 0
+            errors = 0
+            with process_pool(workers, initializer=open_corpus,
+                    initargs=(corpus_path, index)) as pool:
+                scan = partial(scan_assignment, max_seconds=None)
+                futures = {pool.submit(scan, aid): aid for aid in to_scan}
+                for f in as_completed(futures):
+                    n += 1
+                    try:
+                        perc = f.result()[0]
+                        print('{}/{}: #{} scanned ({}%)'.format(
+                            n, len(to_scan), futures[f], perc))
+                    except Exception as e:
+                        errors += 1
+                        print('{}/{}: ERROR while scanning #{}: {}'.format(
+                            n, len(to_scan), futures[f], str(e)))
+        finally:
+            os.remove(corpus_path)
+        print('{} assignments scanned with {} workers; {} errors ({:4.3f} seconds)'.format(
+            len(to_scan), workers, errors, time.time() - t))
+
+    # prints the number of comparisons, and the time needed as estimated from a sample
+    def estimate(self, assignments, to_scan, uploads, workers):
+        # each file of an assignment is compared with the files having the same name
+        # uploaded earlier for the same case and step or an earlier step
+        files = {}
+        for aid, fn, p in uploads:
+            files.setdefault(aid, []).append((fn, p))
+        pairs = []
+        for aid in to_scan:
+            cid, nr, tu, ts = assignments[aid]
+            for fn, p in files.get(aid, []):
+                for oid in files:
+                    o = assignments.get(oid)
+                    if o and o[0] == cid and o[1] <= nr and o[2] < tu:
+                        pairs += [(p, op) for ofn, op in files[oid] if ofn == fn]
+        print('{} comparisons'.format(len(pairs)))
+        if not pairs:
+            return
+        # time the extraction of texts and their comparison for a sample
+        step = max(1, len(pairs) // SAMPLE_SIZE)
+        sample = pairs[::step][:SAMPLE_SIZE]
+        t = time.time()
+        texts = {p: ascii_from_doc(p) for pair in sample for p in pair}
+        t_extract = (time.time() - t) / len(texts)
+        t = time.time()
+        for p1, p2 in sample:
+            matching_blocks(texts[p1], texts[p2], MATCH_THRESHOLD)
+        t_compare = (time.time() - t) / len(sample)
+        n_files = len(set(p for aid, fn, p in uploads))
+        print('Estimated: {:4.3f} s per extraction, {:4.3f} s per comparison'.format(
+            t_extract, t_compare))
+        # NOTE: workers run in parallel only as far as there are CPUs
+        print('Estimated time with {} workers: {:4.0f} seconds'.format(
+            workers, (n_files * t_extract + len(pairs) * t_compare)
+                / min(workers, os.cpu_count() or 1)))
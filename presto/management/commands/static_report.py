@@ -0,0 +1,128 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import get_template
+
+from presto.blobstore import short_size
+
+# python modules
+import os
+import posixpath
+import re
+
+TEMPLATE_REF_RE = re.compile(r'''{%\s*(?:extends|include)\s+["']([^"']+)["']''')
+STATIC_REF_RE = re.compile(r'''{%\s*static\s+["']([^"']+)["']\s*%}''')
+CSS_URL_RE = re.compile(r'''url\(\s*["']?([^"')?#]+)''')
+
+# when a style sheet offers a font in several formats, browsers load only one of them
+FONT_PREFERENCE = ['.woff2', '.woff', '.ttf', '.eot', '.svg']
+
+
+# returns the set of names of static files referred to (literally) by the named template,
+# including the templates it extends or includes
+def template_static_files(name, seen=None):
+    seen = seen if seen is not None else set()
+    if name in seen:
+        return set()
+    seen.add(name)
+    with open(get_template(name).origin.name, encoding='utf-8') as f:
+        source = f.read()
+    names = set(STATIC_REF_RE.findall(source))
+    for t in TEMPLATE_REF_RE.findall(source):
+        # NOTE: template names can be relative (e.g., "./base.html")
+        if t.startswith('.'):
+            t = posixpath.normpath(posixpath.join(posixpath.dirname(name), t))
+        names |= template_static_files(t, seen)
+    return names
+
+
+# returns the set of names of static files that the style sheet (static file) name refers to
+def css_static_files(name, path):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        urls = CSS_URL_RE.findall(f.read())
+    fonts = {}
+    names = set()
+    for url in urls:
+        if url.startswith('data:') or '://' in url or url.startswith('/'):
+            continue
+        n = posixpath.normpath(posixpath.join(posixpath.dirname(name), url))
+        base, ext = posixpath.splitext(n)
+        if ext.lower() in FONT_PREFERENCE:
+            fonts.setdefault(base, set()).add(ext.lower())
+        else:
+            names.add(n)
+    for base, exts in fonts.items():
+        names.add(base + next(e for e in FONT_PREFERENCE if e in exts))
+    return names
+
+
+# returns the size of the file at path, or 0 if it does not exist
+def file_size(path):
+    return os.path.getsize(path) if path and os.path.isfile(path) else 0
+
+
+# compares the size of the static files that a page needs as plain files (source) with
+# their size when sent from STATIC_ROOT (hashed, optimized and precompressed)
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'template',
+            nargs='?',
+            default='presto/student.html',
+            help='the page template (default: presto/student.html)'
+            )
+
+    def handle(self, *args, **options):
+        if not os.path.isfile(os.path.join(settings.STATIC_ROOT, 'staticfiles.json')):
+            raise CommandError('No manifest in STATIC_ROOT -- run "manage.py collectstatic" first')
+        names = template_static_files(options['template'])
+        for n in list(names):
+            if n.endswith('.css'):
+                names |= css_static_files(n, finders.find(n))
+        totals = [0, 0, 0]
+        rows = []
+        for n in sorted(names):
+            source = finders.find(n)
+            if not source:
+                print('Not found: ' + n)
+                continue
+            hashed = staticfiles_storage.path(staticfiles_storage.stored_name(n))
+            size = file_size(hashed)
+            gz = file_size(hashed + '.gz') or size
+            br = file_size(hashed + '.br') or gz
+            row = [file_size(source), gz, br]
+            rows.append((n, row))
+            totals = [t + s for t, s in zip(totals, row)]
+        print('{:<60} {:>8} {:>8} {:>8}'.format('File', 'Plain', 'Gzip', 'Brotli'))
+        for n, row in rows + [('TOTAL ({} files)'.format(len(rows)), totals)]:
+            print('{:<60} {:>8} {:>8} {:>8}'.format(n[-60:], *[short_size(s) for s in row]))
+        if totals[0]:
+            print('Transfer size reduced by {:.1f}% (gzip) and {:.1f}% (brotli)'.format(
+                100.0 * (1 - totals[1] / totals[0]), 100.0 * (1 - totals[2] / totals[0])))
@@ -0,0 +1,141 @@
+# Software developed by Pieter W.G. Bots for the PrESTO project
+# Code repository: https://github.com/pwgbots/presto
+# Project wiki: http://presto.tudelft.nl/wiki
+
+"""
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from presto.models import ParticipantUpload, SHORT_DATE_TIME, TellTale
+from presto.plag_scan import record_telltales, related_assignment_ids
+
+# python modules
+import time
+
+
+# lists the "tell-tales" (images, creation times and workbook structure of DOCX, PPTX and
+# XLSX files) that are shared
+# by uploads of different participants, in all relays of all years
+# NOTE: tell-tales shared only with related work (e.g., the predecessor's document that
+#       a participant has extended) are omitted, unless --all is specified
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--relay',
+            type=int,
+            default=0,
+            help='list only tell-tales shared by an upload in the relay with this ID'
+            )
+        parser.add_argument(
+            '--kind',
+            choices=['image', 'created', 'layout', 'formulas'],
+            help='list only tell-tales of this kind'
+            )
+        parser.add_argument(
+            '--max-participants',
+            type=int,
+            default=10,
+            help='omit tell-tales shared by more participants, as these typically are'
+                ' provided material such as logos (default: 10)'
+            )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='also list tell-tales shared only with related work'
+            )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='first record the tell-tales of uploads for which none have been recorded,'
+                ' and the structure of workbooks that have not been scanned yet'
+            )
+
+    def handle(self, *args, **options):
+        t = time.time()
+        if options['rebuild']:
+            n = 0
+            # NOTE: the structure of a workbook is recorded when it is scanned (or by this
+            #       command), so workbooks without "layout" tell-tales are read once more
+            #       (which is also the case for workbooks too small to have a layout)
+            pul = ParticipantUpload.objects.filter(
+                upload_file__iregex=r'\.(docx|pptx|xlsx)$').exclude(
+                Exists(TellTale.objects.filter(upload=OuterRef('pk'))),
+                ~Q(upload_file__iendswith='.xlsx')
+                    | Exists(TellTale.objects.filter(upload=OuterRef('pk'), kind='layout'))
+                )
+            for pu in pul.iterator():
+                record_telltales(pu, with_layout=True)
+                n += 1
+            print(n, ' uploads scanned for tell-tales ({:4.3f} seconds)'.format(time.time() - t))
+        # tell-tales shared by different participants
+        shared = TellTale.objects.values('kind', 'value').annotate(
+            n=Count('assignment__participant', distinct=True)
+            ).order_by().filter(n__gt=1, n__lte=options['max_participants'])
+        if options['kind']:
+            shared = shared.filter(kind=options['kind'])
+        if options['relay']:
+            shared = shared.annotate(in_relay=Count('id',
+                filter=Q(assignment__participant__estafette_id=options['relay']))
+                ).filter(in_relay__gt=0)
+        shared = {(s['kind'], s['value']): s['n'] for s in shared}
+        if not shared:
+            print('No shared tell-tales')
+            return
+        # get the uploads having these tell-tales
+        groups = {}
+        for tt in TellTale.objects.filter(
+                kind__in=set(k for k, v in shared), value__in=set(v for k, v in shared)
+                ).select_related('assignment__participant__student',
+                    'assignment__participant__estafette__course', 'assignment__case',
+                    'assignment__leg', 'upload'
+                ).order_by('upload__time_uploaded'):
+            key = (tt.kind, tt.value)
+            if key in shared:
+                groups.setdefault(key, []).append(tt)
+        listed = 0
+        for key in sorted(groups):
+            tts = groups[key]
+            # work related to the first upload is legitimately shared
+            related = set(related_assignment_ids(tts[0].assignment))
+            related.add(tts[0].assignment_id)
+            unrelated = [tt for tt in tts
+                if tt.assignment.participant_id != tts[0].assignment.participant_id
+                and tt.assignment_id not in related]
+            if not (unrelated or options['all']):
+                continue
+            listed += 1
+            print('{} {} shared by {} participants'.format(key[0], key[1], shared[key]))
+            for tt in tts:
+                a = tt.assignment
+                print('    {} step {}{} by {} as {} ({}){}'.format(
+                    a.participant.estafette.title_text(),
+                    a.case.letter,
+                    a.leg.number,
+                    a.participant.student.dummy_name(),
+                    tt.upload.file_name,
+                    timezone.localtime(tt.upload.time_uploaded).strftime(SHORT_DATE_TIME),
+                    ' RELATED' if a.id in related and tt != tts[0] else ''
+                    ))
+        print('{} shared tell-tales ({:4.3f} seconds)'.format(listed, time.time() - t))
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.3 on 2026-10-19 09:12
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_legs(apps, schema_editor):
+    EstafetteTemplate = apps.get_model('presto', 'EstafetteTemplate')
+    for et in EstafetteTemplate.objects.annotate(n=Count('estafetteleg')):
+        EstafetteTemplate.objects.filter(pk=et.pk).update(leg_count=et.n)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estafettetemplate',
+            name='leg_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_legs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.3 on 2026-10-19 10:05
+
+import datetime
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+DEFAULT_DATE = datetime.datetime(2000, 12, 31, 23, 0, tzinfo=datetime.timezone.utc)
+
+
+def count_progress(apps, schema_editor):
+    Participant = apps.get_model('presto', 'Participant')
+    Assignment = apps.get_model('presto', 'Assignment')
+    PeerReview = apps.get_model('presto', 'PeerReview')
+    # leg number of the last assignment of each participant
+    steps = {}
+    for pid, n in Assignment.objects.order_by('id').values_list('participant_id', 'leg__number'):
+        steps[pid] = n
+    times = {}
+    for d in Assignment.objects.values('participant_id').annotate(
+            ta=Max('time_assigned'), tu=Max('time_uploaded')):
+        times[d['participant_id']] = max(d['ta'], d['tu'])
+    reviews = {}
+    for d in PeerReview.objects.values('reviewer_id').annotate(
+            n=Count('id'), ts=Max('time_submitted')):
+        reviews[d['reviewer_id']] = d['n']
+        times[d['reviewer_id']] = max(times.get(d['reviewer_id'], DEFAULT_DATE), d['ts'])
+    for pid in set(steps) | set(reviews):
+        Participant.objects.filter(pk=pid).update(
+            step_count=steps.get(pid, 0),
+            review_count=reviews.get(pid, 0),
+            last_progress_at=times.get(pid, DEFAULT_DATE)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0002_estafettetemplate_leg_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='last_progress_at',
+            field=models.DateTimeField(default=datetime.datetime(2000, 12, 31, 23, 0, tzinfo=datetime.timezone.utc)),
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='review_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='step_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_progress, migrations.RunPython.noop),
+    ]
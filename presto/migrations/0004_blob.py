@@ -0,0 +1,37 @@
+# Generated by Django 4.1.3 on 2026-10-19 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import presto.blobstore
+import presto.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0003_participant_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('time_created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='participantupload',
+            name='upload_file',
+            field=models.FileField(storage=presto.blobstore.blob_storage, upload_to=presto.models.participant_dir),
+        ),
+        migrations.AddField(
+            model_name='participantupload',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='presto.blob'),
+        ),
+    ]
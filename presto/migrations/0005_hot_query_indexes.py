@@ -0,0 +1,45 @@
+# Generated by Django 4.1.3 on 2026-10-19 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0004_blob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['participant', 'leg', 'case', 'time_uploaded'], name='a_part_leg_case_upl_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['leg', 'time_uploaded'], name='a_leg_upl_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['time_scanned', 'time_uploaded'], name='a_scan_upl_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='peerreview',
+            index=models.Index(fields=['reviewer', 'assignment', 'time_submitted'], name='pr_rev_assign_sub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='peerreview',
+            index=models.Index(fields=['assignment', 'time_submitted'], name='pr_assign_sub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userdownload',
+            index=models.Index(fields=['user', 'assignment'], name='ud_user_assignment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['user', 'session_key'], name='us_user_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['last_action'], name='us_last_action_idx'),
+        ),
+    ]
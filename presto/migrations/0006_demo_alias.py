@@ -0,0 +1,67 @@
+# Generated by Django 4.1.3 on 2026-10-19 10:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from json import loads
+
+
+def register_aliases(apps, schema_editor):
+    UserSession = apps.get_model('presto', 'UserSession')
+    DemoAlias = apps.get_model('presto', 'DemoAlias')
+    CourseStudent = apps.get_model('presto', 'CourseStudent')
+    taken = set()
+    for us in UserSession.objects.filter(state__contains='"alias"').order_by('-last_action'):
+        try:
+            uss = loads(us.state)
+            key = (us.user_id, uss['alias'])
+            csid = int(uss['course_student_id'])
+        except (ValueError, KeyError, TypeError):
+            continue
+        # NOTE: if sessions share an alias, the most recently active one keeps it
+        if key not in taken and CourseStudent.objects.filter(pk=csid).exists():
+            taken.add(key)
+            DemoAlias.objects.create(user_id=us.user_id, session_id=us.id,
+                course_student_id=csid, alias=uss['alias'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('presto', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemoAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=32)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['start_time'], name='us_start_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='demoalias',
+            name='course_student',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='presto.coursestudent'),
+        ),
+        migrations.AddField(
+            model_name='demoalias',
+            name='session',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='presto.usersession'),
+        ),
+        migrations.AddField(
+            model_name='demoalias',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='demoalias',
+            unique_together={('user', 'alias')},
+        ),
+        migrations.RunPython(register_aliases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.1.3 on 2026-10-19 11:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# duplicate assignments (same participant and step) created by racing "proceed" actions
+# before this constraint existed are retired (all but one of each set), so that
+# no uploaded work is lost (see the repair_doubles command for details)
+def retire_doubles(apps, schema_editor):
+    Assignment = apps.get_model('presto', 'Assignment')
+    ParticipantUpload = apps.get_model('presto', 'ParticipantUpload')
+    doubles = Assignment.objects.filter(clone_of__isnull=True, is_rejected=False,
+        is_retired=False).values('participant_id', 'leg_id').annotate(n=Count('id')
+        ).order_by().filter(n__gt=1)
+    for d in doubles:
+        a_set = list(Assignment.objects.filter(participant_id=d['participant_id'],
+            leg_id=d['leg_id'], clone_of__isnull=True, is_rejected=False, is_retired=False))
+        uploaded = set(ParticipantUpload.objects.filter(assignment__in=a_set
+            ).values_list('assignment_id', flat=True))
+        # keep the one that has been built on, else the one having uploads, else the first
+        a_set.sort(key=lambda a: (a.successor_id is None, a.id not in uploaded, a.id))
+        Assignment.objects.filter(id__in=[a.id for a in a_set[1:]]).update(is_retired=True)
+
+
+# MySQL does not support conditional unique indexes, so there the constraint
+# is a unique index on a generated column that is NULL for clones and rejected or
+# retired assignments (and NULL values are distinct in a unique index)
+def add_mysql_key(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            """ALTER TABLE presto_assignment
+            ADD COLUMN active_leg_key TINYINT GENERATED ALWAYS AS
+                (IF(clone_of_id IS NULL AND is_rejected = 0 AND is_retired = 0, 1, NULL)) VIRTUAL,
+            ADD UNIQUE INDEX a_active_leg_uniq (participant_id, leg_id, active_leg_key)""")
+
+
+def drop_mysql_key(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            """ALTER TABLE presto_assignment
+            DROP INDEX a_active_leg_uniq,
+            DROP COLUMN active_leg_key""")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0006_demo_alias'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='is_retired',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(retire_doubles, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='assignment',
+            constraint=models.UniqueConstraint(condition=models.Q(('clone_of__isnull', True), ('is_rejected', False), ('is_retired', False)), fields=('participant', 'leg'), name='a_active_leg_uniq'),
+        ),
+        migrations.RunPython(add_mysql_key, drop_mysql_key),
+    ]
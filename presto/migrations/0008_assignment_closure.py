@@ -0,0 +1,31 @@
+# Generated by Django 4.1.3 on 2026-10-19 12:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0007_active_assignment_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssignmentAncestor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.IntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='presto.assignment')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='presto.assignment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='assignmentancestor',
+            index=models.Index(fields=['ancestor', 'descendant'], name='aa_anc_desc_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='assignmentancestor',
+            unique_together={('descendant', 'ancestor')},
+        ),
+    ]
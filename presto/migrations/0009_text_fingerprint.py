@@ -0,0 +1,28 @@
+# Generated by Django 4.1.3 on 2026-10-19 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0008_assignment_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TextFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField()),
+                ('estafette', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='presto.courseestafette')),
+                ('item_assignment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='presto.itemassignment')),
+                ('review', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='presto.peerreview')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='textfingerprint',
+            index=models.Index(fields=['estafette', 'value'], name='tf_est_value_idx'),
+        ),
+    ]
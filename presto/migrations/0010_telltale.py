@@ -0,0 +1,32 @@
+# Generated by Django 4.1.3 on 2026-10-19 13:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0009_text_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TellTale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=8)),
+                ('value', models.CharField(max_length=64)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='presto.assignment')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='presto.participantupload')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='telltale',
+            index=models.Index(fields=['kind', 'value'], name='tt_kind_value_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='telltale',
+            unique_together={('upload', 'kind', 'value')},
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.3 on 2026-10-19 15:40
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0010_telltale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_scanned', models.DateTimeField(default=django.utils.timezone.now)),
+                ('content', models.BinaryField(default=b'')),
+                ('assignment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='presto.assignment')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScanCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(blank=True, default='', max_length=64)),
+                ('heartbeat', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lease_expires', models.DateTimeField(default=datetime.datetime(2000, 12, 31, 23, 0, tzinfo=datetime.timezone.utc))),
+                ('state', models.TextField(blank=True, default='')),
+                ('assignment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='presto.assignment')),
+            ],
+        ),
+    ]
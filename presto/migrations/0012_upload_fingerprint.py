@@ -0,0 +1,29 @@
+# Generated by Django 4.1.3 on 2026-10-19 17:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presto', '0011_scan_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField()),
+                ('case', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='presto.estafettecase')),
+                ('estafette', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='presto.courseestafette')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='presto.estafettetemplate')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='presto.participantupload')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='uploadfingerprint',
+            index=models.Index(fields=['template', 'value'], name='uf_tmpl_value_idx'),
+        ),
+    ]
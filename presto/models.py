@@ -27,25 +27,33 @@ SOFTWARE.
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.storage import FileSystemStorage
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Q, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
-from django.utils.html import strip_tags
 
 # python modules
 from datetime import date, datetime, time, timedelta
 from hashlib import md5
 from json import dumps, loads
-from langdetect import detect, detect_langs
 import os
 import random
 import re
+import zlib
 
 # presto modules
+from presto.blacklist import (
+    blacklisted_words,
+    detected_language,
+    normalized_text,
+    words_not_in,
+    )
+from presto.blobstore import blob_storage
+from presto.cache import invalidate
 from presto.uiphrases import (
     CALENDAR_NAMES,
-    UI_BLACKDICT,
     UI_LANGUAGE_CODES,
     UI_PHRASE_DICT,
     )
@@ -79,6 +87,8 @@ DEFAULT_DATE = timezone.make_aware(
 
 # Initial value for security key in user session objects:
 NO_SESSION_KEY = '(no key)'
+# User sessions that have been inactive for this long have expired:
+SESSION_TIMEOUT = timedelta(days=1)
 
 # Status codes associated with working in teams:
 INVITATION_STATUS = ['PENDING', 'ACCEPTED', 'REJECTED', 'WITHDRAWN']
@@ -314,6 +324,23 @@ def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
 
 
+# make cached role lists unreachable when roles change (see presto/cache.py)
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def invalidate_roles(sender, instance, **kwargs):
+    invalidate('Role', 0)
+
+
+@receiver(m2m_changed, sender=Profile.roles.through)
+def invalidate_user_roles(sender, instance, action, reverse, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        if reverse:
+            # the profiles of a role have changed
+            invalidate('Role', 0)
+        else:
+            invalidate('Profile', instance.pk)
+
+
 class UserSession(models.Model):
     """
     User session data: used for security and for holding status information.
@@ -326,6 +353,10 @@ class UserSession(models.Model):
     is set for the user. If so, the JSON string has two attributes:
     - course_student_id (int): the primary key of the CourseStudent instance
     - alias_name (string): the name entered by the user when prompted
+    As the state is not searchable, aliases are also registered as DemoAlias
+    records, one per session.
+    Sessions that have been inactive for some time are removed by the
+    prune_sessions command (to be scheduled, e.g., hourly).
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     session_key = models.CharField(max_length=64, default=NO_SESSION_KEY)
@@ -341,6 +372,16 @@ class UserSession(models.Model):
         )
     state = models.TextField(default='{}', blank=True)
 
+    class Meta:
+        indexes = [
+            # session lookup for each page request (see generic.generic_context)
+            models.Index(fields=['user', 'session_key'], name='us_user_key_idx'),
+            # removal of inactive sessions
+            models.Index(fields=['last_action'], name='us_last_action_idx'),
+            # removal of sessions by age (start_time is the time of creation)
+            models.Index(fields=['start_time'], name='us_start_time_idx'),
+            ]
+
     def __str__(self):
         return '{} [{}] {} {}'.format(
             prefixed_user_name(self.user),
@@ -430,6 +471,30 @@ class CourseStudent(models.Model):
                     ).hexdigest()[4:11], 16))[:4].zfill(4)
 
 
+class DemoAlias(models.Model):
+    """
+    Alias entered by a demonstration user (or a "focused" instructor) for
+    a dummy course student. An alias can be used in only one session of
+    the same user, and the session record "owns" the alias, so it is
+    removed when the session is removed.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    session = models.OneToOneField(UserSession, on_delete=models.CASCADE)
+    course_student = models.ForeignKey(CourseStudent, on_delete=models.CASCADE)
+    alias = models.CharField(max_length=32)
+
+    class Meta:
+        # NOTE: the unique index also serves to look up an alias
+        unique_together = ['user', 'alias']
+
+    def __str__(self):
+        return '{} as "{}" (course student #{})'.format(
+            prefixed_user_name(self.user),
+            self.alias,
+            self.course_student_id
+            )
+
+
 class Item(models.Model):
     """
     Items are used to structure a review to appraise various aspects of a work.
@@ -545,27 +610,58 @@ class EstafetteTemplate(models.Model):
     time_created = models.DateTimeField(default=timezone.now)
     time_last_edit = models.DateTimeField(default=timezone.now)
     published = models.BooleanField(default=False)
+    # number of legs (denormalized, so that it does not take a query each time it is needed)
+    # NOTE: kept up to date by the signal handlers for EstafetteLeg (see below)
+    leg_count = models.IntegerField(default=0)
 
     def __str__(self):
         return 'ET: ' + self.name
 
     def nr_of_legs(self):
-        return EstafetteLeg.objects.filter(template=self).count()
+        return self.leg_count
+
+    # recounts the legs of this template, and stores the result in the database
+    def update_leg_count(self):
+        self.leg_count = EstafetteLeg.objects.filter(template=self).count()
+        EstafetteTemplate.objects.filter(pk=self.pk).update(leg_count=self.leg_count)
+
+    # returns the legs of this template with their items (and users) fetched in bulk
+    def legs_for_export(self):
+        return EstafetteLeg.objects.filter(template=self).select_related(
+            'creator', 'last_editor').prefetch_related('upload_items', 'review_items')
 
     # returns relevant fields as JSON string to facilitate duplication and/or publication for reuse
     # NOTE: creator, last_editor and time stamp fields are ignored, because these
     #       are set upon creation of the duplicating instance
     def to_JSON(self):
-        legs = EstafetteLeg.objects.filter(template=self)
         d = {
             'name': self.name,
             'description': self.description,
             'default_rules': self.default_rules,
-            'legs': [l.to_dict() for l in legs]
+            'legs': [l.to_dict() for l in self.legs_for_export()]
             }
         return dumps(d)
 
+    # yields the same JSON string as to_JSON, but in chunks (one per leg), so that
+    # large templates can be streamed without building the complete string in memory
+    def iter_JSON(self):
+        d = dumps({
+            'name': self.name,
+            'description': self.description,
+            'default_rules': self.default_rules,
+            'legs': []
+            })
+        # NOTE: d ends with the empty leg list "[]}"
+        yield d[:-2]
+        sep = ''
+        for l in self.legs_for_export().iterator(chunk_size=20):
+            yield sep + dumps(l.to_dict())
+            sep = ', '
+        yield d[-2:]
+
     # set not-author-related fields to corresponding values specified by JSON string
+    # NOTE: all legs and items are created within a single transaction, so a template
+    #       is either imported completely, or not at all
     def init_from_JSON(self, json_str, user):
         d = loads(json_str)
         # ensure that name is unique in database
@@ -581,14 +677,38 @@ class EstafetteTemplate(models.Model):
         self.default_rules = d['default_rules']
         self.creator = user
         self.last_editor = user
-        # store the new object in the database, or its primary key will not be known yet
-        self.save()
-        # now the legs can be created
-        for l in d['legs']:
-            leg = EstafetteLeg()
-            leg.template = self
-            # NOTE: l is a dict and hence must be serialized again
-            leg.init_from_dict(l, user)
+        self.leg_count = len(d['legs'])
+        with transaction.atomic():
+            # store the new object in the database, or its primary key will not be known yet
+            self.save()
+            # now the legs can be created
+            legs = []
+            for l in d['legs']:
+                leg = EstafetteLeg()
+                leg.template = self
+                leg.init_from_dict(l, user, save=False)
+                legs.append(leg)
+            # NOTE: bulk_create does not send signals, so the leg count has been set above
+            EstafetteLeg.objects.bulk_create(legs)
+            # NOTE: bulk_create sets the primary keys of the created objects only for some
+            #       databases (not for MySQL), hence the legs are retrieved in order of
+            #       creation
+            legs = EstafetteLeg.objects.filter(template=self).order_by('id')
+            # create the items of all legs (one by one, for the same reason) ...
+            items = []
+            for l, leg in zip(d['legs'], legs):
+                for k in ['upload_items', 'review_items']:
+                    for i in l[k]:
+                        item = Item()
+                        item.init_from_dict(i)
+                        item.save()
+                        items.append((leg, k, item))
+            # ... and then relate them to their legs (in one go per relation)
+            for k in ['upload_items', 'review_items']:
+                tt = getattr(EstafetteLeg, k).through
+                tt.objects.bulk_create([
+                    tt(estafetteleg_id=i[0].id, item_id=i[2].id) for i in items if i[1] == k
+                    ])
         log_message(
             'Initialized template {} from JSON string'.format(self.name, user)
             )
@@ -715,7 +835,7 @@ class EstafetteLeg(models.Model):
             }
 
     # set not-author-related fields to corresponding values in dictionary d
-    def init_from_dict(self, d, user):
+    def init_from_dict(self, d, user, save=True):
         self.number = d['number']
         self.name = d['name']
         self.description = d.get('description', '')
@@ -731,15 +851,41 @@ class EstafetteLeg(models.Model):
         self.required_section_title = d.get('required_section_title', '')
         self.required_section_length = d.get('required_section_length', '')
         self.required_keywords = d.get('required_keywords', '')
-        for i in d['upload_items']:
-            ui = Item()
-            ui.init_from_dict(i)
-        for i in d['review_items']:
-            ri = Item()
-            ri.init_from_dict(i)
         self.creator = user
         self.last_editor = user
-        self.save()
+        # NOTE: when legs are created in bulk (see EstafetteTemplate.init_from_JSON),
+        #       this leg and its items are saved by the caller
+        if save:
+            self.save()
+            for k in ['upload_items', 'review_items']:
+                for i in d[k]:
+                    item = Item()
+                    item.init_from_dict(i)
+                    item.save()
+                    getattr(self, k).add(item)
+
+
+# keep the leg count of templates up to date
+@receiver(post_save, sender=EstafetteLeg)
+def add_leg_to_count(sender, instance, created, **kwargs):
+    if created:
+        instance.template.update_leg_count()
+
+
+@receiver(post_delete, sender=EstafetteLeg)
+def remove_leg_from_count(sender, instance, **kwargs):
+    # NOTE: when a template is deleted, its legs are deleted in cascade
+    try:
+        instance.template.update_leg_count()
+    except EstafetteTemplate.DoesNotExist:
+        pass
+
+
+# make cached legs of the template unreachable when a leg changes (see presto/cache.py)
+@receiver(post_save, sender=EstafetteLeg)
+@receiver(post_delete, sender=EstafetteLeg)
+def invalidate_legs(sender, instance, **kwargs):
+    invalidate('EstafetteTemplate', instance.template_id)
 
 
 class Estafette(models.Model):
@@ -830,6 +976,13 @@ class EstafetteCase(models.Model):
         return '{} {}: {}'.format(case, self.letter, self.name)
 
 
+# make cached cases of the estafette unreachable when a case changes (see presto/cache.py)
+@receiver(post_save, sender=EstafetteCase)
+@receiver(post_delete, sender=EstafetteCase)
+def invalidate_cases(sender, instance, **kwargs):
+    invalidate('Estafette', instance.estafette_id)
+
+
 class CourseEstafette(models.Model):
     course = models.ForeignKey(Course, on_delete=models.PROTECT)
     estafette = models.ForeignKey(Estafette, on_delete=models.PROTECT)
@@ -1049,27 +1202,13 @@ class CourseEstafette(models.Model):
     # returns string stating the number of reviews that have been appealed,
     # and appeals that have been objected against, and not yet decided (and acknowledged).
     # returns empty string if none, or if a specified number of days have passed since the relay end time
-    def pending_decisions(self):
+    # NOTE: counts can be passed as obtained from relay_decision_counts for a list of relays
+    def pending_decisions(self, counts=None):
         if self.end_time + timedelta(days=MAX_DAYS_BEYOND_END_DATE) < timezone.now():
             return ''
-        # allow a few days for participants to respond to referee decisions
-        adt = timezone.now() - timedelta(days=POST_FINISH_DAYS)
-        # pending appeals are: (1) appealed reviews that have not been taken on by a referee yet
-        ap_cnt = PeerReview.objects.filter(reviewer__estafette=self,
-            is_appeal=True, time_appeal_assigned=DEFAULT_DATE).count()
-        # (2) assigned appeals that have not been decided yet
-        ap_cnt += Appeal.objects.filter(review__reviewer__estafette=self,
-            time_decided=DEFAULT_DATE).count()
-        # pending objections are: (1) decided appeals that are contested appeals and have not been assigned
-        ob_cnt = Appeal.objects.filter(review__reviewer__estafette=self,
-            time_decided__gt=DEFAULT_DATE, time_objection_assigned=DEFAULT_DATE
-            ).exclude(is_contested_by_predecessor=False, is_contested_by_successor=False).count()
-        # (2) assigned objections that have not been decided yet
-        ob_cnt += Objection.objects.filter(time_decided=DEFAULT_DATE,
-            appeal__review__reviewer__estafette=self).count()
-        # potential objections: recently (!) decided appeals that have NOT been contested
-        pob_cnt = Appeal.objects.filter(review__reviewer__estafette=self, time_decided__gt=adt,
-            is_contested_by_predecessor=False, is_contested_by_successor=False).count()
+        if counts is None:
+            counts = relay_decision_counts([self.id])[self.id]
+        ap_cnt, ob_cnt, pob_cnt = counts
         ssl = []
         if ap_cnt:
             ssl.append(plural_s(ap_cnt, 'pending appeal'))
@@ -1108,6 +1247,67 @@ class CourseEstafette(models.Model):
         return (b36[1:9], b36[9:25])
 
 
+# returns dict {relay ID: {'participant_count': n, 'active_count': m}} for the relays with
+# IDs in list ce_ids, where active participants have been active in the past 24 hours
+# NOTE: one (grouped) query for all relays; instructors (dummy index -1) are not counted
+def relay_participant_counts(ce_ids):
+    counts = dict([(ceid, {'participant_count': 0, 'active_count': 0}) for ceid in ce_ids])
+    for d in Participant.objects.filter(estafette__in=ce_ids, student__dummy_index__gt=-1
+            ).values('estafette').order_by().annotate(
+                participant_count=Count('id'),
+                active_count=Count('id', filter=Q(
+                    time_last_action__gte=timezone.now() - timedelta(days=1)))
+                ):
+        counts[d['estafette']] = {
+            'participant_count': d['participant_count'],
+            'active_count': d['active_count']
+            }
+    return counts
+
+
+# returns dict {relay ID: (pending appeals, pending objections, potential objections)}
+# for the relays with IDs in list ce_ids (see CourseEstafette.pending_decisions)
+# NOTE: one (grouped) query per model for all relays
+def relay_decision_counts(ce_ids):
+    counts = dict([(ceid, [0, 0, 0]) for ceid in ce_ids])
+    # allow a few days for participants to respond to referee decisions
+    adt = timezone.now() - timedelta(days=POST_FINISH_DAYS)
+    # pending appeals are: (1) appealed reviews that have not been taken on by a referee yet
+    for d in PeerReview.objects.filter(reviewer__estafette__in=ce_ids,
+            is_appeal=True, time_appeal_assigned=DEFAULT_DATE
+            ).values('reviewer__estafette').order_by().annotate(n=Count('id')):
+        counts[d['reviewer__estafette']][0] += d['n']
+    uncontested = Q(is_contested_by_predecessor=False, is_contested_by_successor=False)
+    for d in Appeal.objects.filter(review__reviewer__estafette__in=ce_ids
+            ).values('review__reviewer__estafette').order_by().annotate(
+                # (2) assigned appeals that have not been decided yet
+                ap=Count('id', filter=Q(time_decided=DEFAULT_DATE)),
+                # pending objections are: (1) decided appeals that are contested appeals
+                # and have not been assigned
+                ob=Count('id', filter=Q(time_decided__gt=DEFAULT_DATE,
+                    time_objection_assigned=DEFAULT_DATE) & ~uncontested),
+                # potential objections: recently (!) decided appeals that have NOT been contested
+                pob=Count('id', filter=Q(time_decided__gt=adt) & uncontested)
+                ):
+        c = counts[d['review__reviewer__estafette']]
+        c[0] += d['ap']
+        c[1] += d['ob']
+        c[2] += d['pob']
+    # (2) assigned objections that have not been decided yet
+    for d in Objection.objects.filter(time_decided=DEFAULT_DATE,
+            appeal__review__reviewer__estafette__in=ce_ids
+            ).values('appeal__review__reviewer__estafette').order_by().annotate(n=Count('id')):
+        counts[d['appeal__review__reviewer__estafette']][1] += d['n']
+    return dict([(k, tuple(v)) for k, v in counts.items()])
+
+
+# make cached relay metadata unreachable when the relay changes (see presto/cache.py)
+@receiver(post_save, sender=CourseEstafette)
+@receiver(post_delete, sender=CourseEstafette)
+def invalidate_relay(sender, instance, **kwargs):
+    invalidate('CourseEstafette', instance.pk)
+
+
 class Participant(models.Model):
     student = models.ForeignKey(CourseStudent, on_delete=models.PROTECT)
     estafette = models.ForeignKey(CourseEstafette, on_delete=models.PROTECT)
@@ -1120,6 +1320,12 @@ class Participant(models.Model):
     #review_extension = models.IntegerField(default=0)
     final_grade = models.FloatField(default=-1)
     deleted = models.BooleanField(default=False)
+    # progress counters (denormalized, so that progress can be assessed without queries)
+    # NOTE: kept up to date by the signal handlers for Assignment and PeerReview (see below)
+    #       and verified (and repaired if needed) by the "check_progress" command
+    step_count = models.IntegerField(default=0)
+    review_count = models.IntegerField(default=0)
+    last_progress_at = models.DateTimeField(default=DEFAULT_DATE)
 
     class Meta:
         ordering = ('estafette', 'student')
@@ -1139,11 +1345,34 @@ class Participant(models.Model):
     # returns number of steps and reviews done as a fast proxy for participant progress
     # NOTE: this proxy is used only in student.py
     def progress(self):
-        # NOTE: use the leg number of te last assignment, as participants may have
+        return self.step_count + self.review_count
+
+    # returns the progress fields of this participant as computed from the database
+    def counted_progress(self):
+        # NOTE: use the leg number of the last assignment, as participants may have
         #       been part of a team without uploading assignments themselves
-        a = Assignment.objects.filter(participant=self).last()
-        steps = a.leg.number if a else 0
-        return steps + PeerReview.objects.filter(reviewer=self).count()
+        a = Assignment.objects.filter(participant=self).select_related('leg').last()
+        al = Assignment.objects.filter(participant=self).aggregate(
+            ta=Max('time_assigned'), tu=Max('time_uploaded'))
+        rl = PeerReview.objects.filter(reviewer=self)
+        ts = rl.aggregate(ts=Max('time_submitted'))['ts']
+        return {
+            'step_count': a.leg.number if a else 0,
+            'review_count': rl.count(),
+            'last_progress_at': max([t for t in [al['ta'], al['tu'], ts] if t] + [DEFAULT_DATE])
+            }
+
+    # sets the progress fields to their values as computed from the database (unless
+    # repair is False), and returns a dict {field name: (old value, new value)} for
+    # the fields that needed to be repaired
+    def repair_progress(self, repair=True):
+        d = self.counted_progress()
+        drift = {k: (getattr(self, k), d[k]) for k in d if getattr(self, k) != d[k]}
+        if drift and repair:
+            for k in d:
+                setattr(self, k, d[k])
+            Participant.objects.filter(pk=self.pk).update(**d)
+        return drift
 
     # returns string stating the number of reviews that have been appealed,
     # and appeals that have been objected against, and not yet decided (and acknowledged).
@@ -1187,6 +1416,18 @@ class Participant(models.Model):
         return ''
 
 
+# the relay metadata includes the participant count (see presto/cache.py)
+@receiver(post_save, sender=Participant)
+def invalidate_relay_on_join(sender, instance, created, **kwargs):
+    if created:
+        invalidate('CourseEstafette', instance.estafette_id)
+
+
+@receiver(post_delete, sender=Participant)
+def invalidate_relay_on_leave(sender, instance, **kwargs):
+    invalidate('CourseEstafette', instance.estafette_id)
+
+
 class PartnerInvitation(models.Model):
     initiator = models.ForeignKey(
         Participant,
@@ -1266,11 +1507,38 @@ class Assignment(models.Model):
     #       on a (bad!) predecessor assignment; this assignment must remain in the database
     #       to keep the participant history complete
     is_rejected = models.BooleanField(default=False)
+    # set this flag when this assignment duplicates another one of the same participant
+    # and step (created by racing "proceed" actions before this was prevented), and it
+    # could not be deleted as it has uploads or successors (see repair_doubles)
+    is_retired = models.BooleanField(default=False)
 
     # NOTE: each participant can have only one assignment per leg, but this work
     #       may be cloned once
     class Meta:
         unique_together = ['participant', 'leg', 'clone_of']
+        # NOTE: unique_together does not prevent two "proceed" actions from creating
+        #       the same step twice, as clone_of is then NULL (and NULLs are distinct),
+        #       hence this conditional constraint (on MySQL, which does not support
+        #       conditions, migration 0007 adds an equivalent generated column key)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['participant', 'leg'],
+                condition=Q(clone_of__isnull=True, is_rejected=False, is_retired=False),
+                name='a_active_leg_uniq'
+                ),
+            ]
+        # NOTE: these indexes match the query shapes checked by "explain_hot_queries"
+        indexes = [
+            # assignments of a participant (per step and case, and uploaded or not)
+            models.Index(
+                fields=['participant', 'leg', 'case', 'time_uploaded'],
+                name='a_part_leg_case_upl_idx'
+                ),
+            # uploaded work for a step (predecessor matching, final reviews)
+            models.Index(fields=['leg', 'time_uploaded'], name='a_leg_upl_idx'),
+            # uploaded work that still needs to be scanned
+            models.Index(fields=['time_scanned', 'time_uploaded'], name='a_scan_upl_idx'),
+            ]
 
     def __str__(self):
         if self.time_uploaded == DEFAULT_DATE:
@@ -1392,15 +1660,114 @@ class ItemAssignment(models.Model):
     rating = models.IntegerField(blank=True, default=0)
 
 
+class AssignmentAncestor(models.Model):
+    """
+    Closure table of the "builds on" relation between assignments.
+
+    The parent of an assignment is the assignment it builds on: its predecessor,
+    or (for a clone) its original. For each assignment, this table has a record
+    for each of its ancestors (parent, parent of parent, etc.), where depth is
+    the number of links between the two.
+    The table is maintained only if settings.ASSIGNMENT_CLOSURE_TABLE is True
+    (the build_closure command fills it initially). The plagiarism scanner then
+    finds all work related to an assignment with a single query.
+    """
+    descendant = models.ForeignKey(Assignment, related_name='ancestor_links',
+        on_delete=models.CASCADE)
+    ancestor = models.ForeignKey(Assignment, related_name='descendant_links',
+        on_delete=models.CASCADE)
+    depth = models.IntegerField()
+
+    class Meta:
+        # NOTE: the unique index also serves to look up the ancestors of an assignment
+        unique_together = ['descendant', 'ancestor']
+        indexes = [
+            # descendants of an assignment
+            models.Index(fields=['ancestor', 'descendant'], name='aa_anc_desc_idx'),
+            ]
+
+
+# links assignment a (and the assignments building on it) to the ancestors of its parent
+def link_assignment(a):
+    pid = a.clone_of_id or a.predecessor_id
+    links = AssignmentAncestor.objects.filter(descendant=a.id)
+    if links.filter(depth=1).values_list('ancestor_id', flat=True).first() == pid:
+        # parent has not changed
+        return
+    with transaction.atomic():
+        # get the IDs of a and its descendants, and their depth relative to a
+        sub_tree = [(a.id, 0)] + list(AssignmentAncestor.objects.filter(ancestor=a.id
+            ).values_list('descendant_id', 'depth'))
+        sub_ids = [d for d, n in sub_tree]
+        # remove the links with the former ancestors of a
+        AssignmentAncestor.objects.filter(descendant__in=sub_ids
+            ).exclude(ancestor__in=sub_ids).delete()
+        if not pid:
+            return
+        # link the sub-tree to the parent and its ancestors
+        ancestors = [(pid, 1)] + [(x, n + 1) for x, n in AssignmentAncestor.objects.filter(
+            descendant=pid).values_list('ancestor_id', 'depth')]
+        if [x for x, n in ancestors if x in sub_ids]:
+            # NOTE: should never occur, but a cycle would make the table useless
+            log_message('ERROR: assignment #{} builds on its own work'.format(a.id))
+            return
+        AssignmentAncestor.objects.bulk_create([
+            AssignmentAncestor(descendant_id=d, ancestor_id=x, depth=dn + xn)
+            for d, dn in sub_tree for x, xn in ancestors
+            ])
+
+
+@receiver(post_save, sender=Assignment)
+def link_saved_assignment(sender, instance, **kwargs):
+    if settings.ASSIGNMENT_CLOSURE_TABLE:
+        link_assignment(instance)
+
+
+# NOTE: assignments building on a deleted assignment lose their predecessor, so their
+#       links with the ancestors of the deleted assignment must be removed as well
+@receiver(pre_delete, sender=Assignment)
+def collect_assignment_links(sender, instance, **kwargs):
+    if settings.ASSIGNMENT_CLOSURE_TABLE:
+        instance.closure_links = (
+            list(AssignmentAncestor.objects.filter(descendant=instance.id
+                ).values_list('ancestor_id', flat=True)),
+            list(AssignmentAncestor.objects.filter(ancestor=instance.id
+                ).values_list('descendant_id', flat=True))
+            )
+
+
+@receiver(post_delete, sender=Assignment)
+def unlink_deleted_assignment(sender, instance, **kwargs):
+    if hasattr(instance, 'closure_links'):
+        ancestors, descendants = instance.closure_links
+        AssignmentAncestor.objects.filter(ancestor__in=ancestors,
+            descendant__in=descendants).delete()
+
+
 # returns the path to the participant directory for the specified ParticipantUpload instance
 def participant_dir(instance, filename):
     return os.path.join(instance.assignment.participant.upload_dir, filename)
 
 
+# distinct file contents of participant uploads (see blobstore.py)
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField(default=0)
+    # number of upload files that refer to this blob
+    ref_count = models.IntegerField(default=0)
+    time_created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '{} ({} bytes, {}x)'.format(self.sha256, self.size, self.ref_count)
+
+
 class ParticipantUpload(models.Model):
     assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE)
     file_name = models.CharField(max_length=32)
-    upload_file = models.FileField(upload_to=participant_dir)
+    # NOTE: uploaded files are stored only once per distinct content, but their path
+    #       (participant directory plus file name) remains the same
+    upload_file = models.FileField(upload_to=participant_dir, storage=blob_storage)
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.SET_NULL)
     time_uploaded = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
@@ -1412,6 +1779,133 @@ class ParticipantUpload(models.Model):
             )
 
 
+# relate new uploads to the blob that holds their content
+@receiver(post_save, sender=ParticipantUpload)
+def set_upload_blob(sender, instance, created, **kwargs):
+    if created and not instance.blob_id:
+        b = instance.upload_file.storage.blob(instance.upload_file.name)
+        if b:
+            ParticipantUpload.objects.filter(pk=instance.pk).update(blob=b)
+            instance.blob = b
+
+
+# delete the files of deleted uploads, so that their blobs are released
+# NOTE: several uploads may refer to the same file, so a file is deleted only when the
+#       last of these uploads is deleted -- and only if the deletion has been committed
+@receiver(post_delete, sender=ParticipantUpload)
+def release_upload_blob(sender, instance, **kwargs):
+    name = instance.upload_file.name
+    storage = instance.upload_file.storage
+    has_blob = bool(instance.blob_id)
+
+    def delete_file():
+        if name and not ParticipantUpload.objects.filter(upload_file=name).exists():
+            if has_blob:
+                storage.delete(name)
+            else:
+                # files uploaded before the blob store existed do not refer to a blob
+                FileSystemStorage.delete(storage, name)
+
+    transaction.on_commit(delete_file)
+
+
+class TellTale(models.Model):
+    """
+    Tell-tales of uploaded DOCX, PPTX and XLSX files: properties that files of
+    different authors are unlikely to share, i.e., the size and CRC of each embedded
+    image (kind "image"), the time the file was created (kind "created"), and the
+    structure of workbooks (kinds "layout" and "formulas").
+
+    Tell-tales are recorded when a file is uploaded (see plag_scan.record_telltales),
+    except for the structure of workbooks, which is recorded when these are scanned,
+    so that values shared by the files of different participants -- in any relay of
+    any year -- can be found with a single query (see telltale_report).
+    """
+    assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE)
+    upload = models.ForeignKey(ParticipantUpload, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=8)
+    value = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ['upload', 'kind', 'value']
+        indexes = [
+            # files sharing a tell-tale
+            models.Index(fields=['kind', 'value'], name='tt_kind_value_idx'),
+            ]
+
+    def __str__(self):
+        return '{}: {} {}'.format(str(self.assignment), self.kind, self.value)
+
+
+class UploadFingerprint(models.Model):
+    """
+    Archive of the fingerprints (see plag_scan.text_fingerprints) of the text of
+    uploaded files, grouped by template and case, so that the plagiarism scanner
+    can find files of earlier relays (typically of earlier years) that share text
+    with a file by a single query instead of comparing all these files.
+    Files are archived when they are scanned (see plag_scan.scan_archive).
+    """
+    template = models.ForeignKey(EstafetteTemplate, on_delete=models.CASCADE)
+    case = models.ForeignKey(EstafetteCase, on_delete=models.CASCADE)
+    estafette = models.ForeignKey(CourseEstafette, on_delete=models.CASCADE)
+    upload = models.ForeignKey(ParticipantUpload, on_delete=models.CASCADE)
+    value = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            # files of relays of a template having a fingerprint
+            models.Index(fields=['template', 'value'], name='uf_tmpl_value_idx'),
+            ]
+
+
+class ScanCheckpoint(models.Model):
+    """
+    State of a plagiarism scan that is in progress (see plag_scan.scan_assignment).
+
+    The scanner that works on the assignment "owns" the checkpoint until its lease
+    expires. While scanning, the owner renews the lease (the heartbeat) and saves
+    its state, so that when the owner is killed, the next scanner can claim the
+    checkpoint once the lease has expired, and resume the scan from its state.
+    """
+    assignment = models.OneToOneField(Assignment, on_delete=models.CASCADE)
+    # NOTE: the owner is identified as "process ID:thread ID@host name"
+    owner = models.CharField(max_length=64, blank=True, default='')
+    heartbeat = models.DateTimeField(default=timezone.now)
+    lease_expires = models.DateTimeField(default=DEFAULT_DATE)
+    # state of the scan as JSON string (empty if not saved yet)
+    state = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return '{}: {} until {}'.format(
+            str(self.assignment),
+            self.owner or '(no owner)',
+            timezone.localtime(self.lease_expires).strftime(SHORT_DATE_TIME)
+            )
+
+
+class ScanReport(models.Model):
+    """
+    Report of a completed plagiarism scan in Markdown format, compressed with zlib
+    (as reports list all files scanned, they are long but repetitive).
+    """
+    assignment = models.OneToOneField(Assignment, on_delete=models.CASCADE)
+    time_scanned = models.DateTimeField(default=timezone.now)
+    content = models.BinaryField(default=b'')
+
+    def set_text(self, text):
+        self.content = zlib.compress(text.encode('utf-8'), 9)
+
+    def text(self):
+        return zlib.decompress(self.content).decode('utf-8')
+
+    def __str__(self):
+        return '{}: scanned {} ({} bytes)'.format(
+            str(self.assignment),
+            timezone.localtime(self.time_scanned).strftime(SHORT_DATE_TIME),
+            len(self.content)
+            )
+
+
 # Each download of an uploaded file (of zipped set) is registered.
 # This allows checking per user whether s/he has indeed "seen" a file
 class UserDownload(models.Model):
@@ -1421,6 +1915,9 @@ class UserDownload(models.Model):
 
     class Meta:
         ordering = ['time_downloaded']
+        indexes = [
+            models.Index(fields=['user', 'assignment'], name='ud_user_assignment_idx'),
+            ]
 
     def __str__(self):
         return '{}: {} downloaded {}'.format(
@@ -1453,6 +1950,17 @@ class PeerReview(models.Model):
     time_acknowledged = models.DateTimeField(default=DEFAULT_DATE)
     time_appeal_assigned = models.DateTimeField(default=DEFAULT_DATE)
 
+    class Meta:
+        indexes = [
+            # reviews given by a participant (per assignment, and submitted or not)
+            models.Index(
+                fields=['reviewer', 'assignment', 'time_submitted'],
+                name='pr_rev_assign_sub_idx'
+                ),
+            # reviews of an assignment (submitted or not)
+            models.Index(fields=['assignment', 'time_submitted'], name='pr_assign_sub_idx'),
+            ]
+
     def __str__(self):
         if self.time_submitted == DEFAULT_DATE:
             ts = ''
@@ -1551,23 +2059,19 @@ class PeerReview(models.Model):
         text = ' '.join(
             [ir.comment for ir in ItemReview.objects.filter(review=self)]
             )
-        text = ' '.join([
+        text = normalized_text(' '.join([
             text,
             self.grade_motivation,
             self.appraisal_comment,
             self.improvement_appraisal_comment
-            ])
-        text = strip_tags(
-            text.lower().replace('.', ' ').replace(',', ' ').replace(
-                ';', ' ').replace('!', ' ').replace('?', ' ')
-            )
+            ]))
         # Get the course estafette language.
         lang = self.reviewer.student.course.language
         # Check whether the text appears to be in that language.
-        # If probability too low, return detect_langs dict as string.
+        # NOTE: Its language is detected only if this is not evident.
         try:
             msg = ''
-            dlc = detect(text)
+            dlc = detected_language(text, lang.code)
             if dlc != lang.code.split('-')[0]:
                 msg = '{} instead of {}'.format(dlc, lang.code)
                 raise ValueError(msg)
@@ -1580,26 +2084,16 @@ class PeerReview(models.Model):
 
         # If the language is OK, scan for blacklisted words.
         real_matches = []
-        blacklist = UI_BLACKDICT[lang.code]
-        matches = []
-        for word in blacklist:
-            if word in text:
-                matches.append(word)
+        matches = blacklisted_words(text, lang.code)
         if matches:
             # Ignore matches that also occur in the assignment itself...
-            text = ' '.join([
+            text = normalized_text(' '.join([
                 self.assignment.leg.description,
                 self.assignment.case.name,
                 self.assignment.case.description
-                ])
-            text = strip_tags(
-                text.lower().replace('.', ' ').replace(',', ' ').replace(
-                    ';', ' ').replace('!', ' ').replace('?', ' ')
-                )
+                ]))
             # ... so only retain words not used by the instructor.
-            for word in matches:
-                if not (word in text):
-                    real_matches.append(word)
+            real_matches = words_not_in(matches, text, lang.code)
         # Record the improper language issue for this review.
         if real_matches:
             msg = ', '.join(real_matches)
@@ -1613,6 +2107,55 @@ class PeerReview(models.Model):
         return False
 
 
+# keep the progress fields of participants up to date
+# NOTE: these handlers update the participant in the same database transaction as the
+#       assignment or review (get_or_create is atomic, and so are the writes in student.py)
+def record_progress(pid, t, **kwargs):
+    Participant.objects.filter(pk=pid).update(
+        last_progress_at=Greatest('last_progress_at', Value(t)),
+        **kwargs
+        )
+
+
+@receiver(post_save, sender=Assignment)
+def assignment_progress(sender, instance, created, **kwargs):
+    if created:
+        record_progress(
+            instance.participant_id,
+            max(instance.time_assigned, instance.time_uploaded),
+            step_count=instance.leg.number
+            )
+    elif instance.time_uploaded != DEFAULT_DATE:
+        record_progress(instance.participant_id, instance.time_uploaded)
+
+
+@receiver(post_save, sender=PeerReview)
+def review_progress(sender, instance, created, **kwargs):
+    if created:
+        record_progress(
+            instance.reviewer_id,
+            instance.time_submitted,
+            review_count=F('review_count') + 1
+            )
+    elif instance.time_submitted != DEFAULT_DATE:
+        record_progress(instance.reviewer_id, instance.time_submitted)
+
+
+# NOTE: deletions are rare (e.g., declined assignments), so simply recount
+@receiver(post_delete, sender=Assignment)
+def assignment_regress(sender, instance, **kwargs):
+    p = Participant.objects.filter(pk=instance.participant_id).first()
+    if p:
+        p.repair_progress()
+
+
+@receiver(post_delete, sender=PeerReview)
+def review_regress(sender, instance, **kwargs):
+    p = Participant.objects.filter(pk=instance.reviewer_id).first()
+    if p:
+        p.repair_progress()
+
+
 class ItemReview(models.Model):
     """
     Item reviews are user responses to a specific peer review item.
@@ -1626,6 +2169,30 @@ class ItemReview(models.Model):
         return '#{}-{}'.format(self.id, str(self.review))
 
 
+class TextFingerprint(models.Model):
+    """
+    Inverted index of the texts that participants enter in forms: the comments
+    on assignment items and the motivations of reviews.
+
+    Each record relates a fingerprint value (see plag_scan.text_fingerprints)
+    to the text having it, so that the plagiarism scanner can look up the texts
+    that share fingerprints with a given text instead of comparing all texts.
+    A text is fingerprinted each time it is saved (see ajax.py).
+    """
+    estafette = models.ForeignKey(CourseEstafette, on_delete=models.CASCADE)
+    # NOTE: either the item assignment or the review is set
+    item_assignment = models.ForeignKey(ItemAssignment, null=True, blank=True,
+        on_delete=models.CASCADE)
+    review = models.ForeignKey(PeerReview, null=True, blank=True, on_delete=models.CASCADE)
+    value = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            # texts in a relay having a fingerprint
+            models.Index(fields=['estafette', 'value'], name='tf_est_value_idx'),
+            ]
+
+
 class RefereeExam(models.Model):
     # exam pertains to one specific step in an estafette
     estafette_leg = models.ForeignKey(EstafetteLeg, on_delete=models.CASCADE)
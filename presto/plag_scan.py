@@ -26,35 +26,66 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 from django.conf import settings
-from django.db.models import Q
+from django.db import connection, transaction
+from django.db.models import Count, Q
 from django.shortcuts import render
 from django.utils import timezone
 from django.utils.html import strip_tags
 
 from .models import (
     Assignment,
+    AssignmentAncestor,
     DEFAULT_DATE,
     EstafetteLeg,
+    ItemAssignment,
     Participant,
     ParticipantUpload,
+    PeerReview,
     SHORT_DATE_TIME,
+    ScanCheckpoint,
+    ScanReport,
+    TellTale,
+    TextFingerprint,
+    UploadFingerprint,
     )
 
+from presto import string_tiling
+from presto.cache import cached, template_legs
 from presto.utils import log_message, pdf_to_text
 
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 from difflib import SequenceMatcher
 from docx import Document
+from hashlib import blake2b
+from html import unescape
 from io import BytesIO, TextIOWrapper
 from json import dumps, loads
 from markdown import markdown
+from openpyxl import load_workbook
+from pptx import Presentation
+import mmap
 import os
+import re
+import socket
+import threading
 import time
 from zipfile import ZipFile
 
 # Maximum duration (in seconds) of a single scan (to prevent request timeouts).
 MAX_SECONDS = 30
 
+# Duration (in seconds) of the lease on a scan checkpoint: when its owner has not renewed
+# the lease for this long, it is assumed to have crashed (see claim_checkpoint).
+LEASE_SECONDS = 120
+
+# Interval (in seconds) at which a scanner renews its lease and saves its state.
+HEARTBEAT_SECONDS = 10
+
+# Maximum age (in seconds) of the saved state of a partial scan for it to be resumed
+# (as work related to the scanned assignment may have been uploaded meanwhile).
+RESUME_SECONDS = 900
+
 # Minimum number of characters to be considered a match during text comparison.
 MATCH_THRESHOLD = 20
 
@@ -64,6 +95,35 @@ TOTAL_MATCH_THRESHOLD = 150
 # Minimum matching percentage to be considered suspect:
 SUSPICION_THRESHOLD = 3
 
+# Minimum total length of matches of item comments and review texts to be reported.
+TEXT_MATCH_THRESHOLD = 60
+
+# Number of words per shingle when fingerprinting item comments and review texts.
+SHINGLE_WORDS = 5
+
+# Number of consecutive shingles of which the lowest hash is kept as fingerprint.
+# NOTE: this guarantees that matches of SHINGLE_WORDS + WINNOW_WINDOW - 1 words
+#       are detected
+WINNOW_WINDOW = 4
+
+# Maximum number of fingerprints looked up per query.
+MAX_LOOKUP_VALUES = 500
+
+# Number of consecutive shingles of which the lowest hash is archived for uploaded files.
+# NOTE: this guarantees that matches of SHINGLE_WORDS + ARCHIVE_WINNOW_WINDOW - 1 words
+#       with files of earlier relays are detected
+ARCHIVE_WINNOW_WINDOW = 8
+
+# Minimum number of archived fingerprints that a file of an earlier relay must share with
+# a scanned file to be compared with it.
+MIN_ARCHIVE_HITS = 5
+
+# Maximum number of files of earlier relays compared with a scanned file.
+MAX_ARCHIVE_MATCHES = 10
+
+# Texts of the uploads being scanned (see open_corpus).
+CORPUS = None
+
 # HTML green-to-red color scale to highlight matching percentages.
 SCAN_STATUS_COLORS = [
     (0, '#00bb00'),
@@ -92,6 +152,50 @@ TELLTALE_SEPARATOR = '!!--TELL-TALES--!!'
 # XML tag for OpenDoc file creation time.
 TIME_CREATED_TAG = '<dcterms:created xsi:type="dcterms:W3CDTF">'
 
+# Directory of embedded images per OpenDoc file type.
+MEDIA_DIRS = {'.docx': 'word/media/', '.pptx': 'ppt/media/', '.xlsx': 'xl/media/'}
+
+# Maximum size (in bytes) of a file to extract text from.
+MAX_EXTRACT_FILE_SIZE = 50 * 1024 * 1024
+
+# Maximum number of slides and of (non-empty) spreadsheet cells to extract text from.
+MAX_SLIDES = 500
+MAX_SHEET_CELLS = 250000
+
+# Minimum number of cells of a workbook, and of formulas on a sheet, for a structural
+# fingerprint (as small or simple spreadsheets are likely to be alike by chance).
+MIN_LAYOUT_CELLS = 50
+MIN_SHEET_FORMULAS = 5
+
+# Cell references in spreadsheet formulas (not followed by "(", as in LOG10()).
+CELL_REF_RE = re.compile(r'(?<![A-Za-z_.])(\$?)([A-Z]{1,3})(\$?)([0-9]+)(?![0-9(A-Za-z_])')
+
+# Recursive query for the IDs of all work related to the assignments selected by
+# the subquery {own}, i.e., (1) the work that these assignments build on: their
+# consecutive predecessors up to step 1, tracing clones to their original work,
+# and (2) all work building on that work: successors and clones, generation after
+# generation.
+# NOTE: recursive common table expressions are supported by SQLite and MySQL 8.
+RELATED_WORK_SQL = """
+WITH RECURSIVE
+up (id) AS (
+    SELECT a.predecessor_id FROM {assignment} a
+    WHERE a.id IN ({own}) AND a.predecessor_id IS NOT NULL
+    UNION
+    SELECT COALESCE(a.clone_of_id, a.predecessor_id) FROM {assignment} a
+    JOIN up ON a.id = up.id
+    WHERE COALESCE(a.clone_of_id, a.predecessor_id) IS NOT NULL
+    ),
+down (id) AS (
+    SELECT a.id FROM {assignment} a
+    JOIN up ON a.id = up.id
+    WHERE a.clone_of_id IS NULL
+    UNION
+    SELECT a.id FROM {assignment} a
+    JOIN down ON a.predecessor_id = down.id OR a.clone_of_id = down.id
+    )
+SELECT id FROM down"""
+
 # Typical fragments to ignore while scanning.
 COMMON_FRAGMENTS = [
     'https://',
@@ -138,6 +242,175 @@ def step_status(nr, perc=None):
     return SOLID_SCAN_SYMBOL.format(status_color(perc), (nr + 9) % 16)
 
 
+# returns list of tuples (kind, value) of the "tell-tales" of a DOCX, PPTX or XLSX file:
+# for each image file (in word/media, ppt/media or xl/media) the value
+# "<extension>=<file size>+<CRC>" of kind "image", the creation time stamp (from
+# docProps/core) of kind "created", and for workbooks their structural fingerprint
+# if this is passed as layout (see spreadsheet_content)
+# NOTE: raises an exception if the file is not a ZIP archive
+def file_telltales(path, layout=None):
+    ext = os.path.splitext(path)[1].lower()
+    media = MEDIA_DIRS.get(ext)
+    if not media:
+        return []
+    tt = list(layout or [])
+    with ZipFile(path, 'r') as zf:
+        for i in zf.infolist():
+            if i.filename.startswith(media):
+                tt.append(('image', '{}={}+{}'.format(
+                    os.path.splitext(i.filename)[1].lower(),
+                    i.file_size,
+                    i.CRC
+                    )))
+            elif i.filename == 'docProps/core.xml':
+                core = zf.read(i).decode('utf-8', errors='ignore')
+                p = core.find(TIME_CREATED_TAG)
+                if p >= 0:
+                    p += len(TIME_CREATED_TAG)
+                    cdt = core[p:p + 16]
+                    # ignore the presto "undefined" date
+                    if cdt != '2001-01-01T00:00':
+                        tt.append(('created', cdt))
+    return tt
+
+
+# returns the "tell-tales" of a DOCX, PPTX or XLSX file as lines to be appended to its text
+def telltale_lines(path, layout=None):
+    return ''.join(
+        '\n' + (v if k == 'image' else k + '=' + v) for k, v in file_telltales(path, layout)
+        )
+
+
+# returns the text of a cell value or formula as (space-separated) tokens
+def cell_tokens(v):
+    if isinstance(v, float):
+        v = '{:.10g}'.format(v)
+    elif isinstance(v, datetime):
+        v = v.isoformat()
+    return str(v)
+
+
+# returns a formula of the cell in row r and column c with its (relative) cell references
+# expressed as offsets, so that formulas copied to other cells are alike
+def relative_formula(formula, r, c):
+    def offset(m):
+        col = 0
+        for ch in m.group(2):
+            col = col * 26 + ord(ch) - 64
+        return '{}{}'.format(
+            'C' + str(col) if m.group(1) else 'C[{}]'.format(col - c),
+            'R' + m.group(4) if m.group(3) else 'R[{}]'.format(int(m.group(4)) - r)
+            )
+    return CELL_REF_RE.sub(offset, formula.replace(' ', '').upper())
+
+
+# returns tuple (text, list of tuples (kind, value)) for an XLSX file: the text comprises
+# its cell values and formulas, and the tuples its structural fingerprint: a hash of the
+# dimensions and formulas of all sheets (kind "layout"), and for each sheet having formulas
+# a hash of these formulas (kind "formulas")
+# NOTE: the workbook is read in read-only mode, which streams the sheets rather than loading
+#       them in memory, and at most MAX_SHEET_CELLS cells are read
+def spreadsheet_content(path):
+    wb = load_workbook(path, read_only=True, data_only=False)
+    tokens = []
+    layout = []
+    sheets = []
+    cells = 0
+    try:
+        for ws in wb.worksheets:
+            formulas = []
+            rows = cols = 0
+            for r, row in enumerate(ws.iter_rows(values_only=True), 1):
+                for c, v in enumerate(row, 1):
+                    if v is None or v == '':
+                        continue
+                    cells += 1
+                    rows = r
+                    cols = max(cols, c)
+                    if isinstance(v, str) and v.startswith('='):
+                        formulas.append(relative_formula(v, r, c))
+                    tokens.append(cell_tokens(v))
+                if cells >= MAX_SHEET_CELLS:
+                    break
+            formulas.sort()
+            sheets.append('{}x{}\n{}'.format(rows, cols, '\n'.join(formulas)))
+            if len(formulas) >= MIN_SHEET_FORMULAS:
+                layout.append(('formulas', blake2b('\n'.join(formulas).encode(),
+                    digest_size=8).hexdigest()))
+            if cells >= MAX_SHEET_CELLS:
+                log_message('WARNING: Only first {} cells of file {} scanned'.format(
+                    cells, path))
+                break
+    finally:
+        wb.close()
+    if cells >= MIN_LAYOUT_CELLS:
+        layout.insert(0, ('layout', blake2b('\n\n'.join(sheets).encode(),
+            digest_size=8).hexdigest()))
+    return (' '.join(' '.join(tokens).split()), layout)
+
+
+# returns the text of the shapes (including tables and grouped shapes) on the slides of
+# a PPTX file, and of the notes of these slides
+# NOTE: at most MAX_SLIDES slides are read
+def presentation_text(path):
+    def shape_texts(shapes):
+        for sh in shapes:
+            if sh.shape_type == 6:  # MSO_SHAPE_TYPE.GROUP
+                yield from shape_texts(sh.shapes)
+            elif sh.has_text_frame:
+                yield sh.text_frame.text
+            elif getattr(sh, 'has_table', False) and sh.has_table:
+                for row in sh.table.rows:
+                    for cell in row.cells:
+                        yield cell.text
+    text = []
+    prs = Presentation(path)
+    for i, slide in enumerate(prs.slides):
+        if i >= MAX_SLIDES:
+            log_message('WARNING: Only first {} slides of file {} scanned'.format(
+                MAX_SLIDES, path))
+            break
+        text.extend(shape_texts(slide.shapes))
+        if slide.has_notes_slide:
+            text.append(slide.notes_slide.notes_text_frame.text)
+    return ' '.join(' '.join(text).replace('\u00A0', ' ').split())
+
+
+# records the "tell-tales" of a participant upload (if any) in the TellTale table
+# NOTE: the structure of a workbook is recorded only if with_layout is True, as reading
+#       all its cells takes too long while the file is being uploaded; the scanner
+#       records it when it scans the file (see record_layout_telltales)
+def record_telltales(pu, with_layout=False):
+    path = pu.upload_file.path
+    try:
+        layout = None
+        if with_layout and os.path.splitext(path)[1].lower() == '.xlsx':
+            layout = spreadsheet_content(path)[1]
+        tt = file_telltales(path, layout)
+    except Exception as e:
+        log_message('WARNING: Failed to get tell-tales of file {}\n{}'.format(
+            pu.upload_file.name, str(e)))
+        return 0
+    TellTale.objects.bulk_create([
+        TellTale(assignment_id=pu.assignment_id, upload=pu, kind=k, value=v) for k, v in tt
+        ], ignore_conflicts=True)
+    return len(tt)
+
+
+# records the tell-tales of kinds "layout" and "formulas" in the text of participant upload
+# pu (as extracted by ascii_from_doc, so that its workbook is not read once more)
+def record_layout_telltales(pu, text):
+    parts = text.split(TELLTALE_SEPARATOR, 1)
+    if len(parts) < 2:
+        return 0
+    tt = [l.split('=', 1) for l in parts[1].split('\n')
+        if l.startswith('layout=') or l.startswith('formulas=')]
+    TellTale.objects.bulk_create([
+        TellTale(assignment_id=pu.assignment_id, upload=pu, kind=k, value=v) for k, v in tt
+        ], ignore_conflicts=True)
+    return len(tt)
+
+
 def ascii_from_doc(path, text_to_ignore=[]):
     """
     Extract text from document and return it as a plain ASCII string after
@@ -146,11 +419,37 @@ def ascii_from_doc(path, text_to_ignore=[]):
     Retrieves text from:
      - a DOCX document (paragraphs only, so ignoring tables, headers, etc.)
      - a PDF document (using pdftotext --  see presto_project/settings.py)
+     - a PPTX document (text of shapes and tables on slides, and slide notes)
+     - an XLSX document (cell values and formulas)
 
-    NOTE: Appends "tell tale" properties from DOCX and XLSX files, such as
+    NOTE: Appends "tell tale" properties from DOCX, PPTX and XLSX files, such as
           file creation time and byte count of embedded images.
+    NOTE: Files larger than MAX_EXTRACT_FILE_SIZE are not scanned.
     """
     ext = os.path.splitext(path)[1].lower()
+    if ext not in ['.docx', '.pdf', '.pptx', '.xlsx']:
+        log_message(
+            'File {} is not DOCX, PDF, PPTX or XLSX, and hence not scanned'.format(path)
+            )
+        return ''
+    if os.path.getsize(path) > MAX_EXTRACT_FILE_SIZE:
+        log_message(
+            'WARNING: File {} is too large ({} bytes), and hence not scanned'.format(
+                path,
+                os.path.getsize(path)
+                )
+            )
+        return ''
+    if ext == '.pdf':
+        ascii = pdf_to_text(path)
+        # remove sequences of 3+ periods (typically occur in table of contents)
+        ascii = ' '.join(ascii.replace('...', '').strip().split())
+        # remove text to ignore
+        for t in text_to_ignore:
+            ascii = ascii.replace(t.encode('ascii', 'ignore').decode(), '')
+        return ascii
+    error = ''
+    layout = None
     if ext == '.docx':
         f = open(path, 'rb')
         doc = Document(f)
@@ -159,107 +458,102 @@ def ascii_from_doc(path, text_to_ignore=[]):
         for par in doc.paragraphs:
             # first convert non-breaking spaces to normal ones, and then reduce all whitespace to 1 space
             text.append(' '.join(par.text.replace('\u00A0', ' ').strip().split()))
-        # convert to ASCII to get rid of special chars like curled quotes
-        ascii = (' '.join([s for s in text])).encode('ascii', 'ignore').decode(errors='ignore')
-        for t in text_to_ignore:
-            ascii = ascii.replace(t, '')
-        # NOTE: Word files are also scanned for the images they contain (in xl/media),
-        #       and for their creation date (from docProps/core)
-        # NOTE: we signal this the start of the "tell-tale list" with a separator
-        ascii += TELLTALE_SEPARATOR
-        error = ''
-        try:
-            with ZipFile(path, 'r') as zf:
-                # append for each image file a line "<extension>=<file size>+<CRC>"
-                for i in zf.infolist():
-                    if i.filename[:11] == 'word/media/':
-                        ascii += '\n{}={}+{}'.format(
-                            os.path.splitext(i.filename)[1].lower(),
-                            i.file_size,
-                            i.CRC
-                            )
-                    elif i.filename == 'docProps/core.xml':
-                        try:
-                            # try to extract the creation time stamp
-                            core = zf.read(i)
-                            # log_message('{} bytes read from core'.format(len(core)))
-                            p = core.index(TIME_CREATED_TAG) + len(TIME_CREATED_TAG)
-                            cdt = core[p:p + 16]
-                            # ignore the presto "undefined" date
-                            if cdt != '2001-01-01T00:00':
-                                ascii += '\ncreated=' + cdt
-                        except Exception:
-                            # ignore any errors while checking core.xml
-                            pass
-
-        except Exception as e:
-            error = str(e)
-        if error:
-            log_message(
-                'WARNING: Failed to scan file {} as ZIP archive\n{}'.format(
-                    path,
-                    error
-                    )
-                )
-        return ascii
-    elif ext == '.pdf':
-        ascii = pdf_to_text(path)
-        # remove sequences of 3+ periods (typically occur in table of contents)
-        ascii = ' '.join(ascii.replace('...', '').strip().split())
-        # remove text to ignore
-        for t in text_to_ignore:
-            ascii = ascii.replace(t.encode('ascii', 'ignore'), '')
-        return ascii
-    elif ext == '.xlsx':
-        # NOTE: Excel files are not scanned for text, but -- similar to Word
-        #       files -- for the images they contain (in xl/media), for their
-        #       shared strings (in xl/sharedStrings.xml), and for their
-        #       creation date (from docProps/core).
-        # NOTE: We signal this the start of the "tell-tale list" with a separator.
-        ascii = TELLTALE_SEPARATOR
-        error = ''
+        text = ' '.join(text)
+    else:
         try:
-            with ZipFile(path, 'r') as zf:
-                # append for each image file a line "<extension>=<file size>+<CRC>"
-                for i in zf.infolist():
-                    if i.filename[:9] == 'xl/media/':
-                        ascii += '\n{}={}+{}'.format(
-                            os.path.splitext(i.filename)[1].lower(),
-                            i.file_size,
-                            i.CRC
-                            )
-                    elif i.filename == 'docProps/core.xml':
-                        try:
-                            # Try to extract the creation time stamp.
-                            core = zf.read(i)
-                            # log_message('{} bytes read from core'.format(len(core)))
-                            p = core.index(TIME_CREATED_TAG) + len(TIME_CREATED_TAG)
-                            cdt = core[p:p + 16]
-                            # Ignore the presto "undefined" date.
-                            if cdt != '2001-01-01T00:00':
-                                ascii += '\ncreated=' + cdt
-                        except Exception:
-                            # Ignore any errors while checking core.xml.
-                            pass
+            if ext == '.pptx':
+                text = presentation_text(path)
+            else:
+                text, layout = spreadsheet_content(path)
         except Exception as e:
+            text = ''
+            layout = []
             error = str(e)
         if error:
             log_message(
-                'WARNING: Failed to scan file {} as ZIP archive\n{}'.format(
-                    path,
-                    error
-                    )
+                'WARNING: Failed to extract text from file {}\n{}'.format(path, error)
                 )
-        return ascii
-    else:
+            error = ''
+    # convert to ASCII to get rid of special chars like curled quotes
+    ascii = text.encode('ascii', 'ignore').decode(errors='ignore')
+    for t in text_to_ignore:
+        ascii = ascii.replace(t, '')
+    # NOTE: OpenDoc files are also scanned for the images they contain (in their media
+    #       directory), for their creation date (from docProps/core), and workbooks for
+    #       their structure
+    # NOTE: we signal this the start of the "tell-tale list" with a separator
+    ascii += TELLTALE_SEPARATOR
+    try:
+        ascii += telltale_lines(path, layout)
+    except Exception as e:
+        error = str(e)
+    if error:
         log_message(
-            'File {} is not DOCX, XLSX or PDF, and hence not scanned'.format(path)
+            'WARNING: Failed to scan file {} as ZIP archive\n{}'.format(
+                path,
+                error
+                )
             )
-        return ''
+    return ascii
+
+
+# returns list of tuples (position, size) of the blocks of text a (in characters) having
+# at least min_length characters that also occur in text b
+def matching_blocks(a, b, min_length):
+    if settings.PLAG_SCAN_MATCHER == 'sequence':
+        return [(m.a, m.size) for m in SequenceMatcher(None, a, b).get_matching_blocks()
+            if m.size >= min_length]
+    return string_tiling.matching_blocks(a, b, min_length)
+
+
+# returns the full path of an uploaded file
+# NOTE: workaround to deal with bug (?) in Django that makes that upload_file fields
+#       sometimes include the MEDIA_ROOT (without leading slash) and sometimes not
+def upload_path(upload_file):
+    mr = settings.MEDIA_ROOT.strip(r'\/')
+    if upload_file.find(mr) == 0:
+        return settings.LEADING_SLASH + upload_file
+    return os.path.join(settings.MEDIA_ROOT, upload_file)
+
+
+# writes the texts of the files at the specified paths (as extracted by ascii_from_doc)
+# to a corpus file, and returns its index: a dict {path: (offset, length)}
+def write_corpus(corpus_path, texts):
+    index = {}
+    offset = 0
+    with open(corpus_path, 'wb') as f:
+        for path, text in texts:
+            data = text.encode('utf-8')
+            f.write(data)
+            index[os.path.normpath(path)] = (offset, len(data))
+            offset += len(data)
+    return index
+
+
+# makes doc_text read texts from a corpus file (see write_corpus) that is memory-mapped,
+# so that the processes that scan a relay share one (read-only) copy of the texts
+def open_corpus(corpus_path, index):
+    global CORPUS
+    with open(corpus_path, 'rb') as f:
+        # NOTE: an empty file cannot be mapped
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if index else b''
+    CORPUS = (data, index)
+
+
+# returns the text of the document at path (see ascii_from_doc), from the corpus (if any)
+def doc_text(path, text_to_ignore=[]):
+    if CORPUS:
+        pos = CORPUS[1].get(os.path.normpath(path))
+        if pos:
+            text = CORPUS[0][pos[0]:pos[0] + pos[1]].decode('utf-8')
+            for t in text_to_ignore:
+                text = text.replace(t, '')
+            return text
+    return ascii_from_doc(path, text_to_ignore)
 
 
 def scan_report(text, req_file, path, aid, author, upload_time,
-                related, min_length, text_to_ignore=[]):
+                related, min_length, text_to_ignore=[], boilerplate=set()):
     """
     Return a tuple (percent match, report).
 
@@ -272,6 +566,10 @@ def scan_report(text, req_file, path, aid, author, upload_time,
     Report is a Markdown-formatted description on size, position, and content
     of matching text of at least min_length characters.
 
+    Shingles of the text in the file that occur in the boilerplate (the set of
+    shingle hashes of the text that all participants are given) are removed
+    before comparing.
+
     NOTE: Text is also scanned for matching "tell-tales".
     """
     tell_tales = ''
@@ -296,7 +594,7 @@ def scan_report(text, req_file, path, aid, author, upload_time,
                 )
         else:
            # get the text content from the file to scan
-            scan_text = ascii_from_doc(path)
+            scan_text = doc_text(path)
             # return warning report if no "tell-tales" detected
             if TELLTALE_SEPARATOR not in scan_text:
                 tell_tales = (
@@ -335,14 +633,13 @@ def scan_report(text, req_file, path, aid, author, upload_time,
     percentage = 0
     epolm = 0  # end position of last match
     if l:
-        s = SequenceMatcher(None, text, ascii_from_doc(path, text_to_ignore))
-        for match in s.get_matching_blocks():
-            if match.size >= min_length:
-                n += match.size
-                if epolm > 0:
-                    matching_text += BLUE_ELLIPSIS.format(match.a - epolm)
-                epolm = match.a + match.size
-                matching_text += text[match.a:match.a + match.size] #  .decode('utf-8')
+        other = without_boilerplate(doc_text(path, text_to_ignore), boilerplate)
+        for a, size in matching_blocks(text, other, min_length):
+            n += size
+            if epolm > 0:
+                matching_text += BLUE_ELLIPSIS.format(a - epolm)
+            epolm = a + size
+            matching_text += text[a:a + size]
         # NOTE: matches that are (only a few characters) longer than an ingnorable string
         #       are not ignored; hence we strip "to ignore" text fragments from the report
         mtl = len(matching_text)
@@ -404,9 +701,416 @@ def scan_report(text, req_file, path, aid, author, upload_time,
     return (percentage, report)
 
 
+# returns list of IDs of the assignments that are related to assignment a
+def related_assignment_ids(a):
+    # get ALL assignments for same case submitted (until now) by same participant
+    # because it can occur that participants are assigned the same case in several steps
+    # and then decide to reuse their own prior material
+    own = Assignment.objects.filter(
+        participant=a.participant,
+        case__letter=a.case.letter,
+        time_uploaded__lte=a.time_uploaded
+        ).values('id')
+    if settings.ASSIGNMENT_CLOSURE_TABLE:
+        # the work these assignments build on (clones are traced to their original) ...
+        # NOTE: clones of own work are not followed to their original (the own work)
+        preds = AssignmentAncestor.objects.filter(descendant__in=own,
+            descendant__clone_of__isnull=True, ancestor__clone_of__isnull=True
+            ).values('ancestor_id')
+        # ... and all work building on that work
+        # NOTE: as this work includes the own work, each of these "predecessors" is the
+        #       ancestor in at least one record, so a single query suffices
+        ids = set()
+        for pid, did in AssignmentAncestor.objects.filter(ancestor__in=preds
+                ).values_list('ancestor_id', 'descendant_id'):
+            ids.add(pid)
+            ids.add(did)
+        return list(ids)
+    sql, params = own.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            RELATED_WORK_SQL.format(assignment=Assignment._meta.db_table, own=sql),
+            params
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+# returns the plain ASCII text of an HTML text (as entered in item and review forms)
+# NOTE: tags are replaced by a space to avoid sticking words together, e.g., at </li><li>
+def plain_text(html):
+    text = unescape(re.sub(r'<[^>]*>', ' ', html)).replace('\u00A0', ' ')
+    return ' '.join(text.encode('ascii', 'ignore').decode(errors='ignore').split())
+
+
+# returns list of tuples (hash, start, end) for the shingles (sequences of SHINGLE_WORDS
+# words) of a text, where start and end are the positions of the shingle in the text
+def shingles(text):
+    words = list(re.finditer(r'\w+', text))
+    lw = [w.group().lower() for w in words]
+    return [
+        (
+            int.from_bytes(
+                blake2b(' '.join(lw[i:i + SHINGLE_WORDS]).encode(), digest_size=8).digest(),
+                'big',
+                signed=True
+                ),
+            words[i].start(),
+            words[i + SHINGLE_WORDS - 1].end()
+            )
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+        ]
+
+
+# returns the set of fingerprints of a text: of each window consecutive shingles,
+# the lowest hash value is kept ("winnowing")
+def text_fingerprints(text, window=WINNOW_WINDOW):
+    hashes = [h for h, start, end in shingles(text)]
+    if len(hashes) <= window:
+        return set(hashes)
+    return set(min(hashes[i:i + window]) for i in range(len(hashes) - window + 1))
+
+
+# returns the set of shingle hashes of the text of a case (its name and description)
+# NOTE: cached until a case of the estafette changes (see presto/cache.py)
+def case_shingles(case):
+    return cached('case_shingles', [case.id], [('Estafette', case.estafette_id)],
+        lambda: frozenset(h for h, start, end in shingles(
+            plain_text(case.name + ' ' + case.description))))
+
+
+# returns the set of shingle hashes of the instructions of an estafette leg
+# NOTE: cached until a leg of the template changes (see presto/cache.py)
+def leg_shingles(leg):
+    return cached('leg_shingles', [leg.id], [('EstafetteTemplate', leg.template_id)],
+        lambda: frozenset(h for h, start, end in shingles(plain_text(' '.join([
+            leg.description, leg.upload_instruction, leg.required_section_title
+            ])))))
+
+
+# returns the set of shingle hashes of the text that participants are given for assignment a:
+# the case text, and the instructions of its step and the preceding steps
+def boilerplate_shingles(a):
+    bp = set(case_shingles(a.case))
+    for l in template_legs(a.leg.template_id):
+        if l.number <= a.leg.number:
+            bp |= leg_shingles(l)
+    return bp
+
+
+# returns text without the shingles that occur in the boilerplate (a set of shingle hashes)
+# NOTE: the "tell-tales" (if any) are retained
+def without_boilerplate(text, boilerplate):
+    if not boilerplate:
+        return text
+    parts = text.split(TELLTALE_SEPARATOR, 1)
+    kept = []
+    pos = 0
+    # NOTE: shingles are ordered by position, and may overlap
+    for h, start, end in shingles(parts[0]):
+        if h in boilerplate:
+            if start > pos:
+                kept.append(parts[0][pos:start])
+            pos = max(pos, end)
+    if pos:
+        kept.append(parts[0][pos:])
+        parts[0] = ' '.join(' '.join(kept).split())
+    return TELLTALE_SEPARATOR.join(parts)
+
+
+# returns tuple (relay ID, plain text, dict identifying the text in the fingerprint index)
+# for an item assignment or a peer review
+def form_text(obj):
+    if isinstance(obj, ItemAssignment):
+        return (
+            obj.assignment.participant.estafette_id,
+            plain_text(obj.comment),
+            {'item_assignment_id': obj.id, 'review_id': None}
+            )
+    return (
+        obj.reviewer.estafette_id,
+        plain_text(obj.grade_motivation),
+        {'item_assignment_id': None, 'review_id': obj.id}
+        )
+
+
+# replaces the fingerprints in the index by those of the (saved) text of an item assignment
+# or a peer review
+def fingerprint_text(obj):
+    eid, text, key = form_text(obj)
+    with transaction.atomic():
+        TextFingerprint.objects.filter(**key).delete()
+        TextFingerprint.objects.bulk_create([
+            TextFingerprint(estafette_id=eid, value=v, **key)
+            for v in text_fingerprints(text)
+            ])
+
+
+# returns list of tuples (item assignment ID, review ID) of the texts in relay eid that
+# have fingerprints in common with text, in descending order of the number of these
+def texts_sharing_fingerprints(eid, text):
+    fps = list(text_fingerprints(text))
+    cnt = Counter()
+    for i in range(0, len(fps), MAX_LOOKUP_VALUES):
+        cnt.update(TextFingerprint.objects.filter(
+            estafette_id=eid,
+            value__in=fps[i:i + MAX_LOOKUP_VALUES]
+            ).values_list('item_assignment_id', 'review_id'))
+    return [k for k, n in cnt.most_common()]
+
+
+# scans the item comments of assignment a, and the review its author wrote of the work
+# that a builds on, for matches with the other item comments and review texts in the relay;
+# returns tuple (max. match percentage, min. match percentage, list of reports)
+# NOTE: like files, texts of related work are reported as RELATED (negative percentage)
+def scan_texts(a, related_ids):
+    max_perc = 0
+    min_perc = 0
+    reports = []
+    own = list(ItemAssignment.objects.filter(assignment=a).select_related('item'))
+    if a.predecessor_id:
+        own += list(PeerReview.objects.filter(reviewer=a.participant,
+            assignment_id=a.predecessor_id))
+    for obj in own:
+        eid, text, key = form_text(obj)
+        if len(text) < TEXT_MATCH_THRESHOLD:
+            continue
+        if isinstance(obj, ItemAssignment):
+            label = 'comment on item `{}`'.format(obj.item.name)
+        else:
+            label = 'review text'
+        for iaid, rid in texts_sharing_fingerprints(eid, text):
+            if iaid:
+                other = ItemAssignment.objects.select_related(
+                    'item', 'assignment__participant__student').get(pk=iaid)
+                if other.assignment.participant_id == a.participant_id:
+                    continue
+                other_label = 'comment on item `{}` of #{}'.format(
+                    other.item.name, other.assignment_id)
+                author = other.assignment.participant.student.dummy_name()
+                related = other.assignment_id in related_ids
+            else:
+                other = PeerReview.objects.select_related(
+                    'reviewer__student').get(pk=rid)
+                if other.reviewer_id == a.participant_id:
+                    continue
+                other_label = 'review text of #{}'.format(other.assignment_id)
+                author = other.reviewer.student.dummy_name()
+                related = False
+            n = 0
+            matching_text = ''
+            epolm = 0  # end position of last match
+            for p, size in matching_blocks(text, form_text(other)[1], MATCH_THRESHOLD):
+                n += size
+                if epolm > 0:
+                    matching_text += BLUE_ELLIPSIS.format(p - epolm)
+                epolm = p + size
+                matching_text += text[p:p + size]
+            if n < TEXT_MATCH_THRESHOLD:
+                continue
+            percentage = int(100 * n / len(text))
+            if related:
+                author = 'RELATED ' + author
+                matching_text = '_(matching text omitted because source is legitimate)_'
+            reports.append(
+                '####{}% text match ({} characters) of {} with {} <small>(by {})</small>\n'
+                .format(percentage, n, label, other_label, author)
+                + '<small>' + matching_text + '</small>')
+            log_message('-- {}% ({} characters) match of {} with {} by {}'.format(
+                percentage, n, label, other_label, author))
+            if related:
+                # NOTE: as for files, only a very large match with related work counts
+                if percentage >= 80:
+                    min_perc = min(min_perc, -percentage)
+            else:
+                max_perc = max(max_perc, percentage)
+    return (max_perc, min_perc, reports)
+
+
+# replaces the archived fingerprints of participant upload pu of assignment a by those
+# of its scanned text (without "tell-tales")
+def archive_fingerprints(a, pu, text):
+    fps = text_fingerprints(text.split(TELLTALE_SEPARATOR, 1)[0], ARCHIVE_WINNOW_WINDOW)
+    with transaction.atomic():
+        UploadFingerprint.objects.filter(upload=pu).delete()
+        UploadFingerprint.objects.bulk_create([
+            UploadFingerprint(
+                template_id=a.leg.template_id,
+                case_id=a.case_id,
+                estafette_id=a.participant.estafette_id,
+                upload=pu,
+                value=v
+                )
+            for v in fps
+            ])
+
+
+# archives the fingerprints of the uploaded files of assignment a (as these are scanned)
+# and returns the number of files archived
+# NOTE: needed once for files that were scanned before the archive existed, as from then
+#       on files are archived when they are scanned
+def archive_assignment(a):
+    to_ignore = strings_to_ignore(a) + COMMON_FRAGMENTS
+    boilerplate = boilerplate_shingles(a)
+    n = 0
+    for pu in ParticipantUpload.objects.filter(assignment=a):
+        path = upload_path(pu.upload_file.name)
+        ext = os.path.splitext(path)[1].lower()
+        if ext in ['.docx', '.pdf', '.pptx', '.xlsx'] and os.path.isfile(path):
+            archive_fingerprints(a, pu,
+                without_boilerplate(doc_text(path, to_ignore), boilerplate))
+            n += 1
+    return n
+
+
+# returns list of tuples (upload ID, number of shared fingerprints) of the files uploaded
+# before participant upload pu of assignment a, in other relays of the same template, that
+# share at least MIN_ARCHIVE_HITS archived fingerprints with pu, in descending order of
+# this number
+# NOTE: the archive is joined with itself on fingerprint value, so that the database finds
+#       these files through its (template, value) index rather than by comparing all files
+def archived_uploads_sharing_fingerprints(a, pu):
+    return list(UploadFingerprint.objects.filter(
+        template_id=a.leg.template_id,
+        value__in=UploadFingerprint.objects.filter(upload=pu).values('value'),
+        upload__time_uploaded__lt=pu.time_uploaded
+        ).exclude(
+        estafette_id=a.participant.estafette_id
+        ).values('upload_id').annotate(n=Count('id')).filter(
+        n__gte=MIN_ARCHIVE_HITS
+        ).order_by('-n').values_list('upload_id', 'n')[:MAX_ARCHIVE_MATCHES])
+
+
+# archives the fingerprints of the scanned files of assignment a (list of tuples (participant
+# upload, scanned text)), and compares these files with the files of earlier relays of the
+# same template that share fingerprints with them, except for the pairs [participant upload
+# ID, archived upload ID] in list done; yields tuple (pair, match percentage, report) for
+# each comparison, so that the caller can stop (and resume) the comparisons
+# NOTE: only files that share fingerprints with a scanned file are compared in full
+# NOTE: the participant's own work in an earlier relay is reported as RELATED
+def scan_archive(a, files, text_to_ignore, boilerplate, done=[]):
+    for pu, text in files:
+        archive_fingerprints(a, pu, text)
+        for upid, n in archived_uploads_sharing_fingerprints(a, pu):
+            if [pu.id, upid] in done:
+                continue
+            other = ParticipantUpload.objects.select_related(
+                'assignment__case',
+                'assignment__leg',
+                'assignment__participant__estafette',
+                'assignment__participant__student'
+                ).get(pk=upid)
+            oa = other.assignment
+            path = upload_path(other.upload_file.name)
+            if not os.path.isfile(path):
+                log_message('WARNING: Archived file {} not found'.format(path))
+                continue
+            log_message('-- {} fingerprints shared with {} of #{} in {}'.format(
+                n, other.file_name, oa.id, oa.participant.estafette.title_text()))
+            p, r = scan_report(
+                text,
+                '{}_{}{}'.format(other.file_name, oa.case.letter, oa.leg.number),
+                path,
+                oa.id,
+                oa.participant.student.dummy_name(),
+                '{} in {}'.format(
+                    timezone.localtime(other.time_uploaded).strftime(SHORT_DATE_TIME),
+                    oa.participant.estafette.title_text()
+                    ),
+                oa.participant.student.user_id == a.participant.student.user_id,
+                MATCH_THRESHOLD,
+                text_to_ignore,
+                boilerplate
+                )
+            yield ([pu.id, upid], p, r)
+
+
+# returns list of "strings to ignore" when comparing the texts of assignment a with other
+# texts: the case name, the mandatory section titles, and fragments of the case text
+def strings_to_ignore(a):
+    # (1) ignore case name and mandatory section titles (if any)
+    to_ignore = [a.case.name]
+    for l in EstafetteLeg.objects.filter(
+        template=a.leg.template,
+        number__lte=a.leg.number
+        ):
+        lt = l.required_section_title
+        if lt:
+            to_ignore.append(lt)
+    # (2) also ignore the assignment case introduction text
+    # NOTE: this is HTML, while participants will typically have copied its formatted version,
+    #       hence strip the HTML tags and non-breaking spaces
+    # NOTE: heuristic to replace introductory text even when it is slightly modified,
+    #       is to chunk it by sentence (split text at periods)
+    for t in strip_tags(' '.join(a.case.description.split('&nbsp;'))).split('.'):
+        st = t.strip()
+        # only retain fragments of substantial length (as text is also split at abbreviations!)
+        if len(st) > 5:
+            to_ignore.append(st)
+    return to_ignore
+
+
+# returns the text of the report of the completed scan of assignment a, or None if
+# there is no report
+# NOTE: reports used to be stored as files scan_<case letter><step number>.txt in the
+#       upload directory of the participant; these are stored as scan report when read
+def scan_report_text(a):
+    sr = ScanReport.objects.filter(assignment=a).first()
+    if sr:
+        return sr.text()
+    path = os.path.join(settings.MEDIA_ROOT, a.participant.upload_dir,
+        'scan_{}{}.txt'.format(a.case.letter, a.leg.number))
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    sr = ScanReport(assignment=a, time_scanned=a.time_scanned)
+    sr.set_text(text)
+    sr.save()
+    return text
+
+
+# returns the identifier of this scanner (a thread of a process on some host)
+def scan_owner():
+    return '{}:{}@{}'.format(os.getpid(), threading.get_ident(), socket.gethostname())[:64]
+
+
+# returns the checkpoint of the scan of assignment a, with this scanner as owner, or None
+# if another scanner holds its lease
+# NOTE: the lease is claimed by a conditional update, so that of scanners claiming the
+#       same checkpoint at the same time, only one will succeed
+def claim_checkpoint(a):
+    owner = scan_owner()
+    cp, created = ScanCheckpoint.objects.get_or_create(assignment=a)
+    now = timezone.now()
+    if not ScanCheckpoint.objects.filter(pk=cp.pk).filter(
+            Q(owner=owner) | Q(lease_expires__lt=now)
+            ).update(
+            owner=owner,
+            heartbeat=now,
+            lease_expires=now + timedelta(seconds=LEASE_SECONDS)
+            ):
+        return None
+    cp.refresh_from_db()
+    return cp
+
+
+# renews the lease on checkpoint cp (or releases it), and saves the scan state
+# returns False if another scanner has claimed the checkpoint
+def renew_lease(cp, state, release=False):
+    now = timezone.now()
+    return ScanCheckpoint.objects.filter(pk=cp.pk, owner=cp.owner).update(
+        owner='' if release else cp.owner,
+        heartbeat=now,
+        lease_expires=DEFAULT_DATE if release else now + timedelta(seconds=LEASE_SECONDS),
+        state=dumps(state)
+        ) > 0
+
+
 # scans the uploaded required files (e.g., "report") for the assignment with ID aid
 # returns a tuple (max. match percentage, scan report in HTML format)
-def scan_assignment(aid):
+# NOTE: a scan that takes more than max_seconds is saved as partial scan, to be resumed
+#       by the next call; max_seconds=None means no time limit
+def scan_assignment(aid, max_seconds=MAX_SECONDS):
     # track time needed for this (partial) scan
     start_time = time.time()
     # get the assignment to be scanned
@@ -416,21 +1120,12 @@ def scan_assignment(aid):
     if a.time_uploaded == DEFAULT_DATE or a.clone_of:
         return (0, '')
     upl_dir = os.path.join(settings.MEDIA_ROOT, a.participant.upload_dir)
-    # Directory may not exist yet (when relay template has no required files).
-    if not os.path.exists(upl_dir):
-        os.mkdir(upl_dir)
-    # Prepare to use two text files: one for progress and draft report, and
-    # one for complete report.
-    acl = a.case.letter + str(a.leg.number)
-    report_path = os.path.join(upl_dir, 'scan_{}.txt'.format(acl))
-    progress_path = os.path.join(upl_dir, 'progress_{}.txt'.format(acl))
 
     # If database record shows completed scan, check whether report exists.
     if a.time_scanned != DEFAULT_DATE:
-        # If report exists, read it, get the max. percentage,
-        # and return its contents
-        if os.path.isfile(report_path):
-            content = open(report_path, 'r').read()
+        content = scan_report_text(a)
+        # If report exists, get the max. percentage, and return its contents.
+        if content is not None:
             return (
                 a.scan_result,
                 markdown(content).replace(
@@ -440,24 +1135,22 @@ def scan_assignment(aid):
                     )
                 )
 
-    # If progress file exists, resume the scan.
+    # Claim the checkpoint of this scan; if another scanner holds its lease, leave
+    # the scan to that scanner.
+    cp = claim_checkpoint(a)
+    if not cp:
+        log_message('Scan of #{} by {} is in progress'.format(a.id, author))
+        return (0, '<p><em>Scan in progress</em></p>')
+
+    # If the checkpoint has a saved state, resume the scan.
     resuming = False
-    if os.path.isfile(progress_path):
+    if cp.state:
         try:
-            with open(progress_path, 'r') as ppf:
-                data = loads(ppf.read())
+            data = loads(cp.state)
             # get time since data was saved
-            t_diff = round(time.time() - data['start'])
-            # first verify that assignment IDs match
-            if data['aid'] != a.id:
-                log_message(
-                    'ERROR: Resuming scan ID mismatch (got #{} while expecting #{})'.format(
-                        data['aid'],
-                        a.id
-                        )
-                    )
-            # resume only if partial scan is less than 15 minutes old AND not busy
-            elif t_diff < 900 and not ('busy' in data):
+            t_diff = round(time.time() - data['saved'])
+            # resume only if partial scan was saved less than 15 minutes ago
+            if t_diff < RESUME_SECONDS:
                 # restore "legitimate source" ID list from data
                 prid_list = data['prids']
                 # restore "strings to ignore"
@@ -477,10 +1170,12 @@ def scan_assignment(aid):
                         'author': sa.participant.student.dummy_name(), 'uploaded': sa.time_uploaded}
                 # get the IDs of file uploads already scanned
                 spuid_list = data['spuids']
+                # and the pairs of files already compared with files of earlier relays
+                archived_list = data['archived']
                 log_message(
                     'Resuming scan of #{} by {} ({} seconds ago; {} scanned)'.format(
-                        data['aid'],
-                        data['author'],
+                        a.id,
+                        author,
                         t_diff,
                         len(spuid_list)
                         )
@@ -501,83 +1196,15 @@ def scan_assignment(aid):
     else:
         log_message('Starting scan of #{} by {}'.format(a.id, author))
 
-    # if no progress file OR unsuccessful resume, start from scratch
+    # if no saved state OR unsuccessful resume, start from scratch
     if not resuming:
-        # immediately create a provisionary progress file as "semaphore"
-        with open(progress_path, 'w') as f:
-            data = {'aid': a.id, 'start': time.time(), 'busy': True}
-            f.write(dumps(data))
-        # to avoid false positives, compile a list of assignment IDs that are related:
-        # (1) get ALL assignments for same case submitted (until now) by same participant
-        #     because it can occur that participants are assigned the same case in several steps
-        #     and then decide to reuse their own prior material
-        o_set = Assignment.objects.filter(
-            participant=a.participant,
-            case__letter=a.case.letter,
-            time_uploaded__lte=a.time_uploaded
-            )
-        # (2) for these assignments, get the consecutive predecessors up to step 1,
-        #     tracing cloned work to its original
-        prid_list = []
-        for o in o_set:
-            pr_a = o.predecessor
-            while pr_a:
-                # in case a clone was cloned, keep looking until the "true" original has been found
-                while pr_a.clone_of:
-                    pr_a = pr_a.clone_of
-                prid_list.append(pr_a.id)
-                pr_a = pr_a.predecessor
-        # (3) also get all clones of these assignments
-        c_list = Assignment.objects.filter(clone_of__in=prid_list).values_list('id', flat=True)
-        preds_and_clones = '-- predecessor IDs: {}; clone IDs: {}'.format(
-            ', '.join([str(i) for i in prid_list]),
-            ', '.join([str(i) for i in list(c_list)])
-            )
-        log_message(preds_and_clones)
-        prid_list += c_list
-        # (4) keep collecting IDs of successor assignments and clones of the "predecessors" found
-        #     (one generation at a time) until no more are found
-        n_set = set()
-        o_set = set(Assignment.objects.filter(
-            Q(predecessor__in=prid_list) | Q(clone_of__in=prid_list)
-            ).values_list('id', flat=True)) - n_set
-        while o_set:
-            n_set = n_set | o_set
-            o_set = set(Assignment.objects.filter(
-                Q(predecessor__in=o_set) | Q(clone_of__in=o_set)
-                ).values_list('id', flat=True)) - n_set
-        offspring = '-- offspring IDs: ' + ', '.join(
-            [str(i) for i in sorted(list(n_set))]
-            )
-        log_message(offspring)
-        prid_list = list(set(prid_list) | n_set)
-
-        # add the "legitimate source" ID list to the data dict
-        data['prids'] = prid_list
+        # to avoid false positives, compile a list of assignment IDs that are related
+        prid_list = related_assignment_ids(a)
+        log_message('-- related assignment IDs: ' + ', '.join(
+            [str(i) for i in sorted(prid_list)]))
 
         # next, determine "strings to ignore" when comparing texts
-        # (1) ignore case name and mandatory section titles (if any)
-        to_ignore = [a.case.name]
-        for l in EstafetteLeg.objects.filter(
-            template=a.leg.template,
-            number__lte=a.leg.number
-            ):
-            lt = l.required_section_title
-            if lt:
-                to_ignore.append(lt)
-        # (2) also ignore the assignment case introduction text
-        # NOTE: this is HTML, while participants will typically have copied its formatted version,
-        #       hence strip the HTML tags and non-breaking spaces
-        # NOTE: heuristic to replace introductory text even when it is slightly modified,
-        #       is to chunk it by sentence (split text at periods)
-        for t in strip_tags(' '.join(a.case.description.split('&nbsp;'))).split('.'):
-            st = t.strip()
-            # only retain fragments of substantial length (as text is also split at abbreviations!)
-            if len(st) > 5:
-                to_ignore.append(st)
-
-        # add "strings to ignore" to the data dict
-        data['ignore'] = to_ignore
+        to_ignore = strings_to_ignore(a)
 
         # assume no match with any other file
         max_perc = 0
@@ -604,26 +1231,59 @@ def scan_assignment(aid):
                 'uploaded': sa.time_uploaded
                 }
         # make a list of all IDs of assignments to be scanned
-        said_list = sa_dict.keys()
-
-        # add "assignments to scan" ID list to the data dict
-        data['saids'] = said_list
+        said_list = list(sa_dict.keys())
 
         # when scanning from scratch, no scanned participant uploads yet
         spuid_list = []
+        archived_list = []
+
+    # returns the state of this scan, to be saved in its checkpoint
+    def scan_state():
+        return {
+            'saved': time.time(),
+            'prids': prid_list,
+            'ignore': to_ignore,
+            'min_perc': min_perc,
+            'max_perc': max_perc,
+            'fsr': fsr,
+            'fs_cnt': fs_cnt,
+            'saids': said_list,
+            'spuids': spuid_list,
+            'archived': archived_list
+            }
+
+    # renews the lease now and then, saving the state so far, so that the scan can be
+    # resumed if this scanner crashes; returns False if another scanner has claimed the
+    # checkpoint (as this scan took too long to renew its lease)
+    def keep_lease():
+        nonlocal last_heartbeat
+        if time.time() - last_heartbeat > HEARTBEAT_SECONDS:
+            if not renew_lease(cp, scan_state()):
+                log_message('WARNING: Lost lease on scan of #{} by {}'.format(a.id, author))
+                return False
+            last_heartbeat = time.time()
+        return True
 
     # reduce sensitivity by ignoring typical text fragments
-    to_ignore += COMMON_FRAGMENTS
+    # NOTE: these are not part of the saved state
+    text_to_ignore = to_ignore + COMMON_FRAGMENTS
+    # and by removing the text that participants are given (as shingles, so that this text
+    # is also removed when it has been copied partially or with different layout)
+    boilerplate = boilerplate_shingles(a)
 
+    # keep track of the scanned files as tuples (participant upload, text)
+    scanned_files = []
     # assume that this (resumed) scan will complete the job
     scan_complete = True
+    last_heartbeat = time.time()
 
     # NOTE: for each assignment, multiple files may have been uploaded
     fl = a.leg.file_list()
     for f in fl:
-        # only scan DOCX, XLSX and PDF files
+        # only scan DOCX, PPTX, XLSX and PDF files
         if not (
             '.docx' in f['types']
+            or '.pptx' in f['types']
             or '.xlsx' in f['types']
             or '.pdf' in f['types']
             ):
@@ -637,7 +1297,10 @@ def scan_assignment(aid):
             file1 = '{}_{}{}'.format(f['name'], a.case.letter, a.leg.number)
             pu = pul.first()
             path1 = os.path.join(upl_dir, os.path.basename(pu.upload_file.name))
-            text1 = ascii_from_doc(path1, to_ignore)
+            text1 = without_boilerplate(doc_text(path1, text_to_ignore), boilerplate)
+            scanned_files.append((pu, text1))
+            if path1.lower().endswith('.xlsx'):
+                record_layout_telltales(pu, text1)
             # get uploads for all relevant assignments
             u_list = ParticipantUpload.objects.filter(
                 assignment__id__in=said_list,
@@ -649,18 +1312,12 @@ def scan_assignment(aid):
             for u in u_list:
                 # exit inner loop if maximum scans reached, or maximum time has passed
                 # NOTE: we do that here because at this point we know there is still work to do
-                if time.time() - start_time > MAX_SECONDS:
+                if max_seconds and time.time() - start_time > max_seconds:
                     # indicate that scan is incomplete
                     scan_complete = False
                     break
                 sa = sa_dict[u['assignment__id']]
-                # workaround to deal with bug (?) in Django that makes that upload_file fields
-                # sometimes include the MEDIA_ROOT (without leading slash) and sometimes not
-                mr = settings.MEDIA_ROOT.strip(r'\/')
-                if u['upload_file'].find(mr) == 0:
-                    path2 = settings.LEADING_SLASH + u['upload_file']
-                else:
-                    path2 = os.path.join(settings.MEDIA_ROOT, u['upload_file'])
+                path2 = upload_path(u['upload_file'])
                 file2 = '{}_{}{}'.format(f['name'], a.case.letter, sa['leg'])
                 # NOTE: The author's participant ID will allow identification
                 #       by dummy_name(), the upload time is relevant info for
@@ -675,7 +1332,8 @@ def scan_assignment(aid):
                     sa['uploaded'].strftime(SHORT_DATE_TIME),
                     u['assignment__id'] in prid_list,
                     MATCH_THRESHOLD,
-                    to_ignore
+                    text_to_ignore,
+                    boilerplate
                     )
                 fsr.append(r)
                 # keep track of high AND low values (the latter indicating a match with RELATED work)
@@ -684,17 +1342,40 @@ def scan_assignment(aid):
                 fs_cnt += 1
                 # add upload ID to list of scanned upload IDs
                 spuid_list.append(u['id'])
+                if not keep_lease():
+                    return (max_perc, '<p><em>Scan in progress</em></p>')
         # when maximum duration reached, also exit outer loop
-        if time.time() - start_time > MAX_SECONDS:
+        if max_seconds and time.time() - start_time > max_seconds:
             break
 
-    # TO DO: also scan assignment items
-    # NOTE: all assignment items are collated into to a single string, which is then
-    #       stripped from all its HTML tags (as item texts are HTML)
-    # NOTE: this stripping is done "smartly" so that, e.g., </li><li> and </p><p> are
-    #       replaced by a space to avoid sticking words together
+    if scan_complete:
+        # Archive the fingerprints of the scanned files, and compare these files
+        # with the files of earlier relays that share fingerprints with them.
+        # NOTE: like the files of this relay, these are compared within the time
+        #       limit, and the comparisons made so far are saved in the state
+        if max_seconds and time.time() - start_time > max_seconds:
+            scan_complete = False
+        else:
+            for pair, p, r in scan_archive(a, scanned_files, text_to_ignore, boilerplate,
+                    archived_list):
+                fsr.append(r)
+                max_perc = max(p, max_perc)
+                min_perc = min(p, min_perc)
+                fs_cnt += 1
+                archived_list.append(pair)
+                if not keep_lease():
+                    return (max_perc, '<p><em>Scan in progress</em></p>')
+                if max_seconds and time.time() - start_time > max_seconds:
+                    scan_complete = False
+                    break
 
     if scan_complete:
+        # Also scan the item comments and the review text (these are short, and
+        # are found through the fingerprint index, so this takes little time).
+        p_max, p_min, reports = scan_texts(a, prid_list)
+        fsr += reports
+        max_perc = max(p_max, max_perc)
+        min_perc = min(p_min, min_perc)
         # Report the results.
         t_diff = time.time() - start_time
         stats = '{} files scanned; scan took {:4.3f} seconds.'.format(
@@ -711,22 +1392,23 @@ def scan_assignment(aid):
             max_perc,
             timezone.now().strftime(SHORT_DATE_TIME)
             )) + '\n\n'.join(fsr)
-        with open(report_path, 'wb') as text_file:
-            text_file.write(content.encode('utf-8'))
-        # Update time scanned attribute of assignment.
-        a.time_scanned = timezone.now()
-        # NOTE: If 5% or more overlap, or more unrelated overlap than related
-        #       overlap, show this percentage.
-        if max_perc >= 5 or max_perc > abs(min_perc):
-            a.scan_result = max_perc
-        else:
-            a.scan_result = min_perc
-        a.save()
-        # Remove the progress file.
-        try:
-            os.remove(progress_path)
-        except:
-            pass
+        # NOTE: The report, the assignment and the checkpoint are updated together.
+        with transaction.atomic():
+            # Update time scanned attribute of assignment.
+            a.time_scanned = timezone.now()
+            # NOTE: If 5% or more overlap, or more unrelated overlap than related
+            #       overlap, show this percentage.
+            if max_perc >= 5 or max_perc > abs(min_perc):
+                a.scan_result = max_perc
+            else:
+                a.scan_result = min_perc
+            a.save()
+            sr, created = ScanReport.objects.get_or_create(assignment=a)
+            sr.time_scanned = a.time_scanned
+            sr.set_text(content)
+            sr.save()
+            # The checkpoint is no longer needed.
+            ScanCheckpoint.objects.filter(pk=cp.pk).delete()
         # style the first header to make it display in the appropriate status color
         content = markdown(content).replace(
             '<h2>',
@@ -752,20 +1434,8 @@ def scan_assignment(aid):
                 t_diff
                 )
             )
-        # add the report to the data dict
-        data['author'] = author
-        data['min_perc'] = min_perc
-        data['max_perc'] = max_perc
-        data['fsr'] = fsr
-        data['fs_cnt'] = fs_cnt
-        # add the list of scanned upload files
-        data['spuids'] = spuid_list
-        # unset the "busy" flag
-        if 'busy' in data:
-            del data['busy']
-        # overwrite the provisionary progress file
-        with open(progress_path, 'w') as f:
-            f.write(dumps(data))
+        # save the state, and release the lease so that the next call can resume the scan
+        renew_lease(cp, scan_state(), release=True)
         return (
             max_perc,
             '<p><em>Scan still incomplete ({} checked)</em></p>'.format(fs_cnt)
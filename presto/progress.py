@@ -41,6 +41,7 @@ import os
 from PIL import Image, ImageDraw, ImageFont
 
 # presto modules
+from presto.cache import relay_leg_count
 from presto.generic import generic_context, has_role, change_role
 from presto.teams import team_assignments, team_final_reviews, team_lookup_dict
 from presto.utils import encode, decode, log_message
@@ -110,7 +111,7 @@ def progress(request, **kwargs):
                 # draw white letter o to produce neat circular outline
                 draw.text((x-1.5, y-14.5), 'o', font=fnt, fill=(255, 255, 255, 255))
             # get nr and submission time for this participant's final reviews
-            nr_of_steps = ce.estafette.template.nr_of_legs()
+            nr_of_steps = relay_leg_count(ce.id)
             r_set = team_final_reviews(p).values('reviewer__id', 'time_submitted'
                 ).order_by('reviewer__id', 'time_submitted')
             r_index = 0
@@ -152,7 +153,7 @@ def update_progress_chart(ce):
     # calculate how many seconds of estafette time is represented by one bar
     time_step = int((ce.end_time - ce.start_time).total_seconds() / BAR_CNT) + 1
     # one count array for every estafette leg...
-    nr_of_steps = ce.estafette.template.nr_of_legs()
+    nr_of_steps = relay_leg_count(ce.id)
     # initialize arrays with y-values to zero
     y = [[0.0 for col in range(BAR_CNT + 1)]
         for row in range(nr_of_steps + ce.final_reviews + 1)]
@@ -0,0 +1,196 @@
+"""
+Software developed by Pieter W.G. Bots for the PrESTO project
+Code repository: https://github.com/pwgbots/presto
+Project wiki: http://presto.tudelft.nl/wiki
+
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.db.models import Q
+
+from .models import (
+    DEFAULT_DATE,
+    EstafetteLeg,
+    ItemAssignment,
+    ItemReview,
+    MINIMUM_INSTRUCTOR_WORD_COUNT,
+    PeerReview
+    )
+
+# presto modules
+from presto.teams import team_appeals, team_assignments
+from presto.utils import word_count
+
+
+# groups the data on participant p (and its team) that are needed to build the list of tasks
+# in the student view
+# NOTE: all data are fetched with a fixed number of queries, so that the number of database
+#       lookups does not grow with the progress made by the participant
+class ParticipantSnapshot(object):
+
+    def __init__(self, p, steps):
+        self.participant = p
+        self.steps = steps
+        # all assignments of the participant (or team), last step first
+        self.assignments = list(team_assignments(p).select_related(
+            'leg', 'case__upload',
+            'predecessor__leg', 'predecessor__case__upload', 'predecessor__participant'
+            ).order_by('-leg__number'))
+        # the subset that already has been uploaded
+        self.uploaded = [a for a in self.assignments if a.time_uploaded > DEFAULT_DATE]
+        # all reviews given AND received by the participant, in order of creation
+        self.reviews = list(PeerReview.objects.filter(
+            Q(reviewer=p) | Q(assignment__participant=p)
+            ).select_related(
+            'reviewer__student',
+            'assignment__leg', 'assignment__case__upload', 'assignment__participant',
+            'assignment__successor__leg'
+            ).order_by('id'))
+        # decided appeals that have not been acknowledged yet
+        self.appeals = list(team_appeals(p, True).select_related(
+            'referee',
+            'review__assignment__leg', 'review__assignment__case',
+            'review__assignment__participant__estafette',
+            'review__assignment__participant__student__course__language'
+            ).order_by('id'))
+        # IDs of the instructors of the course (appeals they decided cannot be objected to)
+        self.instructor_ids = set(
+            p.estafette.course.instructors.values_list('id', flat=True)
+            )
+        # collect the assignments for which items may be listed
+        a_dict = {}
+        for a in self.assignments:
+            a_dict[a.id] = a
+            if a.predecessor:
+                a_dict[a.predecessor.id] = a.predecessor
+        for r in self.reviews:
+            a_dict[r.assignment.id] = r.assignment
+        # get the upload items of their legs, and the review items of the reviewed legs
+        lids = set([a.leg_id for a in a_dict.values()])
+        rlids = set([r.assignment.leg_id for r in self.reviews])
+        self.upload_items = self._leg_items(EstafetteLeg.upload_items.through, lids)
+        self.review_items = self._leg_items(EstafetteLeg.review_items.through, rlids)
+        # get all the item assignments and item reviews at once
+        self.item_assignments = {aid: [] for aid in a_dict}
+        for ia in ItemAssignment.objects.filter(
+                assignment__id__in=list(a_dict)).select_related('item'):
+            self.item_assignments[ia.assignment_id].append(ia)
+        self.item_reviews = {r.id: [] for r in self.reviews}
+        for ir in ItemReview.objects.filter(
+                review__id__in=list(self.item_reviews)).select_related('item'):
+            self.item_reviews[ir.review_id].append(ir)
+
+    # returns a dict {leg ID: [items]} for the legs with ID in lids, via the M2M table tt
+    def _leg_items(self, tt, lids):
+        li_dict = {lid: [] for lid in lids}
+        for li in tt.objects.filter(estafetteleg__id__in=list(lids)).select_related('item'):
+            li_dict[li.estafetteleg_id].append(li.item)
+        # NOTE: items are ordered by number (as in their Meta class)
+        for l in li_dict.values():
+            l.sort(key=lambda i: i.number)
+        return li_dict
+
+    # returns the same list as a.item_list(), but without querying the database
+    def item_list(self, a):
+        # fall back on the model method for assignments not in this snapshot
+        if not a.id in self.item_assignments:
+            return a.item_list()
+        il = [{
+            'item': i,
+            'comment': '',
+            'cmnt_words': 0,
+            'rating': 0,
+            'min_words': i.word_count
+            } for i in self.upload_items[a.leg_id]]
+        for ia in self.item_assignments[a.id]:
+            il[ia.item.number - 1].update({
+                'comment': ia.comment,
+                'cmnt_words': word_count(ia.comment),
+                'rating': ia.rating
+                })
+        return il
+
+    # returns the same list as pr.item_list(), but without querying the database
+    def review_item_list(self, pr):
+        # fall back on the model method for reviews not in this snapshot (e.g., just created)
+        if not pr.id in self.item_reviews:
+            return pr.item_list()
+        instr_rev = pr.reviewer.student.dummy_index < 0
+        il = [{
+            'item': i,
+            'comment': '',
+            'cmnt_words': 0,
+            'rating': 0,
+            'min_words': (
+                min(MINIMUM_INSTRUCTOR_WORD_COUNT, i.word_count) if instr_rev
+                else i.word_count
+                )
+            } for i in self.review_items[pr.assignment.leg_id]]
+        for ir in self.item_reviews[pr.id]:
+            il[ir.item.number - 1].update({
+                'comment': ir.comment,
+                'cmnt_words': word_count(ir.comment),
+                'rating': ir.rating
+                })
+        return il
+
+    # returns the reviews given by the participant
+    def given_reviews(self):
+        pid = self.participant.id
+        return [r for r in self.reviews if r.reviewer_id == pid]
+
+    # returns the final reviews given by the participant
+    def final_reviews(self):
+        return [r for r in self.given_reviews() if r.assignment.leg.number == self.steps]
+
+    # returns the final reviews that still need to be submitted
+    def pending_final_reviews(self):
+        return [r for r in self.final_reviews() if r.time_submitted <= DEFAULT_DATE]
+
+    # returns the given reviews that still need to be submitted
+    # NOTE: only relevant for "instructor participants"
+    def pending_reviews(self):
+        return [r for r in self.given_reviews() if r.time_submitted <= DEFAULT_DATE]
+
+    # returns the submitted reviews of the participant's own work that still need to be appraised
+    # NOTE: only reviews of work that the successor has uploaded (or rejected) count,
+    #       and the assignment should not be a clone (owned by the student needing one)
+    def reviews_to_appraise(self):
+        pid = self.participant.id
+        rl = []
+        for r in self.reviews:
+            a = r.assignment
+            if (a.participant_id != pid or r.time_submitted == DEFAULT_DATE
+                    or r.time_appraised != DEFAULT_DATE or a.clone_of_id):
+                continue
+            if (a.successor and a.successor.time_uploaded == DEFAULT_DATE
+                    and not r.is_rejection):
+                continue
+            rl.append(r)
+        return rl
+
+    # returns the appraised reviews given by the participant that have not been acknowledged yet
+    def appraisals_to_acknowledge(self):
+        return [r for r in self.given_reviews()
+            if r.time_appraised != DEFAULT_DATE and r.time_acknowledged == DEFAULT_DATE]
+
+    # returns True if appeal ap has been decided by an instructor of the course
+    def decided_by_instructor(self, ap):
+        return ap.referee.user_id in self.instructor_ids
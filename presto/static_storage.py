@@ -0,0 +1,165 @@
+"""
+Software developed by Pieter W.G. Bots for the PrESTO project
+Code repository: https://github.com/pwgbots/presto
+Project wiki: http://presto.tudelft.nl/wiki
+
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+When "manage.py collectstatic" is run, this storage (see STATICFILES_STORAGE in
+settings.py) copies the static files to STATIC_ROOT under names that include a
+hash of their content (e.g., presto.55e7cbb9ba48.css), so that browsers can
+cache them "forever": when a file changes, so does its name. Then, as part of
+the same build step, PNG and JPEG images are recompressed without loss, and
+compressed .gz (and .br) variants are written for text-based files, so that
+the web server can send these instead of compressing on the fly.
+"""
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+# python modules
+import gzip
+from io import BytesIO
+import os
+from PIL import Image
+from shutil import which
+import subprocess
+
+try:
+    import brotli
+except ImportError:
+    # without the Brotli package, only .gz variants are written
+    brotli = None
+
+# files having these extensions are precompressed
+COMPRESSED_EXTENSIONS = ['.css', '.js', '.svg', '.json', '.map', '.txt', '.eot', '.ttf']
+
+# files smaller than this (in bytes) are not worth compressing
+MIN_COMPRESS_SIZE = 256
+
+
+# returns data compressed with gzip
+# NOTE: mtime=0 makes the result depend only on the data
+def gzipped(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+# returns data losslessly recompressed if this makes it smaller, or None otherwise
+def recompressed_png(data):
+    img = Image.open(BytesIO(data))
+    # NOTE: gamma and chromaticity chunks would be lost, which might affect appearance
+    if [k for k in ['gamma', 'srgb', 'chromaticity'] if k in img.info]:
+        return None
+    # keep the chunks that affect how the image is shown (but not text chunks)
+    kwargs = dict([(k, img.info[k]) for k in ['dpi', 'transparency', 'icc_profile']
+        if k in img.info])
+    buf = BytesIO()
+    img.save(buf, 'PNG', optimize=True, **kwargs)
+    new_data = buf.getvalue()
+    if len(new_data) >= len(data):
+        return None
+    # verify that every pixel is the same
+    new_img = Image.open(BytesIO(new_data))
+    if (new_img.mode != img.mode or new_img.size != img.size
+            or new_img.tobytes() != img.tobytes()):
+        return None
+    return new_data
+
+
+# returns data losslessly recompressed by jpegtran if this makes it smaller, or None otherwise
+# NOTE: Pillow can only re-encode JPEG images (which is lossy), so jpegtran is used when
+#       it is installed
+def recompressed_jpeg(path):
+    cmd = which('jpegtran')
+    if not cmd:
+        return None
+    p = subprocess.run([cmd, '-copy', 'all', '-optimize', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if p.returncode != 0 or not p.stdout or len(p.stdout) >= os.path.getsize(path):
+        return None
+    return p.stdout
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest static files storage that also writes optimized images and
+    precompressed variants of the collected files.
+    """
+
+    # NOTE: some templates compose static file names, so names that are not in the
+    #       manifest are hashed on the fly rather than causing an error
+    manifest_strict = False
+
+    # returns the hashed name for file name (or the name itself if the file does not exist)
+    # NOTE: some style sheets and scripts refer to files that are not part of the static
+    #       files (e.g., source maps); these references are left as they are
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            if content is not None:
+                raise
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # optimize the original files as well as their hashed copies
+        for name in sorted(paths.keys()):
+            hashed_name = self.hashed_files.get(self.hash_key(self.clean_name(name)))
+            self.optimize([n for n in [name, hashed_name] if n and self.exists(n)])
+
+    # recompresses the image files in list names (all having the same content), or writes
+    # compressed variants of these text files
+    def optimize(self, names):
+        if not names:
+            return
+        # NOTE: style sheets may differ from their hashed copy, as their URLs are replaced
+        path = self.path(names[0])
+        ext = os.path.splitext(names[0])[1].lower()
+        if ext in COMPRESSED_EXTENSIONS:
+            for name in names:
+                path = self.path(name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if len(data) >= MIN_COMPRESS_SIZE:
+                    self.write_variant(path + '.gz', data, gzipped(data))
+                    if brotli:
+                        self.write_variant(path + '.br', data, brotli.compress(data))
+            return
+        if ext == '.png':
+            with open(path, 'rb') as f:
+                data = recompressed_png(f.read())
+        elif ext in ['.jpg', '.jpeg']:
+            data = recompressed_jpeg(path)
+        else:
+            return
+        if data:
+            for name in names:
+                with open(self.path(name), 'wb') as f:
+                    f.write(data)
+
+    # writes the compressed variant of data if it is worth it (and removes it otherwise)
+    def write_variant(self, path, data, compressed):
+        if len(compressed) < 0.95 * len(data):
+            with open(path, 'wb') as f:
+                f.write(compressed)
+        elif os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,174 @@
+"""
+Software developed by Pieter W.G. Bots for the PrESTO project
+Code repository: https://github.com/pwgbots/presto
+Project wiki: http://presto.tudelft.nl/wiki
+
+Copyright (c) 2022 Delft University of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Greedy String Tiling (GST) finds the longest common substrings of two texts
+(here: sequences of words) one after the other, and "marks" them as tiles, so
+that no word is part of more than one tile. Unlike difflib.SequenceMatcher, it
+also finds blocks that were moved or reordered, and it does not need junk
+heuristics. The Running-Karp-Rabin variant (Wise, 1993) finds the candidate
+matches of a given length by comparing rolling hash values of word windows, so
+each iteration takes (roughly) linear time.
+"""
+
+# python modules
+import re
+
+# words are runs of non-white space characters
+WORD_RE = re.compile(r'\S+')
+
+# minimum number of words in a tile
+MIN_TILE_WORDS = 4
+
+# the search starts with matches of this many words
+INITIAL_SEARCH_LENGTH = 32
+
+# windows that occur more often than this in one text (e.g., in tables) are ignored,
+# as comparing all their pairs of positions would take quadratic time
+MAX_WINDOW_OCCURRENCES = 100
+
+# base and modulus for the rolling hash
+HASH_BASE = 1000003
+HASH_MOD = (1 << 61) - 1
+
+
+# returns list of (word, start, end) for the words in text
+def words(text):
+    return [(m.group(), m.start(), m.end()) for m in WORD_RE.finditer(text)]
+
+
+# returns dict {hash value: list of start positions} for all windows of s unmarked
+# tokens in sequence seq
+def window_hashes(seq, marked, s):
+    hashes = {}
+    top = pow(HASH_BASE, s - 1, HASH_MOD)
+    n = len(seq)
+    i = 0
+    while i + s <= n:
+        # skip marked tokens, as windows may not contain them
+        if marked[i]:
+            i += 1
+            continue
+        # find the end of this run of unmarked tokens
+        j = i
+        while j < n and not marked[j]:
+            j += 1
+        if j - i >= s:
+            h = 0
+            for k in range(i, i + s):
+                h = (h * HASH_BASE + seq[k]) % HASH_MOD
+            hashes.setdefault(h, []).append(i)
+            for k in range(i + s, j):
+                h = ((h - seq[k - s] * top) * HASH_BASE + seq[k]) % HASH_MOD
+                hashes.setdefault(h, []).append(k - s + 1)
+        i = j
+    return hashes
+
+
+# returns list of tuples (position in a, position in b, length) of the maximal matches
+# of at least s unmarked tokens, or list with only the first match longer than 2 * s
+def scan_pattern(a, b, marked_a, marked_b, s):
+    matches = []
+    b_hashes = window_hashes(b, marked_b, s)
+    for h, a_starts in window_hashes(a, marked_a, s).items():
+        b_starts = b_hashes.get(h)
+        if (not b_starts or len(b_starts) > MAX_WINDOW_OCCURRENCES
+                or len(a_starts) > MAX_WINDOW_OCCURRENCES):
+            continue
+        for i in a_starts:
+            for j in b_starts:
+                # skip matches that extend to the left, as these are part of a longer
+                # match that starts earlier
+                if (i and j and a[i - 1] == b[j - 1]
+                        and not marked_a[i - 1] and not marked_b[j - 1]):
+                    continue
+                # verify the match (hash values may collide), and extend it
+                if a[i:i + s] != b[j:j + s]:
+                    continue
+                k = s
+                while (i + k < len(a) and j + k < len(b) and a[i + k] == b[j + k]
+                        and not marked_a[i + k] and not marked_b[j + k]):
+                    k += 1
+                if k > 2 * s:
+                    # the search length is too short: restart with a longer one
+                    return [(i, j, k)]
+                matches.append((i, j, k))
+    return matches
+
+
+# returns list of tuples (position in a, position in b, length) of the tiles of token
+# sequences a and b, in order of position in a
+def greedy_string_tiling(a, b, min_length=MIN_TILE_WORDS):
+    marked_a = [False] * len(a)
+    marked_b = [False] * len(b)
+    tiles = []
+    s = max(min_length, INITIAL_SEARCH_LENGTH)
+    while True:
+        matches = scan_pattern(a, b, marked_a, marked_b, s)
+        max_match = max([k for i, j, k in matches], default=0)
+        if max_match > 2 * s:
+            s = max_match
+            continue
+        # mark the matches as tiles, longest first, unless they are occluded by tiles
+        # found before
+        occluded = False
+        matches.sort(key=lambda m: (-m[2], m[0], m[1]))
+        for i, j, k in matches:
+            if any(marked_a[i:i + k]) or any(marked_b[j:j + k]):
+                occluded = True
+                continue
+            for x in range(k):
+                marked_a[i + x] = True
+                marked_b[j + x] = True
+            tiles.append((i, j, k))
+        # the unmarked parts of occluded matches may still be long enough, so then
+        # search again with the same length
+        # NOTE: this ends, as each search marks at least one tile
+        if occluded:
+            continue
+        if s > 2 * min_length:
+            s //= 2
+        elif s > min_length:
+            s = min_length
+        else:
+            break
+    return sorted(tiles)
+
+
+# returns list of tuples (position, size) of the blocks of text a that also occur in text b,
+# as tiles of at least MIN_TILE_WORDS words and at least min_length characters
+# NOTE: positions and sizes are in characters, as for difflib.SequenceMatcher
+def matching_blocks(text_a, text_b, min_length):
+    wa = words(text_a)
+    wb = words(text_b)
+    # represent words by integers (for hashing)
+    ids = {}
+    a = [ids.setdefault(w, len(ids) + 1) for w, i, j in wa]
+    b = [ids.setdefault(w, len(ids) + 1) for w, i, j in wb]
+    blocks = []
+    for i, j, k in greedy_string_tiling(a, b):
+        start = wa[i][1]
+        end = wa[i + k - 1][2]
+        if end - start >= min_length:
+            blocks.append((start, end - start))
+    return blocks
@@ -26,7 +26,7 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.db.models import Count, Q
 from django.http import HttpResponse
 from django.shortcuts import render
@@ -81,19 +81,19 @@ from presto.generic import (
     warn_user
     )
 from presto.history_view import decided_appeal_dict
-from presto.plag_scan import scan_one_assignment
+from presto.plag_scan import record_telltales, scan_one_assignment
 from presto.scan import (
     contains_comments,
     missing_key_words,
     missing_sections
     )
+from presto.snapshot import ParticipantSnapshot
 from presto.teams import (
     authorized_participant,
     current_team_leader,
     extended_assignment_deadline,
     extended_review_deadline,
     sometime_team_partners,
-    team_appeals,
     team_as_html,
     team_assignments,
     team_final_reviews,
@@ -118,6 +118,274 @@ from presto.utils import (
     YOUR_OPINIONS
     )
 
+# number of times the next step is assigned when concurrent actions interfere
+MAX_ASSIGN_ATTEMPTS = 3
+
+
+# assigns step next_leg to participant p, building on (a clone of) the work of another
+# participant in the preceding step, while avoiding cases in c_list (the IDs of the cases
+# p already worked on), and returns the tuple (new assignment, True iff p's own work was
+# cloned to build on)
+# NOTE: should be called within a transaction, as it may fail with an IntegrityError when
+#       a concurrent action assigns the same step (or takes the same predecessor)
+def assign_next_step(p, next_leg, c_list, user):
+    p_relay = p.estafette
+    last_nr = next_leg.number - 1
+    # (6) find "eligible" assignments for the student to build on
+    # NOTE: we must also filter out the PREDECESSORS of rejected assignments,
+    #       (i.e., the assignments of which the uploaded work was rejected)
+    #       because the elig_set is possibly used later on to identify clone
+    #       candidates
+    rejids = Assignment.objects.filter(participant__estafette=p_relay,
+        leg__number=next_leg.number, is_rejected=True).values_list('predecessor__id')
+    log_message(
+        'TRACE - predecessor IDs of rejected assignments: ' + str(rejids),
+        user
+        )
+    elig_set = Assignment.objects.filter(
+        participant__estafette=p_relay, leg__number=last_nr, is_rejected=False,
+        is_retired=False, clone_of__isnull=True, time_uploaded__gt=DEFAULT_DATE
+        ).exclude(id__in=rejids)
+    # elig_set now contains "eligible" predecessors, because:
+    # a) same course-estafette, b) preceding step, c) not rejected (work),
+    # d) not a "clone" of another assignment, and e) uploaded work
+    # NOTE: we exclude "clones" to prevent "cloning clones"
+    log_message(
+        'TRACE - eligible predecessors: '
+            + ', '.join([str(a) for a in elig_set]),
+        user
+        )
+
+    # (7) ideally, elig_set has a subset of assignments having no successor yet
+    #     and having a case that the student has not worked on yet, but we
+    #     plan for the worst case of neither condition being TRUE
+    no_successor = False
+    new_case = False
+
+    # start with the complete set of eligible predecessors
+    pr_set = elig_set
+    # narrow it down to those w/o successor and having a new case
+    sub_set = pr_set.filter(successor__isnull=True).exclude(case__in=c_list)
+    log_message(
+        'TRACE - preferred predecessors: '
+            + ', '.join([str(a) for a in sub_set]),
+        user
+        )
+    # if both conditions can be met, the predecessor set can be limited
+    # to this subset
+    if sub_set:
+        pr_set = sub_set
+        no_successor = True
+        new_case = True
+    else:
+        # (8) see if duplicate cases can be avoided by "cloning"
+        sub_set = elig_set.exclude(case__in=c_list)
+        # NOTE: avoid cloning the same assignment twice, as this would
+        #       violate the uniqueness constraint
+        # to effectuate this, get the clones of the subset
+        clone_set = Assignment.objects.filter(clone_of__in=sub_set)
+        # and then remove from the subset the assignments already having a clone
+        sub_set = sub_set.exclude(
+            id__in=clone_set.values_list('clone_of', flat=True))
+        log_message(
+            'TRACE - still clonable predecessors with new case: '
+                + ', '.join([str(a) for a in sub_set]),
+            user
+            )
+        # if so, use this subset of assignments with "new" cases (and successor)
+        if sub_set:
+            pr_set = sub_set
+            new_case = True
+        else:
+            # (9) if duplicate cases cannot be avoided, revert to the eligible
+            #     assignments (regardless of their case) having no successor
+            pr_set = elig_set.filter(successor__isnull=True)
+            log_message(
+                'TRACE - eligible predecessors with known case: '
+                    + ', '.join([str(a) for a in pr_set]),
+                user
+                )
+            if pr_set:
+                no_successor = True
+                # try to exclude the student's own previous step
+                sub_set = pr_set.exclude(participant=p)
+                if sub_set:
+                    pr_set = sub_set
+
+    # now pr_set is "the best we can do", i.e., in order of preference, either:
+    #  (1) NEW case, NO successor (ideal situation)
+    #  (2) NEW case, a successor, but NO clone
+    #  (3) OLD case, NO successor (3rd choice because different cases are preferred)
+    #  (4) OLD case, a successor, but NO clone
+    # and in all 4 cases, the participant's own work is excluded if possible
+
+    # NOTE: pr_set cannot be empty because there always should be at least
+    #       one assignment: the previous step of the student;
+    #       even so, we double-check
+    if not pr_set:
+        raise ValueError('No previous assignment found')
+    else:
+        log_message(
+            'TRACE - "best we can do" predecessors: '
+                + ', '.join([str(a) for a in pr_set]),
+                user
+            )
+
+    # if pr_set contains "free" assignments (case 1 or 3), choose the "best" one
+    if no_successor:
+        # get the case occurrence in the set
+        case_set = pr_set.values('case__id', 'case__letter'
+            ).annotate(c_count=Count('case')
+            ).order_by('-c_count')
+        # print it in readable form
+        ac_str = ', '.join([x['case__letter'] + str(x['c_count']) for x in case_set])
+        log_message('TRACE - case occurrence: ' + ac_str, user)
+        # get the highest count (NOTE: several cases may have this occurrence)
+        high_count = case_set.first()['c_count']
+        # get the case IDs of cases having the highest occurrence
+        high_case_ids = []
+        for x in case_set:
+            if x['c_count'] == high_count:
+                high_case_ids.append(x['case__id'])
+        # (10) select the "best" remaining assignment as predecessor
+        pr_list = list(pr_set.filter(case__in=high_case_ids
+            ).select_related('participant'))
+        pr_list.sort(key=lambda a: -a.participant.progress())
+        # NOTE: the list is ordered in decreasing order of progress
+        #       so that the "fast runners" are preferred over "slow runners"
+        log_message(
+            'TRACE - sorted retained predecessors: '
+                + ', '.join([str(a) for a in pr_list]),
+                user
+                )
+        pr_a = pr_list[0]
+
+        # NOTE: this predecessor work may be authored by the same participant!
+        if pr_a.participant == p:
+            # if so, it should be cloned as a selfie ...
+            clone, created = Assignment.objects.get_or_create(
+                participant=pr_a.participant,
+                case=pr_a.case, leg=pr_a.leg, time_assigned=pr_a.time_assigned,
+                time_uploaded=pr_a.time_uploaded, clone_of=pr_a,
+                is_selfie=True)
+            if not created:
+                log_message(
+                    'WARNING: attempt to create selfie clone again: '
+                        + str(clone),
+                    user
+                    )
+            # ... and the selfie should be used as predecessor assignment
+            pr_a = clone
+
+        # (11) create a new assignment that builds on the selected one
+        a, created = Assignment.objects.get_or_create(participant=p,
+            case=pr_a.case, leg=next_leg,
+            predecessor=pr_a)  # other fields have their default value
+        if not created:
+            log_message(
+                'WARNING: attempt to assign step {} again (ID {})'.format(
+                    next_leg.number,
+                    a.id
+                    ),
+                user
+                )
+        # (12) also link the predecessor's assignment to the new one
+        #      (so as to facilitate database lookups later on)
+        pr_a.successor = a
+        pr_a.save()
+        log_message(
+            'Work assigned: ' + str(pr_a),
+            user
+            )
+        return (a, False)
+    else:
+        # if no work without successor can be found, a work needs to be cloned
+        log_message(
+            'Looking for suitable clone candidate with new case',
+            user
+            )
+        # NOTE: pr_set now contains predecessors in same course-estafette
+        #       who HAVE been assigned to a successor, are NOT clones,
+        #       and have NOT been cloned yet (cases 2 and 4)
+
+        # (10b) from this set, we prefer assignments for which the successor
+        # assignment has NOT been uploaded yet, because that may never happen.
+        # NOTE: see the code for the 'upload' action (some 200 lines earlier)
+        #       for explanation on how the successor of a "clone" is re-assigned
+        #       if the successor of its original has not uploaded yet
+        sub_set = pr_set.filter(successor__time_uploaded=DEFAULT_DATE)
+        log_message(
+            'TRACE - predecessors w/o successor having uploaded: '
+                + ', '.join([str(a) for a in sub_set]),
+            user
+            )
+        if sub_set:
+            pr_set = sub_set
+
+        # choose the one having the case with the LOWEST occurrence
+        # (because we're creating a clone)
+        case_set = pr_set.values('case__id', 'case__letter'
+            ).annotate(c_count=Count('case')
+            ).order_by('c_count')  # important! this time NO minus sign
+        # print the choice set
+        ac_str = ', '.join([x['case__letter'] + str(x['c_count'])
+            for x in case_set])
+        log_message('TRACE - clonable case occurrence: ' + ac_str,
+            user)
+        # get the lowest count
+        low_count = case_set.first()['c_count']
+        low_case_ids = []
+        for x in case_set:
+            # retain the IDs of only the low count cases
+            if x['c_count'] == low_count:
+                low_case_ids.append(x['case__id'])
+        # retain only those cases
+        pr_set = pr_set.filter(case__in=low_case_ids)
+
+        # from this set, select the best remaining assignment as predecessor
+        # NOTE: "best" now means: having the highest grade, since we
+        #       do not want "bad" work to be cloned, as this will
+        #       frustrate/demotivate participants
+        # get reviews on the assignments in the list (if any)
+        rev_set = PeerReview.objects.filter(assignment__in=pr_set
+            ).exclude(grade=0).exclude(is_rejection=True).order_by('-grade')
+        # NOTE: the list is ordered in decreasing order of grade
+        # so that the "good work" is preferred over "bad work"
+        if rev_set:
+            pr_a = rev_set.first().assignment
+        else:
+            pr_a = pr_set.first()
+        
+        # (11b + 12b) first create a clone of the selected work...
+        clone, created = Assignment.objects.get_or_create(
+            participant=pr_a.participant,
+            case=pr_a.case, leg=pr_a.leg, time_assigned=pr_a.time_assigned,
+            time_uploaded=pr_a.time_uploaded, clone_of=pr_a,
+            # NOTE: set "selfie flag" if we're cloning the student's own work
+            is_selfie=pr_a.participant == p)
+        if not created:
+            log_message(
+                'WARNING: attempt to create clone again: '
+                    + str(clone),
+                user
+                )
+        # ... and make this cloned work the predecessor 
+        a, created = Assignment.objects.get_or_create(participant=p,
+            case=clone.case, leg=next_leg, predecessor=clone)
+        if not created:
+            log_message(
+                'WARNING: attempt to create "build-on-clone" assignment again: '
+                    + str(a),
+                user
+                )
+        clone.successor = a
+        clone.save()
+        log_message(
+            'Clone assigned: ' + str(clone),
+            user
+            )
+        return (a, clone.is_selfie)
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 @login_required(login_url=settings.LOGIN_URL)
@@ -195,7 +463,7 @@ def student(request, **kwargs):
             p = Participant.objects.get(pk=pid)
             p.time_started=timezone.now()
             p.time_last_action=timezone.now()
-            p.save()
+            p.save(update_fields=['time_started', 'time_last_action'])
             ce = p.estafette
             if p.student.dummy_index > 0:
                 set_focus_and_alias(
@@ -220,7 +488,7 @@ def student(request, **kwargs):
             pid = decode(h, context['user_session'].decoder)
             p = Participant.objects.get(pk=pid)
             p.time_last_action=timezone.now()
-            p.save()
+            p.save(update_fields=['time_last_action'])
             ce = p.estafette
             # NOTE: double-check to prevent demonstration users from defocusing
             if p.student.dummy_index > 0 and not is_demo_user(context):
@@ -235,7 +503,7 @@ def student(request, **kwargs):
             if dts == DEFAULT_DATE:
                 p.time_started=timezone.now()
             p.time_last_action=timezone.now()
-            p.save()
+            p.save(update_fields=['time_started', 'time_last_action'])
             ce = p.estafette
             log_message('Starting with relay ' + str(ce), context['user'])
             lang = ce.course.language
@@ -292,8 +560,16 @@ def student(request, **kwargs):
                         # if so, assign the first assignment to this participant
                         p = ctl
                     # create the assignment -- default fields suffice
-                    a, created = Assignment.objects.get_or_create(participant=p,
-                        case=ec, leg=el_list.first())
+                    try:
+                        with transaction.atomic():
+                            a, created = Assignment.objects.get_or_create(participant=p,
+                                case=ec, leg=el_list.first())
+                    except IntegrityError:
+                        # a concurrent action has created the first step (possibly for
+                        # another case), so the participant has started all the same
+                        a = Assignment.objects.get(participant=p, leg=el_list.first(),
+                            clone_of__isnull=True, is_rejected=False, is_retired=False)
+                        created = False
                     if not created:
                         log_message(
                             'WARNING: attempt to assign first step again '
@@ -313,7 +589,7 @@ def student(request, **kwargs):
             if not authorized_participant(a.participant, context['user']):
                 raise ValueError('Assignment not authenticated')
             a.participant.time_last_action=timezone.now()
-            a.participant.save()
+            a.participant.save(update_fields=['time_last_action'])
             lang = a.participant.estafette.course.language
             # assume that review of predecessor is complete,
             # or not required (step 1)
@@ -514,11 +790,12 @@ def student(request, **kwargs):
                     for rf in rfl:
                         f = request.FILES[rf['name']]
                         # no need to anonymize file (is done when downloading)
-                        ParticipantUpload.objects.create(
+                        pu = ParticipantUpload.objects.create(
                             assignment=a,
                             file_name=rf['name'],
                             upload_file=f
                             )
+                        record_telltales(pu)
                         log_message(
                             'Uploaded file "{n}" as {f} for relay {r}'.format(
                                 n=f.name,
@@ -651,7 +928,7 @@ def student(request, **kwargs):
             # get list of all assignments for the student (assigned so far)
             # NOTE: excluding "rejected" assignments!
             a_list = Assignment.objects.filter(participant=p
-                ).exclude(is_rejected=True).order_by('-leg__number')
+                ).exclude(is_rejected=True).exclude(is_retired=True).order_by('-leg__number')
             # the one to be declined = the most recent = the first of the list
             decl_a = a_list.first()
             log_message(
@@ -684,8 +961,10 @@ def student(request, **kwargs):
                 warn_user(context, lang.phrase('Could_not_decline'),
                     lang.phrase('Downloaded_or_old_URL'))
             # update action status
+            # NOTE: deleting the assignment has updated the progress counters of the
+            #       participant in the database, so only the action time is saved
             p.time_last_action=timezone.now()
-            p.save()
+            p.save(update_fields=['time_last_action'])
         elif act == 'proceed':
             # check whether student is eligible for next assignment
             pid = decode(h, context['user_session'].decoder)
@@ -693,7 +972,7 @@ def student(request, **kwargs):
             if not authorized_participant(p, context['user']):
                 raise ValueError('Participant not authenticated')
             p.time_last_action=timezone.now()
-            p.save()
+            p.save(update_fields=['time_last_action'])
             log_message('Proceeding with next step', context['user'])
             # if so, create a new assignment object and set its predecessor
             # NOTE: for clarity, the subsequent operations to achieve this are numbered
@@ -733,265 +1012,42 @@ def student(request, **kwargs):
                 c_list = [a.case.id for a in a_list]
 
                 # NOTE: multi-threading, so the database transaction must be indivisible
-                # NOTE: this still needs implementation with database locking -- TO DO!!
-                with transaction.atomic():
-                    # (6) find "eligible" assignments for the student to build on
-                    # NOTE: we must also filter out the PREDECESSORS of rejected assignments,
-                    #       (i.e., the assignments of which the uploaded work was rejected)
-                    #       because the elig_set is possibly used later on to identify clone
-                    #       candidates
-                    rejids = Assignment.objects.filter(participant__estafette=p_relay,
-                        leg__number=next_leg.number, is_rejected=True).values_list('predecessor__id')
-                    log_message(
-                        'TRACE - predecessor IDs of rejected assignments: ' + str(rejids),
-                        context['user']
-                        )
-                    elig_set = Assignment.objects.filter(
-                        participant__estafette=p_relay, leg__number=last_nr, is_rejected=False,
-                        clone_of__isnull=True, time_uploaded__gt=DEFAULT_DATE
-                        ).exclude(id__in=rejids)
-                    # elig_set now contains "eligible" predecessors, because:
-                    # a) same course-estafette, b) preceding step, c) not rejected (work),
-                    # d) not a "clone" of another assignment, and e) uploaded work
-                    # NOTE: we exclude "clones" to prevent "cloning clones"
-                    log_message(
-                        'TRACE - eligible predecessors: '
-                            + ', '.join([str(a) for a in elig_set]),
-                        context['user']
-                        )
-
-                    # (7) ideally, elig_set has a subset of assignments having no successor yet
-                    #     and having a case that the student has not worked on yet, but we
-                    #     plan for the worst case of neither condition being TRUE
-                    no_successor = False
-                    new_case = False
-                    
-                    # start with the complete set of eligible predecessors
-                    pr_set = elig_set
-                    # narrow it down to those w/o successor and having a new case
-                    sub_set = pr_set.filter(successor__isnull=True).exclude(case__in=c_list)
-                    log_message(
-                        'TRACE - preferred predecessors: '
-                            + ', '.join([str(a) for a in sub_set]),
-                        context['user']
-                        )
-                    # if both conditions can be met, the predecessor set can be limited
-                    # to this subset
-                    if sub_set:
-                        pr_set = sub_set
-                        no_successor = True
-                        new_case = True
-                    else:
-                        # (8) see if duplicate cases can be avoided by "cloning"
-                        sub_set = elig_set.exclude(case__in=c_list)
-                        # NOTE: avoid cloning the same assignment twice, as this would
-                        #       violate the uniqueness constraint
-                        # to effectuate this, get the clones of the subset
-                        clone_set = Assignment.objects.filter(clone_of__in=sub_set)
-                        # and then remove from the subset the assignments already having a clone
-                        sub_set = sub_set.exclude(
-                            id__in=clone_set.values_list('clone_of', flat=True))
-                        log_message(
-                            'TRACE - still clonable predecessors with new case: '
-                                + ', '.join([str(a) for a in sub_set]),
-                            context['user']
-                            )
-                        # if so, use this subset of assignments with "new" cases (and successor)
-                        if sub_set:
-                            pr_set = sub_set
-                            new_case = True
-                        else:
-                            # (9) if duplicate cases cannot be avoided, revert to the eligible
-                            #     assignments (regardless of their case) having no successor
-                            pr_set = elig_set.filter(successor__isnull=True)
-                            log_message(
-                                'TRACE - eligible predecessors with known case: '
-                                    + ', '.join([str(a) for a in pr_set]),
-                                context['user']
-                                )
-                            if pr_set:
-                                no_successor = True
-                                # try to exclude the student's own previous step
-                                sub_set = pr_set.exclude(participant=p)
-                                if sub_set:
-                                    pr_set = sub_set
-
-                    # now pr_set is "the best we can do", i.e., in order of preference, either:
-                    #  (1) NEW case, NO successor (ideal situation)
-                    #  (2) NEW case, a successor, but NO clone
-                    #  (3) OLD case, NO successor (3rd choice because different cases are preferred)
-                    #  (4) OLD case, a successor, but NO clone
-                    # and in all 4 cases, the participant's own work is excluded if possible
-
-                    # NOTE: pr_set cannot be empty because there always should be at least
-                    #       one assignment: the previous step of the student;
-                    #       even so, we double-check
-                    if not pr_set:
-                        raise ValueError('No previous assignment found')
-                    else:
-                        log_message(
-                            'TRACE - "best we can do" predecessors: '
-                                + ', '.join([str(a) for a in pr_set]),
-                                context['user']
-                            )
-                    
-                    # if pr_set contains "free" assignments (case 1 or 3), choose the "best" one
-                    if no_successor:
-                        # get the case occurrence in the set
-                        case_set = pr_set.values('case__id', 'case__letter'
-                            ).annotate(c_count=Count('case')
-                            ).order_by('-c_count')
-                        # print it in readable form
-                        ac_str = ', '.join([x['case__letter'] + str(x['c_count']) for x in case_set])
-                        log_message('TRACE - case occurrence: ' + ac_str, context['user'])
-                        # get the highest count (NOTE: several cases may have this occurrence)
-                        high_count = case_set.first()['c_count']
-                        # get the case IDs of cases having the highest occurrence
-                        high_case_ids = []
-                        for x in case_set:
-                            if x['c_count'] == high_count:
-                                high_case_ids.append(x['case__id'])
-                        # (10) select the "best" remaining assignment as predecessor
-                        pr_list = list(pr_set.filter(case__in=high_case_ids))
-                        pr_list.sort(key=lambda a: -a.participant.progress())
-                        # NOTE: the list is ordered in decreasing order of progress
-                        #       so that the "fast runners" are preferred over "slow runners"
-                        log_message(
-                            'TRACE - sorted retained predecessors: '
-                                + ', '.join([str(a) for a in pr_list]),
-                                context['user']
-                                )
-                        pr_a = pr_list[0]
-
-                        # NOTE: this predecessor work may be authored by the same participant!
-                        if pr_a.participant == p:
-                            # if so, it should be cloned as a selfie ...
-                            clone, created = Assignment.objects.get_or_create(
-                                participant=pr_a.participant,
-                                case=pr_a.case, leg=pr_a.leg, time_assigned=pr_a.time_assigned,
-                                time_uploaded=pr_a.time_uploaded, clone_of=pr_a,
-                                is_selfie=True)
-                            if not created:
-                                log_message(
-                                    'WARNING: attempt to create selfie clone again: '
-                                        + str(clone),
-                                    context['user']
-                                    )
-                            # ... and the selfie should be used as predecessor assignment
-                            pr_a = clone
-                        
-                        # (11) create a new assignment that builds on the selected one
-                        a, created = Assignment.objects.get_or_create(participant=p,
-                            case=pr_a.case, leg=next_leg,
-                            predecessor=pr_a)  # other fields have their default value
-                        if not created:
+                # NOTE: two concurrent "proceed" actions (e.g., from two browser windows)
+                #       could both create this step; the unique constraint on active
+                #       assignments makes the second one fail with an IntegrityError,
+                #       and then the whole transaction is rolled back and retried
+                for attempt in range(MAX_ASSIGN_ATTEMPTS):
+                    try:
+                        with transaction.atomic():
+                            a, own_work_cloned = assign_next_step(p, next_leg, c_list,
+                                context['user'])
+                        # only inform the student of building on a clone if own work was
+                        # cloned (and only now that the assignment has been committed)
+                        if own_work_cloned:
+                            lang = p.estafette.course.language
+                            inform_user(context, lang.phrase('Frontrunner'),
+                                lang.phrase('Continue_own_work'))
+                        break
+                    except IntegrityError:
+                        # if the step has been assigned in the meantime, the action
+                        # has been completed (by the other request)
+                        a = Assignment.objects.filter(participant=p, leg=next_leg,
+                            clone_of__isnull=True, is_rejected=False, is_retired=False
+                            ).first()
+                        if a:
                             log_message(
-                                'WARNING: attempt to assign step {} again (ID {})'.format(
+                                'WARNING: step {} was assigned concurrently (ID {})'.format(
                                     next_leg.number,
                                     a.id
                                     ),
                                 context['user']
                                 )
-                        # (12) also link the predecessor's assignment to the new one
-                        #      (so as to facilitate database lookups later on)
-                        pr_a.successor = a
-                        pr_a.save()
-                        log_message(
-                            'Work assigned: ' + str(pr_a),
-                            context['user']
-                            )
-                    else:
-                        # if no work without successor can be found, a work needs to be cloned
-                        cloning = True
-                        log_message(
-                            'Looking for suitable clone candidate with new case',
-                            context['user']
-                            )
-                        # NOTE: pr_set now contains predecessors in same course-estafette
-                        #       who HAVE been assigned to a successor, are NOT clones,
-                        #       and have NOT been cloned yet (cases 2 and 4)
-
-                        # (10b) from this set, we prefer assignments for which the successor
-                        # assignment has NOT been uploaded yet, because that may never happen.
-                        # NOTE: see the code for the 'upload' action (some 200 lines earlier)
-                        #       for explanation on how the successor of a "clone" is re-assigned
-                        #       if the successor of its original has not uploaded yet
-                        sub_set = pr_set.filter(successor__time_uploaded=DEFAULT_DATE)
-                        log_message(
-                            'TRACE - predecessors w/o successor having uploaded: '
-                                + ', '.join([str(a) for a in sub_set]),
-                            context['user']
-                            )
-                        if sub_set:
-                            pr_set = sub_set
-    
-                        # choose the one having the case with the LOWEST occurrence
-                        # (because we're creating a clone)
-                        case_set = pr_set.values('case__id', 'case__letter'
-                            ).annotate(c_count=Count('case')
-                            ).order_by('c_count')  # important! this time NO minus sign
-                        # print the choice set
-                        ac_str = ', '.join([x['case__letter'] + str(x['c_count'])
-                            for x in case_set])
-                        log_message('TRACE - clonable case occurrence: ' + ac_str,
-                            context['user'])
-                        # get the lowest count
-                        low_count = case_set.first()['c_count']
-                        low_case_ids = []
-                        for x in case_set:
-                            # retain the IDs of only the low count cases
-                            if x['c_count'] == low_count:
-                                low_case_ids.append(x['case__id'])
-                        # retain only those cases
-                        pr_set = pr_set.filter(case__in=low_case_ids)
-
-                        # from this set, select the best remaining assignment as predecessor
-                        # NOTE: "best" now means: having the highest grade, since we
-                        #       do not want "bad" work to be cloned, as this will
-                        #       frustrate/demotivate participants
-                        # get reviews on the assignments in the list (if any)
-                        rev_set = PeerReview.objects.filter(assignment__in=pr_set
-                            ).exclude(grade=0).exclude(is_rejection=True).order_by('-grade')
-                        # NOTE: the list is ordered in decreasing order of grade
-                        # so that the "good work" is preferred over "bad work"
-                        if rev_set:
-                            pr_a = rev_set.first().assignment
-                        else:
-                            pr_a = pr_set.first()
-                                    
-                        # (11b + 12b) first create a clone of the selected work...
-                        clone, created = Assignment.objects.get_or_create(
-                            participant=pr_a.participant,
-                            case=pr_a.case, leg=pr_a.leg, time_assigned=pr_a.time_assigned,
-                            time_uploaded=pr_a.time_uploaded, clone_of=pr_a,
-                            # NOTE: set "selfie flag" if we're cloning the student's own work
-                            is_selfie=pr_a.participant == p)
-                        if not created:
-                            log_message(
-                                'WARNING: attempt to create clone again: '
-                                    + str(clone),
-                                context['user']
-                                )
-                        # ... and make this cloned work the predecessor 
-                        a, created = Assignment.objects.get_or_create(participant=p,
-                            case=clone.case, leg=next_leg, predecessor=clone)
-                        if not created:
-                            log_message(
-                                'WARNING: attempt to create "build-on-clone" assignment again: '
-                                    + str(a),
-                                context['user']
-                                )
-                        clone.successor = a
-                        clone.save()
-                        log_message(
-                            'Clone assigned: ' + str(clone),
-                            context['user']
-                            )
-                        # only inform the student of building on a clone if own work was cloned
-                        if clone.is_selfie:
-                            lang = p.estafette.course.language
-                            inform_user(context, lang.phrase('Frontrunner'),
-                                lang.phrase('Continue_own_work'))
+                            break
+                        # otherwise, a predecessor was taken (or cloned) by someone else
+                        if attempt == MAX_ASSIGN_ATTEMPTS - 1:
+                            raise
+                        log_message('WARNING: retrying to assign step {}'.format(
+                            next_leg.number), context['user'])
 
                 # END OF ATOMIC TRANSACTION
 
@@ -1082,7 +1138,7 @@ def student(request, **kwargs):
             if not authorized_participant(pr.reviewer, context['user']):
                 raise ValueError('Review not authenticated')
             pr.reviewer.time_last_action=timezone.now()
-            pr.reviewer.save()
+            pr.reviewer.save(update_fields=['time_last_action'])
             est = pr.reviewer.estafette
             est_c = est.course
             lang = est_c.language
@@ -1117,9 +1173,11 @@ def student(request, **kwargs):
                     )
             else:
                 sub = request.POST.get('sub', 0)
-                # register the review as "submitted" 
-                pr.time_submitted = timezone.now()
-                pr.save()
+                # register the review as "submitted"
+                # NOTE: in a single transaction with the reviewer's progress fields
+                with transaction.atomic():
+                    pr.time_submitted = timezone.now()
+                    pr.save()
                 log_message('Review submitted: ' + str(pr), context['user'])
                 offense = pr.check_offensiveness()
                 if offense:
@@ -1184,7 +1242,7 @@ def student(request, **kwargs):
                 raise ValueError('Assignment not authenticated')
             # register the action
             a.participant.time_last_action=timezone.now()
-            a.participant.save()
+            a.participant.save(update_fields=['time_last_action'])
             lang = a.participant.estafette.course.language
             # verify that the student has a predecessor
             pr_a = a.predecessor
@@ -1211,7 +1269,7 @@ def student(request, **kwargs):
             if not authorized_participant(p, context['user']):
                 raise ValueError('Appraisal not authenticated')
             p.time_last_action=timezone.now()
-            p.save()
+            p.save(update_fields=['time_last_action'])
             lang = p.estafette.course.language
             # check wether appraisal was not submitted already
             if pr.time_appraised != DEFAULT_DATE:
@@ -1264,7 +1322,7 @@ def student(request, **kwargs):
                 raise ValueError('Appeal decision not authenticated')
             # update participant's status
             p.time_last_action=timezone.now()
-            p.save()
+            p.save(update_fields=['time_last_action'])
             lang = p.estafette.course.language
             # check wether appraisal was not submitted already
             if t != DEFAULT_DATE:
@@ -1315,8 +1373,8 @@ def student(request, **kwargs):
             pr = PeerReview.objects.get(pk=prid)
             if not authorized_participant(pr.reviewer, context['user']):
                 raise ValueError('Review not authenticated')
-            pr.reviewer.last_action=timezone.now()
-            pr.reviewer.save()
+            pr.reviewer.time_last_action=timezone.now()
+            pr.reviewer.save(update_fields=['time_last_action'])
             lang = pr.reviewer.estafette.course.language
             # check wether appraisal was not already acknowledged
             if pr.time_acknowledged != DEFAULT_DATE:
@@ -1758,21 +1816,22 @@ def student(request, **kwargs):
         else:
             # add participant's progress data to the context
             part['things_to_do'] = things_to_do(p)
+            # get all assignments, reviews, items and appeals of the participant (or team)
+            # in one go, so that the number of queries does not grow with the progress made
+            snap = ParticipantSnapshot(p, part['steps'])
             # get list of all assignments for the participant (or team leader) assigned so far
-            a_list = team_assignments(p).order_by('-leg__number')
+            a_list = snap.assignments
             # get subset that already have uploads -- these may need review appraisal
-            u_list = a_list.filter(time_uploaded__gt=DEFAULT_DATE)
+            u_list = snap.uploaded
             # remember the case IDs of the uploaded assignments (used to establish decline option)
             cases_worked_on = [u.case.id for u in u_list]
 
             # get assigned final reviews that still need to be sumbitted (if any)
-            final_reviews = PeerReview.objects.filter(reviewer=p,
-                assignment__leg__number=part['steps']).exclude(time_submitted__gt=DEFAULT_DATE)
+            final_reviews = snap.pending_final_reviews()
 
             # get pending instructor reviews (if any; only for "instructor participants")
             if p.student.dummy_index < 0:
-                instructor_reviews = PeerReview.objects.filter(reviewer=p,
-                    ).exclude(time_submitted__gt=DEFAULT_DATE)
+                instructor_reviews = snap.pending_reviews()
             else:
                 instructor_reviews = []
             # if a_list has more elements than u_list, the student still has a pending assignment
@@ -1790,12 +1849,12 @@ def student(request, **kwargs):
                 if len(instructor_reviews) > 0: # not a_list:
                     log_message('Selecting first instructor review')
                     a = None
-                    rev = instructor_reviews.first()
+                    rev = instructor_reviews[0]
                     pr_a = rev.assignment                
                 else:
-                    a = a_list.first()
+                    a = a_list[0] if a_list else None
                     if final_reviews:
-                        rev = final_reviews.first()
+                        rev = final_reviews[0]
                         pr_a = rev.assignment
                     else:
                         pr_a = a.predecessor
@@ -1834,7 +1893,7 @@ def student(request, **kwargs):
                         'instr': a.leg.upload_instruction,
                         'rev_instr': a.leg.complete_review_instruction(),
                         # get assignment items (if any)
-                        'upl_items': a.item_list(),
+                        'upl_items': snap.item_list(a),
                         'file_list': fl,
                         'min_to_wait': min_to_wait + 1,  # add 1 to compensate for rounding down
                         'bonus': bonus,
@@ -1981,12 +2040,12 @@ def student(request, **kwargs):
                             'selfie': pr_a.is_selfie,
                             'rejectable': pr_a.leg.rejectable,
                             # also add assignment items (if any)
-                            'upl_items': pr_a.item_list(),
+                            'upl_items': snap.item_list(pr_a),
                             'file_list': pr_a.leg.file_list(),
                             'grade': rev.grade,
                             'reject': rev.is_rejection,
                             # get item reviews
-                            'rev_items': rev.item_list(),
+                            'rev_items': snap.review_item_list(rev),
                             'rev': rev.grade_motivation,
                             'rev_words': word_count(rev.grade_motivation),
                             # pass review model text (if any) as plain text
@@ -2086,8 +2145,8 @@ def student(request, **kwargs):
                         })
                 elif not (new_steps or unfinished_step):
                     # if not, check whether how many final steps the student has reviewed
-                    fr_list = PeerReview.objects.filter(reviewer=p, assignment__leg__number=part['steps'])
-                    fr_count = fr_list.filter(time_submitted__gt=DEFAULT_DATE).count()
+                    fr_list = snap.final_reviews()
+                    fr_count = len([fr for fr in fr_list if fr.time_submitted > DEFAULT_DATE])
                     # if that number is less than required, prompt student to ask for a review
                     fr_to_do = p.estafette.final_reviews - fr_count
                     if fr_to_do > 0 and not past_review_deadline:
@@ -2179,18 +2238,7 @@ def student(request, **kwargs):
             # his/her own work. Such reviews must be submitted AND the successor
             # must have uploaded the next step AND the assignment should not be
             # a clone (NOTE: owned by the student him/herself)
-            pr_list = PeerReview.objects.filter(
-                    assignment__participant=p
-                ).exclude(
-                    time_submitted=DEFAULT_DATE
-                ).filter(
-                    time_appraised=DEFAULT_DATE
-                ).exclude(
-                    Q(assignment__successor__time_uploaded=DEFAULT_DATE)
-                        & Q(is_rejection=False)
-                ).exclude(
-                    assignment__clone_of__isnull=False
-                )
+            pr_list = snap.reviews_to_appraise()
             for pr in pr_list:
                 a = pr.assignment
                 own_fl = a.leg.file_list()
@@ -2216,7 +2264,7 @@ def student(request, **kwargs):
                     'case': ui_img(a.case.description),
                     'desc': a.leg.description,
                     'peer_review': pr,
-                    'rev_items': pr.item_list(),
+                    'rev_items': snap.review_item_list(pr),
                     # NOTE: task now refers to former task!
                     'your_task': lang.phrase('Your_task_was'),
                     # characteristic icon and color for this task
@@ -2253,8 +2301,7 @@ def student(request, **kwargs):
 
             # ALSO at all times, the student may need to acknowledge appraisals of his/her reviews
             # provided that such appraisals have been submitted and not already acknowledged
-            pr_list = PeerReview.objects.filter(reviewer=p
-                ).exclude(time_appraised=DEFAULT_DATE).filter(time_acknowledged=DEFAULT_DATE)
+            pr_list = snap.appraisals_to_acknowledge()
             for pr in pr_list:
                 t_nr += 1
                 a = pr.assignment
@@ -2272,7 +2319,7 @@ def student(request, **kwargs):
                     'desc': '',
                     'appraised_review': pr,
                     'is_final': a.leg.number == part['steps'],
-                    'rev_items': pr.item_list(),
+                    'rev_items': snap.review_item_list(pr),
                     'your_task': lang.phrase('Please_confirm_read'),
                     'app_icon': FACES[pr.appraisal],
                     'app_header': lang.phrase(
@@ -2297,7 +2344,7 @@ def student(request, **kwargs):
             # ALSO at all times, the student may need to appraise a referee decision on appeal cases
             # in which s/he is a party, provided that such appeals have been decided upon,
             # and NOT already been acknowledged (hence second parameter not_ack=True)
-            ap_list = team_appeals(p, True)
+            ap_list = snap.appeals
             for ap in ap_list:
                 t_nr += 1
                 part['decided_appeal'] =  True
@@ -2317,7 +2364,7 @@ def student(request, **kwargs):
                     appr_motiv = ap.successor_motivation
                     xtra = ' (' + lang.phrase('As_successor') + ')'
                 # disable objection when appeal has been decided by an instructor
-                if a.participant.estafette.course.instructors.filter(pk=ap.referee.user.pk):
+                if snap.decided_by_instructor(ap):
                     may_object = False
                     possibility_to_object = lang.phrase('Refereed_by_instructor')
                     objection_hint = lang.phrase('No_objection_possible')
@@ -41,6 +41,7 @@ from .models import (
 from datetime import datetime, timedelta
 
 # presto modules
+from presto.cache import relay_leg_count
 from presto.generic import log_message
 from presto.extension_data import (
     ASSIGNMENT_DEADLINE_EXTENSIONS,
@@ -421,7 +422,7 @@ def team_as_html(p):
 # for participant p, including (!) those submitted by the team leader while p was team member,
 # over the required numbers
 def team_submissions(p):
-    steps = p.estafette.estafette.template.nr_of_legs()
+    steps = relay_leg_count(p.estafette_id)
     frevs = p.estafette.final_reviews
     ta = 0
     tr = 0
@@ -438,8 +439,8 @@ def team_submissions(p):
             tr = PeerReview.objects.filter(reviewer=lp, final_review_index__gt=0).exclude(
                 time_submitted=DEFAULT_DATE).exclude(time_submitted__gte=dts).count()
     # add number of p's own submitted assignments
-    ta += Assignment.objects.filter(participant=p, is_rejected=False, clone_of__isnull=True
-            ).exclude(time_uploaded=DEFAULT_DATE).count()
+    ta += Assignment.objects.filter(participant=p, is_rejected=False, is_retired=False,
+            clone_of__isnull=True).exclude(time_uploaded=DEFAULT_DATE).count()
     if frevs:
         # if final reviews required, add number of p's own submitted final reviews
         tr += PeerReview.objects.filter(reviewer=p, final_review_index__gt=0
@@ -460,15 +461,18 @@ def team_assignments(p):
         ta_set = Assignment.objects.none()
     else:
         # otherwise, get the assignments of the team leader (excluding clones and rejected ones) 
-        ta_set = Assignment.objects.filter(participant=lp, is_rejected=False, clone_of__isnull=True)
+        ta_set = Assignment.objects.filter(participant=lp, is_rejected=False, is_retired=False,
+            clone_of__isnull=True)
         # get the separation time of p (will be future if partnership still holds)
         dts = time_separated(lp, p)
         if dts < FOREVER_DATE:
             # if separated, retain only those submitted (i.e., completed) before the separation
             ta_set = ta_set.filter(time_uploaded__gt=DEFAULT_DATE, time_uploaded__lt=dts)
     # get assignments participant p has worked on so far (not necessarily uploaded),
-    # ignoring rejected ones and clones (since clones are "owned" by the student needing one)
-    a_set = Assignment.objects.filter(participant=p, is_rejected=False, clone_of__isnull=True)
+    # ignoring rejected (and retired) ones and clones (since clones are "owned" by the student
+    # needing one)
+    a_set = Assignment.objects.filter(participant=p, is_rejected=False, is_retired=False,
+        clone_of__isnull=True)
     return ta_set | a_set
 
 
@@ -564,12 +568,28 @@ def team_appeals(p, not_ack=False):
     return tap_set | pap_set | sap_set
 
 
+# returns a dict {assignment ID: time of first download} for the user downloads
+# performed by participant p OR by team members (!) for assignments having ID in list aid_list
+def team_first_downloads(p, aid_list):
+    fd_dict = {}
+    if not aid_list:
+        return fd_dict
+    # NOTE: downloads are sorted such that the oldest comes first
+    for aid, t in team_user_downloads(p, aid_list).values_list(
+            'assignment__id', 'time_downloaded'):
+        if not aid in fd_dict:
+            fd_dict[aid] = t
+    return fd_dict
+
+
 # returns a dict with progress data for each step and final review (for display as progress bar)
 # for participant p, taking into account its team!
+# NOTE: downloads and reviews are fetched for all steps at once, so that the number of
+#       database queries does not grow with the number of steps completed
 def things_to_do(p):
     lang = p.student.course.language
     r = p.estafette
-    steps = r.estafette.template.nr_of_legs()
+    steps = relay_leg_count(r.id)
     all_steps_done = False
     all_final_reviews_done = r.final_reviews == 0
     last_completed = DEFAULT_DATE
@@ -585,8 +605,28 @@ def things_to_do(p):
         'uploaded': False,
         'uploaded_tip': lang.phrase('Step_not_uploaded').format(i + 1),
         } for i in range(steps)]
+    # get the assignments and final reviews of the participant (or team)
+    a_list = list(team_assignments(p).select_related('leg'))
+    fr_list = list(team_final_reviews(p).select_related('assignment__leg'))
+    # get IDs of the predecessor assignments, as these are the ones that are downloaded and reviewed
+    pids = [a.predecessor_id for a in a_list
+        if a.leg.number > 1 and a.predecessor_id]
+    # also get IDs of the assignments that are (to be) downloaded for final reviews
+    dl_ids = [a.predecessor_id for a in a_list
+        if a.leg.number > 1 and a.leg.required_files and a.predecessor_id]
+    dl_ids += [ur.assignment_id for ur in fr_list if ur.assignment.leg.required_files]
+    # get the times of first download (by the student or team) with a single query
+    dl_dict = team_first_downloads(p, list(set(dl_ids)))
+    # get the submission times of the reviews of the predecessor assignments with a single query
+    # NOTE: as before, only the first review of a predecessor assignment counts,
+    #       and the ID of the reviewer is ignored (could be team leader)
+    rev_dict = {}
+    for aid, t in PeerReview.objects.filter(assignment__id__in=pids).order_by(
+            'id').values_list('assignment__id', 'time_submitted'):
+        if not aid in rev_dict:
+            rev_dict[aid] = t
     # add data on these assignments to the progress list
-    for a in team_assignments(p):
+    for a in a_list:
         t = ttd[a.leg.number - 1]
         t['assigned'] = True
         t['assigned_tip'] = lang.phrase('Step_assigned').format(
@@ -597,26 +637,23 @@ def things_to_do(p):
             # NOTE: show tooltip only if step has required files
             if a.leg.required_files:
                 # check whether the student (or team) already downloaded the predecessor's work
-                dl = team_user_downloads(p, [a.predecessor.id])
-                if dl:
+                dlt = dl_dict.get(a.predecessor_id, None)
+                if dlt:
                     t['downloaded'] = True
                     t['downloaded_tip'] = lang.phrase('Step_downloaded').format(
                         nr=(t['step'] - 1),
-                        time=lang.ftime(dl.first().time_downloaded)
+                        time=lang.ftime(dlt)
                         )
             else:
                 t['downloaded'] = True
                 t['downloaded_tip'] = t['assigned_tip']
-            # NOTE: ignore ID of reviewer (could be team leader)
-            ur = PeerReview.objects.filter(assignment=a.predecessor)
-            if ur:
-                ur = ur.first()
-                if ur.time_submitted != DEFAULT_DATE:
-                    t['reviewed'] = True
-                    t['reviewed_tip'] = lang.phrase('Step_reviewed').format(
-                        nr=(t['step'] - 1),
-                        time=lang.ftime(ur.time_submitted)
-                        )
+            ts = rev_dict.get(a.predecessor_id, DEFAULT_DATE)
+            if ts != DEFAULT_DATE:
+                t['reviewed'] = True
+                t['reviewed_tip'] = lang.phrase('Step_reviewed').format(
+                    nr=(t['step'] - 1),
+                    time=lang.ftime(ts)
+                    )
         if a.time_uploaded != DEFAULT_DATE:
             t['uploaded'] = True
             t['uploaded_tip'] = lang.phrase('Step_uploaded').format(
@@ -634,18 +671,17 @@ def things_to_do(p):
         'reviewed_tip': lang.phrase('Review_not_uploaded').format(i + 1)
         } for i in range(r.final_reviews)]
     # add data for each final review this participant has worked on so far
-    for ur in team_final_reviews(p):
+    for ur in fr_list:
         t = ttd[steps + ur.final_review_index - 1]
         # NOTE: show tooltip only if step has required files
-        a = ur.assignment
-        if a.leg.required_files:
+        if ur.assignment.leg.required_files:
             # check whether the student (or team) already downloaded the work
-            dl = team_user_downloads(p, [a.id])
-            if dl:
+            dlt = dl_dict.get(ur.assignment_id, None)
+            if dlt:
                 t['downloaded'] = True
                 t['downloaded_tip'] = lang.phrase('Review_downloaded').format(
                     nr=t['review'],
-                    time=lang.ftime(dl.first().time_downloaded)
+                    time=lang.ftime(dlt)
                     )
         if ur.time_submitted != DEFAULT_DATE:
             t['reviewed'] = True
@@ -658,5 +694,3 @@ def things_to_do(p):
     if all_steps_done and all_final_reviews_done:
         ttd += [{'finish': lang.ftime(last_completed)}]
     return ttd
-
-
@@ -28,6 +28,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.db import IntegrityError
 from django.db.models import F
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django.utils import timezone
 
@@ -58,14 +59,30 @@ from .models import (
 @login_required(login_url=settings.LOGIN_URL)
 def template(request, **kwargs):
     h = kwargs.get('hex', '')
-    context = generic_context(request, h)
+    # NOTE: exporting a template opens a NEW browser tab/window (as for downloads),
+    #       meaning that the coding keys should NOT be rotated
+    exporting = kwargs.get('action', '') == 'export'
+    context = generic_context(request, 'NOT' if exporting else h)
     # check whether user can have developer role
     if not change_role(context, 'Developer'):
         return render(request, 'presto/forbidden.html', context)
 
     try:
+        # check whether the template is to be exported as a JSON file
+        if exporting:
+            # NOTE: since keys have not been rotated, use the ENcoder here!
+            etid = decode(h, context['user_session'].encoder)
+            et = EstafetteTemplate.objects.get(pk=etid)
+            log_message('Exporting template ' + et.name, context['user'])
+            # stream the JSON string, as templates with many steps can be large
+            response = StreamingHttpResponse(et.iter_JSON(), content_type='application/json')
+            response['Content-Disposition'] = (
+                'attachment; filename="template-{}.json"'.format(et.id)
+                )
+            return response
+
         # check whether a new template is to be created
-        if kwargs.get('action', '') == 'new':
+        elif kwargs.get('action', '') == 'new':
             et = EstafetteTemplate(name=random_hex32())
             et.init_from_JSON('{"name": "New template", "description": "(template description)", '
                 '"default_rules": "", "legs": []}', context['user'])
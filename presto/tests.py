@@ -23,5 +23,2020 @@ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.files.base import ContentFile
+from django.db import connection, IntegrityError, transaction
+from django.db.models import Q
+from django.core.management import call_command
+from django.test import override_settings, RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from django.test import TestCase
+from presto.models import (
+    Appeal,
+    Assignment,
+    Blob,
+    AssignmentAncestor,
+    Course,
+    CourseEstafette,
+    CourseStudent,
+    DEFAULT_DATE,
+    DemoAlias,
+    Estafette,
+    EstafetteCase,
+    EstafetteLeg,
+    EstafetteTemplate,
+    Item,
+    ItemAssignment,
+    ItemReview,
+    Language,
+    Objection,
+    Participant,
+    PeerReview,
+    POST_FINISH_DAYS,
+    Referee,
+    relay_decision_counts,
+    ParticipantUpload,
+    relay_participant_counts,
+    Role,
+    ScanCheckpoint,
+    ScanReport,
+    TellTale,
+    UploadFingerprint,
+    UserDownload,
+    UserSession
+    )
+from presto import blacklist
+from presto.blobstore import blob_name
+from presto import cache as presto_cache
+from presto.cache import (
+    all_roles,
+    cache_statistics,
+    estafette_cases,
+    profile_roles,
+    relay_leg_count,
+    relay_metadata
+    )
+from presto.blacklist import blacklisted_words, compile_blacklist, normalized_text
+from presto.download import zip_stream
+from presto.generic import generic_context, set_focus_and_alias
+from presto.plag_scan import (
+    boilerplate_shingles,
+    case_shingles,
+    doc_text,
+    fingerprint_text,
+    MATCH_THRESHOLD,
+    matching_blocks,
+    open_corpus,
+    plain_text,
+    presentation_text,
+    record_telltales,
+    related_assignment_ids,
+    relative_formula,
+    scan_report,
+    scan_texts,
+    spreadsheet_content,
+    TELLTALE_SEPARATOR,
+    text_fingerprints,
+    texts_sharing_fingerprints,
+    upload_path,
+    without_boilerplate,
+    write_corpus
+    )
+from presto import logindex, plag_scan, student
+from presto.management.commands import explain_hot_queries, scan_relay
+from presto.snapshot import ParticipantSnapshot
+from presto.static_storage import PrecompressedManifestStaticFilesStorage, recompressed_png
+from presto.string_tiling import greedy_string_tiling
+from presto import string_tiling
+from presto.teams import team_assignments, team_final_reviews, team_user_downloads, things_to_do
+from presto import utils
+
+# python modules
+from datetime import datetime, timedelta
+from docx import Document
+import gzip
+from openpyxl import Workbook
+from pptx import Presentation
+from pptx.util import Inches
+from PIL import Image
+from io import BytesIO, StringIO
+from json import dumps, loads
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from time import perf_counter
+from unittest import mock, skipUnless
+from zipfile import ZipFile
+from zlib import crc32
+
+# benchmarks take long, so they run only when asked for
+benchmark = skipUnless(os.environ.get('PRESTO_BENCHMARKS'),
+    'set PRESTO_BENCHMARKS=1 to run benchmarks')
+
+
+# returns the path of a temporary directory that is removed when the test has run, and
+# makes the named settings (e.g., MEDIA_ROOT) refer to this directory during the test
+def temp_dir(test, *names):
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path)
+    if names:
+        dirs = test.settings(**{n: path for n in names})
+        dirs.enable()
+        test.addCleanup(dirs.disable)
+    return path
+
+
+# creates a relay with nlegs steps (every third step without required files) and nparts
+# participants who have progressed a random number of steps, and returns the tuple
+# (relay, list of participants)
+def build_relay(nlegs=10, nparts=12, final_reviews=2, seed=1):
+    rnd = random.Random(seed)
+    lang = Language.objects.create(name='English', code='en-US')
+    admin = User.objects.create(username='admin')
+    course = Course.objects.create(code='C1', name='Course', manager=admin, language=lang)
+    et = EstafetteTemplate.objects.create(name='T', creator=admin)
+    legs = []
+    for n in range(1, nlegs + 1):
+        leg = EstafetteLeg.objects.create(template=et, number=n, name='L{}'.format(n),
+            upload_instruction='Upload', review_instruction='Review', creator=admin,
+            required_files='' if n % 3 == 0 else 'Report:rep.pdf')
+        leg.upload_items.add(Item.objects.create(number=1, name='u{}'.format(n), word_count=5))
+        leg.review_items.add(Item.objects.create(number=1, name='r{}'.format(n), word_count=5))
+        legs.append(leg)
+    e = Estafette.objects.create(template=et, name='E', creator=admin)
+    cases = [EstafetteCase.objects.create(estafette=e, letter=c, name='Case ' + c, creator=admin)
+        for c in 'AB']
+    now = timezone.now()
+    r = CourseEstafette.objects.create(course=course, estafette=e,
+        start_time=now - timedelta(days=10), deadline=now + timedelta(days=10),
+        review_deadline=now + timedelta(days=12), end_time=now + timedelta(days=14),
+        final_reviews=final_reviews)
+    parts = []
+    for i in range(nparts):
+        u = User.objects.create(username='s{}'.format(i), first_name='S', last_name=str(i))
+        cs = CourseStudent.objects.create(user=u, course=course)
+        parts.append(Participant.objects.create(student=cs, estafette=r))
+    # let each participant progress a random number of steps
+    by_leg = {}
+    t0 = now - timedelta(days=9)
+    for i, p in enumerate(parts):
+        k = rnd.randint(1, nlegs)
+        pred = None
+        for n in range(1, k + 1):
+            leg = legs[n - 1]
+            dt = t0 + timedelta(hours=n * 3 + i)
+            if n > 1:
+                free = [a for a in by_leg.get(n - 1, [])
+                    if a.successor_id is None and a.participant_id != p.id]
+                pred = free[0] if free else own
+            a = Assignment.objects.create(participant=p, case=cases[i % 2], leg=leg,
+                predecessor=pred, time_assigned=dt)
+            if pred:
+                pred.successor = a
+                pred.save()
+                pr = PeerReview.objects.create(assignment=pred, reviewer=p, grade=3,
+                    grade_motivation='Fine work indeed',
+                    time_submitted=dt + timedelta(hours=1) if rnd.random() < 0.8 else DEFAULT_DATE)
+                ItemReview.objects.create(review=pr, item=leg.review_items.first(),
+                    comment='OK', rating=0)
+                if rnd.random() < 0.7:
+                    for m in (5, 9):
+                        UserDownload.objects.create(user=p.student.user, assignment=pred,
+                            time_downloaded=dt + timedelta(minutes=m))
+            if n < k or rnd.random() < 0.5:
+                a.time_uploaded = dt + timedelta(hours=2)
+                a.save()
+            ItemAssignment.objects.create(assignment=a, item=leg.upload_items.first(),
+                comment='Some text here', rating=0)
+            by_leg.setdefault(n, []).append(a)
+            own = a
+        if k == nlegs:
+            others = [a for a in by_leg[nlegs] if a.participant_id != p.id]
+            for fi in range(min(final_reviews, len(others))):
+                PeerReview.objects.create(assignment=others[fi], reviewer=p,
+                    final_review_index=fi + 1,
+                    time_submitted=(t0 + timedelta(days=5, hours=fi)
+                        if rnd.random() < 0.7 else DEFAULT_DATE))
+                if rnd.random() < 0.6:
+                    UserDownload.objects.create(user=p.student.user, assignment=others[fi],
+                        time_downloaded=t0 + timedelta(days=4, hours=fi))
+    return (r, parts)
+
+
+class PrestoTestCase(TestCase):
+
+    def setUp(self):
+        # NOTE: the cache is not part of the test database, and IDs are reused by tests
+        cache.clear()
+
+
+class ThingsToDoTest(PrestoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.relay, cls.parts = build_relay()
+
+    # returns the progress flags of participant p, determined with separate queries for
+    # each step, as things_to_do did before
+    def progress_flags(self, p):
+        flags = [[False, False, False, False]
+            for i in range(self.relay.estafette.template.nr_of_legs())]
+        for a in team_assignments(p):
+            f = flags[a.leg.number - 1]
+            f[0] = True
+            if a.leg.number > 1:
+                f[1] = (not a.leg.required_files
+                    or team_user_downloads(p, [a.predecessor_id]).exists())
+                pr = PeerReview.objects.filter(assignment=a.predecessor).first()
+                f[2] = pr is not None and pr.time_submitted != DEFAULT_DATE
+            f[3] = a.time_uploaded != DEFAULT_DATE
+        flags += [[False, False] for i in range(self.relay.final_reviews)]
+        for pr in team_final_reviews(p):
+            f = flags[-self.relay.final_reviews + pr.final_review_index - 1]
+            f[0] = (not pr.assignment.leg.required_files
+                or team_user_downloads(p, [pr.assignment_id]).exists())
+            f[1] = pr.time_submitted != DEFAULT_DATE
+        return flags
+
+    def test_parity(self):
+        for p in self.parts:
+            ttd = [t for t in things_to_do(p) if 'finish' not in t]
+            self.assertEqual(
+                [[t['assigned'], t['downloaded'], t['reviewed'], t['uploaded']] if 'step' in t
+                    else [t['downloaded'], t['reviewed']] for t in ttd],
+                self.progress_flags(p)
+                )
+
+    def test_query_count(self):
+        # the number of queries should not depend on the number of steps completed
+        p_list = sorted(self.parts, key=lambda p: team_assignments(p).count())
+        p_list = [p for p in p_list if team_assignments(p).count() > 1]
+        things_to_do(p_list[0])
+        for p in (p_list[0], p_list[-1]):
+            with self.assertNumQueries(4):
+                things_to_do(p)
+
+
+class ParticipantSnapshotTest(PrestoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.relay, cls.parts = build_relay()
+
+    # builds the snapshot of participant p and gets the lookups needed by the student view
+    def lookups(self, p):
+        ps = ParticipantSnapshot(p, 10)
+        return (
+            [ps.item_list(a) for a in ps.assignments],
+            [ps.item_list(a.predecessor) for a in ps.assignments if a.predecessor],
+            [ps.review_item_list(pr) for pr in ps.reviews],
+            ps.reviews_to_appraise(),
+            ps.pending_final_reviews()
+            )
+
+    def test_parity(self):
+        for p in self.parts:
+            a_list = list(team_assignments(p).order_by('-leg__number'))
+            pr_list = PeerReview.objects.filter(
+                Q(reviewer=p) | Q(assignment__participant=p)).order_by('id')
+            self.assertEqual(self.lookups(p), (
+                [a.item_list() for a in a_list],
+                [a.predecessor.item_list() for a in a_list if a.predecessor],
+                [pr.item_list() for pr in pr_list],
+                list(PeerReview.objects.filter(assignment__participant=p).exclude(
+                    time_submitted=DEFAULT_DATE).filter(time_appraised=DEFAULT_DATE).exclude(
+                    Q(assignment__successor__time_uploaded=DEFAULT_DATE) & Q(is_rejection=False)
+                    ).exclude(assignment__clone_of__isnull=False).order_by('id')),
+                list(PeerReview.objects.filter(reviewer=p, assignment__leg__number=10).exclude(
+                    time_submitted__gt=DEFAULT_DATE).order_by('id'))
+                ))
+
+    def test_query_count(self):
+        # a participant near the end of the relay needs as many queries as one at step 2
+        p_list = sorted(self.parts, key=lambda p: team_assignments(p).count())
+        p_list = [p for p in p_list if team_assignments(p).count() > 1]
+        counts = []
+        for p in (p_list[0], p_list[-1]):
+            with CaptureQueriesContext(connection) as cqc:
+                self.lookups(p)
+            counts.append(len(cqc))
+        self.assertEqual(counts[0], counts[1])
+
+
+class TemplateTest(PrestoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.relay, cls.parts = build_relay(nlegs=5, nparts=2)
+        cls.et = cls.relay.estafette.template
+        cls.admin = cls.et.creator
+
+    def test_leg_count(self):
+        self.assertEqual(self.et.nr_of_legs(), 5)
+        leg = EstafetteLeg.objects.create(template=self.et, number=6, name='L6',
+            creator=self.admin)
+        self.et.refresh_from_db()
+        self.assertEqual(self.et.nr_of_legs(), 6)
+        leg.delete()
+        self.et.refresh_from_db()
+        self.assertEqual(self.et.nr_of_legs(), 5)
+        with self.assertNumQueries(0):
+            self.et.nr_of_legs()
+
+    def test_export(self):
+        js = self.et.to_JSON()
+        self.assertEqual(''.join(self.et.iter_JSON()), js)
+        d = loads(js)
+        self.assertEqual([l['name'] for l in d['legs']], ['L{}'.format(n) for n in range(1, 6)])
+        # the number of queries should not depend on the number of legs
+        with self.assertNumQueries(3):
+            self.et.to_JSON()
+
+    # imports the JSON export of the template, and checks that the copy exports the same
+    def check_import(self):
+        js = self.et.to_JSON()
+        for n in (1, 2):
+            et = EstafetteTemplate()
+            et.init_from_JSON(js, self.admin)
+            self.assertEqual(et.name, 'T ({})'.format(n))
+            self.assertEqual(et.creator, self.admin)
+            self.assertEqual(EstafetteTemplate.objects.get(pk=et.pk).nr_of_legs(), 5)
+            d = loads(et.to_JSON())
+            d['name'] = 'T'
+            self.assertEqual(d, loads(js))
+
+    def test_import(self):
+        self.check_import()
+
+    def test_import_without_returned_keys(self):
+        # MySQL does not set the primary keys of objects created in bulk
+        with mock.patch.object(type(connection.features),
+                'can_return_rows_from_bulk_insert', False):
+            self.check_import()
+
+    def test_failed_import(self):
+        d = loads(self.et.to_JSON())
+        del d['legs'][-1]['review_items'][0]['name']
+        with self.assertRaises(KeyError):
+            EstafetteTemplate().init_from_JSON(dumps(d), self.admin)
+        self.assertEqual(EstafetteTemplate.objects.count(), 1)
+        self.assertEqual(EstafetteLeg.objects.count(), 5)
+
+
+class ProgressTest(PrestoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.relay, cls.parts = build_relay()
+
+    # returns the participants whose progress fields differ from the counted values
+    def drifted(self):
+        return [p for p in Participant.objects.all() if p.repair_progress(False)]
+
+    def test_counters(self):
+        self.assertEqual(self.drifted(), [])
+        a = Assignment.objects.filter(successor__isnull=True, predecessor__isnull=False
+            ).select_related('leg', 'participant').last()
+        p = a.participant
+        with self.assertNumQueries(0):
+            self.assertEqual(p.progress(), a.leg.number + p.review_count)
+        # deleting a review or an assignment recounts
+        PeerReview.objects.filter(reviewer=p).last().delete()
+        a.delete()
+        self.assertEqual(self.drifted(), [])
+        p.refresh_from_db()
+        self.assertEqual(p.step_count, a.leg.number - 1)
+        # submitting a review records the time of progress
+        pr = PeerReview.objects.filter(time_submitted=DEFAULT_DATE).first()
+        pr.time_submitted = timezone.now()
+        pr.save()
+        self.assertEqual(Participant.objects.get(pk=pr.reviewer_id).last_progress_at,
+            pr.time_submitted)
+        self.assertEqual(self.drifted(), [])
+
+    def test_check_progress(self):
+        Participant.objects.filter(pk__in=[p.pk for p in self.parts[:3]]).update(
+            step_count=0, review_count=99)
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('check_progress', dry_run=True)
+        self.assertIn('3  participants with drifted progress fields', out.getvalue())
+        self.assertEqual(len(self.drifted()), 3)
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('check_progress')
+        self.assertIn('3  participants repaired', out.getvalue())
+        self.assertEqual(self.drifted(), [])
+
+
+class ZipStreamTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = temp_dir(self)
+        doc = Document()
+        doc.core_properties.author = 'Secret Author'
+        doc.add_paragraph('Some text ' * 500)
+        doc.save(os.path.join(self.dir, 'a.docx'))
+        with open(os.path.join(self.dir, 'b.bin'), 'wb') as f:
+            f.write(os.urandom(3 * 1024 * 1024))
+        self.members = [
+            (os.path.join(self.dir, 'a.docx'), 'work/report.docx', True),
+            (os.path.join(self.dir, 'b.bin'), 'work/data.bin', False)
+            ]
+
+    def test_simultaneous_downloads(self):
+        results = {}
+
+        def download(i):
+            results[i] = b''.join(zip_stream(self.members, chunk_size=65536))
+
+        threads = [threading.Thread(target=download, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # all downloads yield the same files, and no files are written
+        # NOTE: the archives (and the documents in them) may differ in the time stamps
+        #       of their members, so documents are compared by their text
+        contents = []
+        for data in results.values():
+            with ZipFile(BytesIO(data)) as zf:
+                contents.append([
+                    (n, [par.text for par in Document(BytesIO(zf.read(n))).paragraphs]
+                        if n.endswith('.docx') else zf.read(n))
+                    for n in zf.namelist()
+                    ])
+        self.assertEqual(len(contents), 8)
+        for c in contents[1:]:
+            self.assertEqual(c, contents[0])
+        self.assertEqual(sorted(os.listdir(self.dir)), ['a.docx', 'b.bin'])
+        with ZipFile(BytesIO(results[0])) as zf:
+            self.assertIsNone(zf.testzip())
+            doc = Document(BytesIO(zf.read('work/report.docx')))
+            self.assertEqual(doc.core_properties.author, '')
+            with open(os.path.join(self.dir, 'b.bin'), 'rb') as f:
+                self.assertEqual(zf.read('work/data.bin'), f.read())
+
+    def test_chunks(self):
+        # large files are streamed in chunks rather than as a whole
+        sizes = [len(chunk) for chunk in zip_stream(self.members, chunk_size=65536)]
+        self.assertLess(max(sizes), 1024 * 1024)
+
+    @benchmark
+    def test_peak_memory(self):
+        # the peak memory used for streaming should not grow with the size of the files
+        path = os.path.join(self.dir, 'c.bin')
+        with open(path, 'wb') as f:
+            for i in range(64):
+                f.write(os.urandom(1024 * 1024))
+        members = self.members + [(path, 'work/large.bin', False)]
+        tracemalloc.start()
+        t0 = perf_counter()
+        n = sum(len(chunk) for chunk in zip_stream(members))
+        t = perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('\nzip_stream: {:.1f} MB in {:.2f} s with peak memory {:.1f} MB'.format(
+            n / 1048576, t, peak / 1048576))
+        self.assertLess(peak, 16 * 1024 * 1024)
+
+
+class BlobStoreTest(PrestoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = temp_dir(self, 'MEDIA_ROOT')
+        relay, parts = build_relay(nlegs=2, nparts=3, final_reviews=0)
+        self.a_list = list(Assignment.objects.filter(participant__estafette=relay,
+            successor__isnull=True).order_by('id')[:3])
+
+    def upload(self, a, data):
+        return ParticipantUpload.objects.create(assignment=a, file_name='report',
+            upload_file=ContentFile(data, name='report.pdf'))
+
+    def test_shared_content(self):
+        pu1 = self.upload(self.a_list[0], b'same content')
+        pu2 = self.upload(self.a_list[1], b'same content')
+        pu3 = self.upload(self.a_list[2], b'other content')
+        self.assertEqual(pu1.blob, pu2.blob)
+        self.assertNotEqual(pu1.blob, pu3.blob)
+        self.assertEqual(Blob.objects.get(pk=pu1.blob_id).ref_count, 2)
+        self.assertTrue(os.path.samefile(pu1.upload_file.path, pu2.upload_file.path))
+        with pu2.upload_file.open('rb') as f:
+            self.assertEqual(f.read(), b'same content')
+        # deleting an upload releases its blob
+        blob_path = pu1.upload_file.storage.path(blob_name(pu1.blob.sha256))
+        with self.captureOnCommitCallbacks(execute=True):
+            pu1.delete()
+        self.assertFalse(os.path.exists(pu1.upload_file.path))
+        self.assertEqual(Blob.objects.get(pk=pu2.blob_id).ref_count, 1)
+        # also when it is deleted together with its assignment
+        with self.captureOnCommitCallbacks(execute=True):
+            pu2.assignment.delete()
+        self.assertFalse(Blob.objects.filter(pk=pu2.blob_id).exists())
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_dedup_uploads(self):
+        # files stored before the blob store existed (one of them used by two uploads)
+        pu_list = []
+        for i, a in enumerate(self.a_list):
+            name = 'old{}/report.pdf'.format(i)
+            os.makedirs(os.path.join(self.dir, 'old{}'.format(i)))
+            with open(os.path.join(self.dir, name), 'wb') as f:
+                f.write(b'same content' if i < 2 else b'other content')
+            pu_list.append(ParticipantUpload.objects.create(assignment=a, file_name='report',
+                upload_file=name))
+        pu_list.append(ParticipantUpload.objects.create(assignment=self.a_list[2],
+            file_name='copy', upload_file='old0/report.pdf'))
+        self.assertFalse(Blob.objects.exists())
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('dedup_uploads', dry_run=True)
+        self.assertIn('4 uploads to deduplicate', out.getvalue())
+        self.assertIn('12 saved (estimate)', out.getvalue())
+        self.assertFalse(Blob.objects.exists())
+        with redirect_stdout(out):
+            call_command('dedup_uploads')
+            # running the command again changes nothing
+            ParticipantUpload.objects.update(blob=None)
+            call_command('dedup_uploads')
+        self.assertEqual(
+            sorted(Blob.objects.values_list('size', 'ref_count')), [(12, 2), (13, 1)])
+        self.assertFalse(ParticipantUpload.objects.filter(blob__isnull=True).exists())
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.dir, 'old0/report.pdf'), os.path.join(self.dir, 'old1/report.pdf')))
+
+
+# writes a single-page PDF file showing text to path
+def write_pdf(path, text):
+    stream = 'BT /F1 12 Tf 72 720 Td ({}) Tj ET'.format(text)
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R'
+            ' /Resources << /Font << /F1 5 0 R >> >> >>',
+        '<< /Length {} >>\nstream\n{}\nendstream'.format(len(stream), stream),
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+        ]
+    pdf = '%PDF-1.4\n'
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(pdf))
+        pdf += '{} 0 obj\n{}\nendobj\n'.format(i + 1, obj)
+    xref = len(pdf)
+    pdf += 'xref\n0 {}\n0000000000 65535 f \n'.format(len(objects) + 1)
+    pdf += ''.join('{:010d} 00000 n \n'.format(o) for o in offsets)
+    pdf += 'trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+        len(objects) + 1, xref)
+    with open(path, 'w') as f:
+        f.write(pdf)
+
+
+class PdfToTextTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = temp_dir(self)
+        self.paths = []
+        for i in range(200):
+            path = os.path.join(self.dir, 'f{}.pdf'.format(i))
+            write_pdf(path, 'Document number {} of the stress test'.format(i))
+            self.paths.append(path)
+        utils.PDF_TEXT_CACHE.clear()
+
+    def tearDown(self):
+        utils.PDF_TEXT_CACHE.clear()
+
+    def test_concurrent_conversions(self):
+        converted_pdf = utils.converted_pdf
+        lock = threading.Lock()
+        running = [0, 0]
+        calls = [0]
+
+        # counts the conversions that are running at the same time
+        def counted(path):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+                calls[0] += 1
+            try:
+                return converted_pdf(path)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        utils.converted_pdf = counted
+        try:
+            with ThreadPoolExecutor(200) as ex:
+                texts = list(ex.map(utils.pdf_to_text, self.paths))
+            # the second time, the texts come from the cache
+            with ThreadPoolExecutor(200) as ex:
+                cached = list(ex.map(utils.pdf_to_text, self.paths))
+        finally:
+            utils.converted_pdf = converted_pdf
+        for i, text in enumerate(texts):
+            self.assertIn('Document number {} of'.format(i), text)
+        self.assertEqual(cached, texts)
+        self.assertEqual(calls[0], 200)
+        self.assertLessEqual(running[1], settings.PDF_TO_TEXT_WORKERS)
+
+
+class HotQueriesTest(PrestoTestCase):
+
+    def test_no_full_scans(self):
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('explain_hot_queries')
+        self.assertTrue(out.getvalue().endswith('No full table scans\n'))
+
+    def test_full_scan(self):
+        plan, scans = explain_hot_queries.explain(
+            UserDownload.objects.filter(time_downloaded__gt=DEFAULT_DATE))
+        self.assertEqual(scans, ['presto_userdownload'])
+        plan, scans = explain_hot_queries.explain(
+            UserDownload.objects.filter(user__id=1, assignment__id=1))
+        self.assertEqual(scans, [])
+
+
+class LogIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = temp_dir(self, 'LOG_DIR')
+        self.ymd = '20261019'
+        self.entries = []
+        for i in range(600):
+            msg = ['Viewing step {}', 'ERROR: Step {} failed\nTraceback\n  ValueError: {}',
+                'WARNING: step {} took long'][i % 3].format(i, i)
+            self.entries.append('2026-10-19  10:{:02d}:{:02d} [1.2.3.{}] [u{}] {}'.format(
+                i // 60, i % 60, i % 7, i % 5, msg))
+        with open(os.path.join(self.dir, 'presto-{}.log'.format(self.ymd)), 'w') as f:
+            f.write(''.join(e + '\n' for e in self.entries))
+
+    # returns the list of all entries found by following the "next page" cursors
+    def all_pages(self, **kwargs):
+        entries = []
+        after = 0
+        while True:
+            page, first, last = logindex.log_page(self.ymd, after=after, size=50, **kwargs)
+            if not page:
+                return entries
+            entries += page
+            after = last
+
+    def test_index(self):
+        self.assertEqual(logindex.index_logs(), 600)
+        self.assertEqual(self.all_pages(), self.entries)
+        self.assertEqual(self.all_pages(user='u3'),
+            [e for e in self.entries if '] [u3] ' in e])
+        self.assertEqual(self.all_pages(level='error'),
+            [e for e in self.entries if ' ERROR: ' in e])
+        # paging backwards from the end
+        page, first, last = logindex.log_page(self.ymd, tail=True, size=50)
+        self.assertEqual(page, self.entries[-50:])
+        page, first, last = logindex.log_page(self.ymd, before=first, size=50)
+        self.assertEqual(page, self.entries[-100:-50])
+
+    def test_text_search(self):
+        db = logindex.log_index()
+        fts = logindex.has_text_index(db)
+        db.close()
+        if not fts:
+            self.skipTest('SQLite has no FTS5 trigram tokenizer')
+        # patterns match the entire entry (also time, IP address and user name), and
+        # are case-sensitive, both with and without text index
+        for pattern in ['10:00:11', '1.2.3.4', 'u1] Viewing', 'step 1', 'Step 1',
+                'ValueError: 42', 'Traceback', 'no such text']:
+            found = self.all_pages(pattern=pattern)
+            with mock.patch.object(logindex, 'has_text_index', lambda db: False):
+                self.assertEqual(self.all_pages(pattern=pattern), found)
+            self.assertEqual(found, [e for e in self.entries if pattern in e])
+
+
+class CacheTest(PrestoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.relay, cls.parts = build_relay(nlegs=4, nparts=3)
+
+    def setUp(self):
+        super().setUp()
+        presto_cache.CACHE_STATS.clear()
+
+    def test_relay_lookups(self):
+        r = self.relay
+        md = relay_metadata(r.id)
+        self.assertEqual(md['participant_count'], 3)
+        relay_leg_count(r.id)
+        estafette_cases(r.estafette_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(relay_metadata(r.id), md)
+            self.assertEqual(relay_leg_count(r.id), 4)
+            self.assertEqual(len(estafette_cases(r.estafette_id)), 2)
+        # changes of the relay, its legs, cases and participants are seen right away
+        r.final_reviews = 1
+        r.save()
+        self.assertEqual(relay_metadata(r.id)['final_reviews'], 1)
+        u = User.objects.create(username='late')
+        cs = CourseStudent.objects.create(user=u, course=r.course)
+        p = Participant.objects.create(student=cs, estafette=r)
+        self.assertEqual(relay_metadata(r.id)['participant_count'], 4)
+        p.delete()
+        self.assertEqual(relay_metadata(r.id)['participant_count'], 3)
+        et = r.estafette.template
+        leg = EstafetteLeg.objects.create(template=et, number=5, name='L5', creator=et.creator)
+        self.assertEqual(relay_leg_count(r.id), 5)
+        leg.delete()
+        self.assertEqual(relay_leg_count(r.id), 4)
+        EstafetteCase.objects.create(estafette=r.estafette, letter='C', name='Case C',
+            creator=et.creator)
+        self.assertEqual(len(estafette_cases(r.estafette_id)), 3)
+
+    def test_evicted_version(self):
+        md = relay_metadata(self.relay.id)
+        # when a version is evicted from the cache, the values that depend on it are lost
+        cache.delete(presto_cache.version_key('CourseEstafette', self.relay.id))
+        CourseEstafette.objects.filter(pk=self.relay.id).update(final_reviews=1)
+        self.assertEqual(relay_metadata(self.relay.id), dict(md, final_reviews=1))
+
+    def test_roles(self):
+        roles = [Role.objects.create(name=n, rank=i)
+            for i, n in enumerate(['Student', 'Instructor'])]
+        profile = self.relay.estafette.template.creator.profile
+        self.assertEqual(profile_roles(profile), [])
+        profile.roles.add(roles[0])
+        self.assertEqual(profile_roles(profile), roles[:1])
+        self.assertEqual(all_roles(), roles)
+        roles.append(Role.objects.create(name='Developer', rank=2))
+        self.assertEqual(all_roles(), roles)
+        profile.roles.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(profile_roles(profile), [])
+            # looking up roles writes nothing to the database
+            self.assertEqual(profile_roles(profile), [])
+
+    def test_superuser_roles(self):
+        roles = [Role.objects.create(name=n, rank=i)
+            for i, n in enumerate(['Student', 'Instructor', 'Developer'])]
+        su = User.objects.create(username='root', is_superuser=True)
+        su.profile.roles.add(roles[0])
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        request.user = su
+        self.assertEqual(list(generic_context(request)['user_roles']), roles)
+        self.assertEqual(list(su.profile.roles.all()), roles)
+        self.assertEqual(profile_roles(su.profile), roles)
+
+    def test_statistics(self):
+        for i in range(3):
+            relay_metadata(self.relay.id)
+        self.assertEqual(cache_statistics(), [
+            {'name': 'relay', 'hits': 2, 'misses': 1, 'hit_rate': '66.7%'}])
+
+
+class EncodingTest(SimpleTestCase):
+
+    # codes produced by the original implementation (which encoded digit by digit)
+    CODES = [
+        ('0123456789abcdeffedcba9876543210', 0, 'f123626319abcdeffe70ba987554321f'),
+        ('0123456789abcdeffedcba9876543210', 1, 'f123626319aacdeffe70ba997554321f'),
+        ('0123456789abcdeffedcba9876543210', 4711, 'f12362631bacccefff70baff75543215'),
+        ('0123456789abcdeffedcba9876543210', 2 ** 40 + 17, 'f133626319aacdeffe70ba897554321f'),
+        ('0123456789abcdeffedcba9876543210', 2 ** 64 - 1, 'fedc6293165432100170456785abcde7'),
+        ('5f3a9c0e7b1d2468ace13579bdf02468', 42, 'ff3a62031b172468ac703553b5f0246a'),
+        ('5f3a9c0e7b1d2468ace13579bdf02468', 123456789, 'ff3a620316a82838d070356cb5f02467')
+        ]
+
+    def test_original_codes(self):
+        for k, n, code in self.CODES:
+            self.assertEqual(utils.encode(n, k, True), code)
+            self.assertEqual(utils.encode_many([n], k, True), [code])
+            self.assertEqual(utils.decode(code, k), n)
+
+    def test_round_trip(self):
+        rnd = random.Random(37)
+        for i in range(2000):
+            k = utils.random_hex(32)
+            n = rnd.choice([0, 1, rnd.randrange(1 << 20), rnd.randrange(1 << 64)])
+            self.assertEqual(utils.decode(utils.encode(n, k), k), n)
+            self.assertEqual(utils.decode(utils.encode(n, k, True), k), n)
+        ns = list(range(1000))
+        random.seed(37)
+        codes = utils.encode_many(ns, k)
+        random.seed(37)
+        self.assertEqual(codes, [utils.encode(n, k) for n in ns])
+        self.assertEqual([utils.decode(c, k) for c in codes], ns)
+
+    def test_invalid_codes(self):
+        k = '5f3a9c0e7b1d2468ace13579bdf02468'
+        code = utils.encode(4711, k, True)
+        for c in [code[:-1], 'x' * 32]:
+            with self.assertRaisesMessage(ValueError, utils.INCORRECT_SESSION_KEY):
+                utils.decode(c, k)
+        # changing a digit (other than the seed) breaks the bit count check
+        c = code[:5] + '{:x}'.format(int(code[5], 16) ^ 1) + code[6:]
+        with self.assertRaisesMessage(ValueError, utils.INCONSISTENT_SESSION_KEY):
+            utils.decode(c, k)
+        # a code decoded with another key does not pass the validation digits
+        with self.assertRaises(ValueError):
+            utils.decode(code, '0123456789abcdeffedcba9876543210')
+
+    @benchmark
+    def test_speed(self):
+        k = utils.random_hex(32)
+        ns = list(range(50000))
+        t0 = perf_counter()
+        codes = [utils.encode(n, k) for n in ns]
+        t1 = perf_counter()
+        codes = utils.encode_many(ns, k)
+        t2 = perf_counter()
+        self.assertEqual([utils.decode(c, k) for c in codes], ns)
+        t3 = perf_counter()
+        print('\nencoding 50k ids: encode {:.2f} s, encode_many {:.2f} s, decode {:.2f} s'.format(
+            t1 - t0, t2 - t1, t3 - t2))
+
+
+class StaticStorageTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = temp_dir(self)
+        self.storage = PrecompressedManifestStaticFilesStorage(
+            location=self.dir, base_url='/static/')
+        # a stored PNG image is not compressed at all
+        img = Image.new('RGB', (64, 64))
+        img.putdata([(x * 4, y * 4, 0) for y in range(64) for x in range(64)])
+        buf = BytesIO()
+        img.save(buf, 'PNG', compress_level=0)
+        self.files = {
+            'img/logo.png': buf.getvalue(),
+            'css/site.css': (b'body { background: url("../img/logo.png"); }\n'
+                b'/*# sourceMappingURL=site.css.map */\n' + b'.x { color: red; }\n' * 100),
+            'js/tiny.js': b'var x = 1;\n'
+            }
+
+    # collects the files as "manage.py collectstatic" does, and returns the manifest
+    def collect(self):
+        for name, data in self.files.items():
+            self.storage.save(name, ContentFile(data))
+        paths = {name: (self.storage, name) for name in self.files}
+        for name, hashed_name, processed in self.storage.post_process(paths):
+            if isinstance(processed, Exception):
+                raise processed
+        return self.storage.hashed_files
+
+    def read(self, name):
+        with open(self.storage.path(name), 'rb') as f:
+            return f.read()
+
+    def test_hashed_names(self):
+        hashed = self.collect()
+        for name in self.files:
+            self.assertNotEqual(hashed[name], name)
+            self.assertTrue(self.storage.exists(hashed[name]))
+        css = self.read(hashed['css/site.css']).decode()
+        self.assertIn('../img/' + os.path.basename(hashed['img/logo.png']), css)
+        # references to files that do not exist are left as they are
+        self.assertIn('sourceMappingURL=site.css.map', css)
+        self.assertEqual(self.storage.url('css/site.css'), '/static/' + hashed['css/site.css'])
+
+    def test_precompressed(self):
+        hashed = self.collect()
+        for name in ['css/site.css', hashed['css/site.css']]:
+            with gzip.open(self.storage.path(name) + '.gz') as f:
+                self.assertEqual(f.read(), self.read(name))
+        # small files are not compressed
+        self.assertFalse(self.storage.exists(hashed['js/tiny.js'] + '.gz'))
+
+    def test_images(self):
+        hashed = self.collect()
+        for name in ['img/logo.png', hashed['img/logo.png']]:
+            data = self.read(name)
+            self.assertLess(len(data), len(self.files['img/logo.png']))
+            self.assertEqual(Image.open(BytesIO(data)).tobytes(),
+                Image.open(BytesIO(self.files['img/logo.png'])).tobytes())
+        # images with gamma information are not recompressed
+        buf = BytesIO()
+        Image.new('RGB', (64, 64)).save(buf, 'PNG', compress_level=0)
+        data = buf.getvalue()
+        self.assertIsNotNone(recompressed_png(data))
+        # NOTE: the gAMA chunk must come right after the IHDR chunk (at byte 33)
+        chunk = b'gAMA' + (45455).to_bytes(4, 'big')
+        data = (data[:33] + (4).to_bytes(4, 'big') + chunk + crc32(chunk).to_bytes(4, 'big')
+            + data[33:])
+        self.assertIsNone(recompressed_png(data))
+
+
+class RelayCountsTest(PrestoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(39)
+        lang = Language.objects.create(name='English', code='en-US')
+        admin = User.objects.create(username='admin')
+        et = EstafetteTemplate.objects.create(name='T', creator=admin)
+        leg = EstafetteLeg.objects.create(template=et, number=1, name='L1', creator=admin)
+        ref = Referee.objects.create(user=admin, estafette_leg=leg)
+        course = Course.objects.create(code='C1', name='Course', manager=admin, language=lang)
+        now = timezone.now()
+        cls.relays = []
+        for r in range(50):
+            e = Estafette.objects.create(template=et, name='E{}'.format(r), creator=admin)
+            case = EstafetteCase.objects.create(estafette=e, letter='A', name='A', creator=admin)
+            end = now + timedelta(days=rnd.choice([-20, -2, 5]))
+            ce = CourseEstafette.objects.create(course=course, estafette=e,
+                start_time=now - timedelta(days=50), deadline=end - timedelta(days=2),
+                review_deadline=end - timedelta(days=1), end_time=end)
+            cls.relays.append(ce)
+            parts = []
+            for i in range(rnd.randint(2, 5)):
+                u = User.objects.create(username='u{}_{}'.format(r, i))
+                cs = CourseStudent.objects.create(user=u, course=course,
+                    dummy_index=rnd.choice([0, 0, 0, -1]))
+                parts.append(Participant.objects.create(student=cs, estafette=ce,
+                    time_last_action=now - timedelta(hours=rnd.choice([1, 48]))))
+            for p in parts:
+                a = Assignment.objects.create(participant=p, case=case, leg=leg)
+                for q in parts:
+                    if q == p or rnd.random() < 0.5:
+                        continue
+                    pr = PeerReview.objects.create(assignment=a, reviewer=q,
+                        is_appeal=rnd.random() < 0.5,
+                        time_appeal_assigned=rnd.choice([DEFAULT_DATE, now]))
+                    if rnd.random() < 0.6:
+                        ap = Appeal.objects.create(review=pr, referee=ref,
+                            time_decided=rnd.choice(
+                                [DEFAULT_DATE, now - timedelta(days=1), now - timedelta(days=10)]),
+                            time_objection_assigned=rnd.choice([DEFAULT_DATE, now]),
+                            is_contested_by_predecessor=rnd.random() < 0.3,
+                            is_contested_by_successor=rnd.random() < 0.3)
+                        if rnd.random() < 0.5:
+                            Objection.objects.create(appeal=ap, referee=ref,
+                                time_decided=rnd.choice([DEFAULT_DATE, now]))
+
+    # returns the decision counts for relay ce, computed with separate queries, as
+    # CourseEstafette.pending_decisions did before
+    def decision_counts(self, ce):
+        adt = timezone.now() - timedelta(days=POST_FINISH_DAYS)
+        appeals = Appeal.objects.filter(review__reviewer__estafette=ce)
+        uncontested = Q(is_contested_by_predecessor=False, is_contested_by_successor=False)
+        return (
+            PeerReview.objects.filter(reviewer__estafette=ce, is_appeal=True,
+                time_appeal_assigned=DEFAULT_DATE).count()
+                + appeals.filter(time_decided=DEFAULT_DATE).count(),
+            appeals.filter(time_decided__gt=DEFAULT_DATE, time_objection_assigned=DEFAULT_DATE
+                ).exclude(uncontested).count()
+                + Objection.objects.filter(time_decided=DEFAULT_DATE,
+                    appeal__review__reviewer__estafette=ce).count(),
+            appeals.filter(uncontested, time_decided__gt=adt).count()
+            )
+
+    def test_decision_counts(self):
+        ids = [ce.id for ce in self.relays]
+        with self.assertNumQueries(3):
+            counts = relay_decision_counts(ids)
+        self.assertEqual(counts, {ce.id: self.decision_counts(ce) for ce in self.relays})
+        self.assertTrue(any(any(c) for c in counts.values()))
+
+    def test_participant_counts(self):
+        ids = [ce.id for ce in self.relays]
+        with self.assertNumQueries(1):
+            counts = relay_participant_counts(ids)
+        since = timezone.now() - timedelta(days=1)
+        for ce in self.relays:
+            pl = Participant.objects.filter(estafette=ce, student__dummy_index__gt=-1)
+            self.assertEqual(counts[ce.id], {
+                'participant_count': pl.count(),
+                'active_count': pl.filter(time_last_action__gte=since).count()
+                })
+
+
+class UserSessionTest(PrestoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        lang = Language.objects.create(name='English', code='en-US')
+        cls.user = User.objects.create(username='demo')
+        course = Course.objects.create(code='C1', name='Course', manager=cls.user, language=lang)
+        cls.cs = CourseStudent.objects.create(user=cls.user, course=course)
+
+    # creates n sessions of which every other one has expired, and gives every fifth
+    # session an alias
+    def create_sessions(self, n):
+        now = timezone.now()
+        UserSession.objects.bulk_create([UserSession(user=self.user, session_key=str(i),
+            last_action=now - timedelta(days=i % 2, minutes=1)) for i in range(n)],
+            batch_size=5000)
+        DemoAlias.objects.bulk_create([DemoAlias(user=self.user, session=us,
+            course_student=self.cs, alias='Alias {}'.format(us.session_key))
+            for us in UserSession.objects.all() if int(us.session_key) % 5 == 0],
+            batch_size=5000)
+
+    def prune(self, **options):
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('prune_sessions', **options)
+        return out.getvalue()
+
+    def test_prune_sessions(self):
+        self.create_sessions(200)
+        self.assertIn('100  sessions would be deleted', self.prune(dry_run=True))
+        self.assertEqual(UserSession.objects.count(), 200)
+        self.assertIn('100  sessions deleted', self.prune(batch_size=30))
+        self.assertEqual(sorted(int(k) % 2 for k in
+            UserSession.objects.values_list('session_key', flat=True)), [0] * 100)
+        # aliases are deleted with their sessions
+        self.assertEqual(DemoAlias.objects.count(), 20)
+        self.assertIn('0  sessions deleted', self.prune())
+
+    def test_alias(self):
+        self.create_sessions(20)
+        us = UserSession.objects.get(session_key='2')
+        context = {'user': self.user, 'user_session': us, 'notifications': []}
+        # an alias that is in use by an active session is refused
+        self.assertFalse(set_focus_and_alias(context, self.cs.id, 'Alias  10 '))
+        self.assertEqual(context['notifications'][-1][2], 'Alias "Alias 10" already in use')
+        # the alias of an expired session is taken over
+        self.assertTrue(set_focus_and_alias(context, self.cs.id, 'Alias 15'))
+        self.assertFalse(UserSession.objects.filter(session_key='15').exists())
+        self.assertEqual(DemoAlias.objects.get(session=us).alias, 'Alias 15')
+        self.assertEqual(loads(UserSession.objects.get(pk=us.pk).state)['alias'], 'Alias 15')
+        # when told to clear sessions, an alias that is in use is taken over as well
+        self.assertTrue(set_focus_and_alias(context, self.cs.id, 'Alias 10', True))
+        self.assertFalse(UserSession.objects.filter(session_key='10').exists())
+        self.assertEqual(DemoAlias.objects.get(session=us).alias, 'Alias 10')
+
+    @benchmark
+    def test_speed(self):
+        t0 = perf_counter()
+        self.create_sessions(100000)
+        t1 = perf_counter()
+        # looking up an alias takes a single-row query, while before, the states of all
+        # sessions of the user were read
+        names = ['Alias {}'.format(i) for i in range(0, 100000, 1000)]
+        for alias in names:
+            DemoAlias.objects.filter(user_id=self.user.id, alias=alias
+                ).select_related('session').first()
+        t2 = perf_counter()
+        for alias in names[:5]:
+            [us for us in UserSession.objects.filter(user=self.user)
+                if loads(us.state).get('alias') == alias]
+        t3 = perf_counter()
+        self.prune()
+        t4 = perf_counter()
+        self.assertEqual(UserSession.objects.count(), 50000)
+        print('\n100k sessions: created in {:.2f} s, alias lookup {:.2f} ms '
+            '(reading all sessions {:.0f} ms), 50k sessions pruned in {:.2f} s'.format(
+            t1 - t0, (t2 - t1) * 10, (t3 - t2) * 200, t4 - t3))
+
+
+class DuplicateAssignmentTest(PrestoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Role.objects.create(name='Student', rank=0)
+        self.relay, parts = build_relay(nlegs=3, nparts=3, final_reviews=0)
+        # start a fresh participant who has uploaded step 1
+        u = User.objects.create(username='newcomer')
+        u.profile.roles.add(Role.objects.get(name='Student'))
+        cs = CourseStudent.objects.create(user=u, course=self.relay.course)
+        self.p = Participant.objects.create(student=cs, estafette=self.relay)
+        self.legs = list(EstafetteLeg.objects.filter(template=self.relay.estafette.template
+            ).order_by('number'))
+        self.cases = list(EstafetteCase.objects.filter(estafette=self.relay.estafette))
+        Assignment.objects.create(participant=self.p, case=self.cases[0], leg=self.legs[0],
+            time_uploaded=timezone.now())
+
+    def active_assignments(self, leg):
+        return Assignment.objects.filter(participant=self.p, leg=leg,
+            clone_of__isnull=True, is_rejected=False, is_retired=False)
+
+    # performs the "proceed" action of the student view, and returns the logged messages
+    def proceed(self, atomic=transaction.atomic):
+        request = RequestFactory().get('/student/proceed/' + '0' * 32)
+        SessionMiddleware(lambda r: None).process_request(request)
+        request.session.save()
+        request.user = self.p.student.user
+        logged = []
+        with mock.patch.object(student, 'decode', lambda h, k: self.p.id), \
+                mock.patch.object(student, 'render', lambda request, tpl, context: context), \
+                mock.patch.object(student, 'log_message', lambda m, *a: logged.append(m)), \
+                mock.patch.object(student, 'transaction', mock.Mock(atomic=atomic)):
+            student.student(request, action='proceed', hex='0' * 32)
+        return logged
+
+    def test_constraint(self):
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Assignment.objects.create(participant=self.p, case=self.cases[1],
+                    leg=self.legs[0])
+        # rejected and retired assignments and clones do not count
+        a = self.active_assignments(self.legs[0]).get()
+        Assignment.objects.create(participant=self.p, case=self.cases[1], leg=self.legs[0],
+            clone_of=a)
+        a.is_rejected = True
+        a.save()
+        b = Assignment.objects.create(participant=self.p, case=self.cases[1], leg=self.legs[0])
+        b.is_retired = True
+        b.save()
+        Assignment.objects.create(participant=self.p, case=self.cases[0], leg=self.legs[0])
+        self.assertEqual(self.active_assignments(self.legs[0]).count(), 1)
+
+    def test_retired_duplicate(self):
+        # a retired duplicate of step 1 (without upload) does not keep the participant
+        # from proceeding, and is not rejected work
+        dup = Assignment.objects.create(participant=self.p, case=self.cases[1],
+            leg=self.legs[0], is_retired=True)
+        self.assertNotIn(dup, team_assignments(self.p))
+        self.proceed()
+        a = self.active_assignments(self.legs[1]).get()
+        self.assertEqual(a.predecessor.successor, a)
+        dup.refresh_from_db()
+        self.assertFalse(dup.is_rejected)
+
+    def test_concurrent_proceed(self):
+        atomic = transaction.atomic
+        first = [True]
+
+        # lets a "concurrent request" assign step 2 just before the proceed action does
+        # NOTE: the first transaction of the student view is the one that assigns the step
+        def competing_atomic():
+            if first[0]:
+                first[0] = False
+                Assignment.objects.create(participant=self.p, case=self.cases[1],
+                    leg=self.legs[1])
+            return atomic()
+
+        logged = self.proceed(competing_atomic)
+        # the action failed with an IntegrityError, and was completed by the other request
+        self.assertFalse(first[0])
+        self.assertTrue([m for m in logged if 'was assigned concurrently' in m])
+        self.assertEqual(self.active_assignments(self.legs[1]).count(), 1)
+        self.assertFalse(Assignment.objects.filter(leg=self.legs[0],
+            successor__participant=self.p).exists())
+
+
+@override_settings(ASSIGNMENT_CLOSURE_TABLE=True)
+class RelatedAssignmentsTest(PrestoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(42)
+        with override_settings(ASSIGNMENT_CLOSURE_TABLE=True):
+            relay, parts = build_relay(nlegs=8, nparts=30, seed=42)
+            # add clones (also of clones) and assignments building on these clones
+            uploaded = list(Assignment.objects.exclude(time_uploaded=DEFAULT_DATE).order_by('id'))
+            for i in range(40):
+                src = rnd.choice(uploaded)
+                if rnd.random() < 0.3:
+                    src = Assignment.objects.filter(clone_of__isnull=False).last() or src
+                if Assignment.objects.filter(participant=src.participant, leg=src.leg,
+                        clone_of=src).exists():
+                    continue
+                clone = Assignment.objects.create(participant=src.participant, case=src.case,
+                    leg=src.leg, time_assigned=src.time_assigned,
+                    time_uploaded=src.time_uploaded, clone_of=src)
+                if src.leg.number < 8:
+                    leg = EstafetteLeg.objects.get(template=src.leg.template,
+                        number=src.leg.number + 1)
+                    p = rnd.choice(parts)
+                    if not Assignment.objects.filter(participant=p, leg=leg,
+                            clone_of__isnull=True, is_rejected=False).exists():
+                        uploaded.append(Assignment.objects.create(participant=p,
+                            case=src.case, leg=leg, predecessor=clone,
+                            time_uploaded=timezone.now() - timedelta(days=rnd.randint(0, 5))))
+            # let some assignments build on other work
+            for a in rnd.sample(list(Assignment.objects.filter(predecessor__isnull=False,
+                    clone_of__isnull=True).order_by('id')), 15):
+                a.predecessor = rnd.choice(list(Assignment.objects.filter(
+                    leg__number=a.leg.number - 1).exclude(id=a.id).order_by('id')))
+                a.save()
+
+    # returns the set of IDs of assignments related to a, found hop by hop as the scanner
+    # did before
+    def related_ids(self, a):
+        prid_list = []
+        for o in Assignment.objects.filter(participant=a.participant,
+                case__letter=a.case.letter, time_uploaded__lte=a.time_uploaded):
+            pr_a = o.predecessor
+            while pr_a:
+                while pr_a.clone_of:
+                    pr_a = pr_a.clone_of
+                prid_list.append(pr_a.id)
+                pr_a = pr_a.predecessor
+        prid_list += Assignment.objects.filter(clone_of__in=prid_list
+            ).values_list('id', flat=True)
+        n_set = set()
+        o_set = set(Assignment.objects.filter(
+            Q(predecessor__in=prid_list) | Q(clone_of__in=prid_list)
+            ).values_list('id', flat=True))
+        while o_set:
+            n_set |= o_set
+            o_set = set(Assignment.objects.filter(
+                Q(predecessor__in=o_set) | Q(clone_of__in=o_set)
+                ).values_list('id', flat=True)) - n_set
+        return set(prid_list) | n_set
+
+    def test_parity(self):
+        a_list = Assignment.objects.exclude(time_uploaded=DEFAULT_DATE).filter(
+            clone_of__isnull=True)
+        self.assertTrue(Assignment.objects.filter(clone_of__isnull=False).exists())
+        for a in a_list:
+            expected = self.related_ids(a)
+            with self.settings(ASSIGNMENT_CLOSURE_TABLE=False):
+                with self.assertNumQueries(1):
+                    cte = set(related_assignment_ids(a))
+            self.assertEqual(cte, expected)
+            with self.assertNumQueries(1):
+                self.assertEqual(set(related_assignment_ids(a)), expected)
+
+    def test_closure_table(self):
+        # the closure table that is maintained on save equals a rebuilt one
+        maintained = set(AssignmentAncestor.objects.values_list(
+            'descendant_id', 'ancestor_id', 'depth'))
+        self.assertTrue(maintained)
+        with redirect_stdout(StringIO()):
+            call_command('build_closure')
+        self.assertEqual(maintained, set(AssignmentAncestor.objects.values_list(
+            'descendant_id', 'ancestor_id', 'depth')))
+
+
+class StringTilingTest(SimpleTestCase):
+
+    # checks that tiles are matches that do not overlap, and returns the tuple of
+    # lists of flags (marked tokens of a, marked tokens of b)
+    def check_tiles(self, a, b, tiles):
+        marked_a = [False] * len(a)
+        marked_b = [False] * len(b)
+        for i, j, k in tiles:
+            self.assertGreaterEqual(k, string_tiling.MIN_TILE_WORDS)
+            self.assertEqual(a[i:i + k], b[j:j + k])
+            for x in range(k):
+                self.assertFalse(marked_a[i + x] or marked_b[j + x])
+                marked_a[i + x] = True
+                marked_b[j + x] = True
+        return (marked_a, marked_b)
+
+    def test_tiles(self):
+        a = list(range(100))
+        b = list(range(50, 80)) + list(range(200, 230)) + list(range(40))
+        self.assertEqual(greedy_string_tiling(a, b), [(0, 60, 40), (50, 0, 30)])
+        # matches shorter than the minimum length are ignored
+        self.assertEqual(greedy_string_tiling([1, 2, 3, 9], [1, 2, 3, 8]), [])
+        self.assertEqual(greedy_string_tiling([1, 2, 3, 4], [0, 1, 2, 3, 4]), [(0, 1, 4)])
+
+    def test_short_inputs(self):
+        self.assertEqual(greedy_string_tiling([], []), [])
+        self.assertEqual(greedy_string_tiling([1, 2, 3], []), [])
+        self.assertEqual(greedy_string_tiling([1, 2, 3], [1, 2, 3]), [])
+        self.assertEqual(string_tiling.matching_blocks('', 'some text', 1), [])
+
+    def test_long_match(self):
+        # a match much longer than the initial search length makes the search restart
+        a = list(range(1000))
+        b = [-1] + a[100:900] + [-2]
+        self.assertEqual(greedy_string_tiling(a, b), [(100, 1, 800)])
+
+    def test_occlusion(self):
+        # each token is part of at most one tile, so a text repeated in b matches once
+        p = list(range(40))
+        self.assertEqual(greedy_string_tiling(p, p + [-1] + p), [(0, 0, 40)])
+        self.assertEqual(greedy_string_tiling(p + [-1] + p, p), [(0, 0, 40)])
+        # the parts of a shorter match that are not occluded by a longer one are found
+        a = list(range(60))
+        b = list(range(20, 60)) + [-1] + list(range(30))
+        self.assertEqual(greedy_string_tiling(a, b), [(0, 41, 20), (20, 0, 40)])
+
+    def test_maximal_tiling(self):
+        # no common run of unmarked tokens remains that is long enough to be a tile
+        rnd = random.Random(43)
+        m = string_tiling.MIN_TILE_WORDS
+        for n in range(500):
+            v = rnd.randint(2, 6)
+            a = [rnd.randrange(v) for x in range(rnd.randint(0, 60))]
+            b = [rnd.randrange(v) for x in range(rnd.randint(0, 60))]
+            marked_a, marked_b = self.check_tiles(a, b, greedy_string_tiling(a, b))
+            for i in range(len(a) - m + 1):
+                for j in range(len(b) - m + 1):
+                    self.assertFalse(all(a[i + x] == b[j + x]
+                        and not marked_a[i + x] and not marked_b[j + x] for x in range(m)))
+
+    def test_character_offsets(self):
+        text_a = 'First, some words that are copied from the other text.  Then more.'
+        text_b = 'Here  some   words that are\ncopied from the other   text.'
+        blocks = string_tiling.matching_blocks(text_a, text_b, 10)
+        self.assertEqual([text_a[p:p + n] for p, n in blocks],
+            ['some words that are copied from the other text.'])
+        self.assertEqual(string_tiling.matching_blocks(text_a, text_b, 50), [])
+
+    # returns a random text of n words, and a text of n random words in which k blocks
+    # of the first text are planted (in random order), plus the list of positions and
+    # sizes (in characters) of these blocks in the first text
+    def planted_texts(self, rnd, n, k):
+        vocabulary = ['w{}{}'.format(i, 'x' * rnd.randint(0, 6)) for i in range(5000)]
+        a = rnd.choices(vocabulary, k=n)
+        b = rnd.choices(vocabulary, k=n)
+        offsets = [0]
+        for w in a:
+            offsets.append(offsets[-1] + len(w) + 1)
+        planted = []
+        for x in range(k):
+            i = rnd.randrange(n - 60)
+            size = rnd.randint(5, 60)
+            pos = offsets[i]
+            planted.append((pos, offsets[i + size] - 1 - pos))
+            j = rnd.randrange(len(b))
+            b[j:j] = a[i:i + size]
+        return (' '.join(a), ' '.join(b), planted)
+
+    # returns the tuple (share of the planted characters that is matched, number of
+    # other characters matched, seconds) for the matcher
+    def match_quality(self, matcher, text_a, text_b, planted):
+        with self.settings(PLAG_SCAN_MATCHER=matcher):
+            t0 = perf_counter()
+            blocks = matching_blocks(text_a, text_b, MATCH_THRESHOLD)
+            t = perf_counter() - t0
+        expected = set()
+        for p, n in planted:
+            if n >= MATCH_THRESHOLD:
+                expected |= set(range(p, p + n))
+        found = set()
+        for p, n in blocks:
+            found |= set(range(p, p + n))
+        return (len(found & expected) / len(expected), len(found - expected), t)
+
+    def test_quality(self):
+        # greedy string tiling finds (nearly) all planted text, also when it has been
+        # moved around, whereas the junk heuristics of SequenceMatcher make it miss text
+        rnd = random.Random(43)
+        for n, k in [(300, 3), (2000, 10)]:
+            text_a, text_b, planted = self.planted_texts(rnd, n, k)
+            recall, other, t = self.match_quality('gst', text_a, text_b, planted)
+            self.assertGreater(recall, 0.99)
+            self.assertEqual(other, 0)
+            self.assertLess(self.match_quality('sequence', text_a, text_b, planted)[0], recall)
+
+    @benchmark
+    def test_speed(self):
+        rnd = random.Random(43)
+        for n, k in [(1000, 5), (5000, 20), (20000, 50)]:
+            text_a, text_b, planted = self.planted_texts(rnd, n, k)
+            for matcher in ['gst', 'sequence']:
+                recall, other, t = self.match_quality(matcher, text_a, text_b, planted)
+                print('\n{:>6} words, {}: {:.0%} of planted text found in {:.3f} s'.format(
+                    n, matcher, recall, t), end='')
+        print()
+
+
+# writes a DOCX file containing the words in list words as paragraphs of n words to path
+# NOTE: files written by python-docx have the same creation time unless it is specified
+class TextFingerprintTest(PrestoTestCase):
+
+    TEXT = ('The relay method lets each participant build on the work of a peer, '
+        'and review that work before improving it in the next step of the relay.')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.relay, cls.parts = build_relay(nlegs=3, nparts=6)
+
+    def test_plain_text(self):
+        self.assertEqual(plain_text('<ul><li>One</li><li>two&nbsp;&amp; three</li></ul>'),
+            'One two & three')
+
+    def test_fingerprints(self):
+        rnd = random.Random(44)
+        vocabulary = ['w{}'.format(i) for i in range(200)]
+        # texts sharing a sequence of SHINGLE_WORDS + WINNOW_WINDOW - 1 words share
+        # a fingerprint
+        n = plag_scan.SHINGLE_WORDS + plag_scan.WINNOW_WINDOW - 1
+        for i in range(200):
+            shared = rnd.choices(vocabulary, k=n)
+            texts = [' '.join(rnd.choices(vocabulary, k=rnd.randint(0, 30)) + shared
+                + rnd.choices(vocabulary, k=rnd.randint(0, 30))) for j in range(2)]
+            self.assertTrue(text_fingerprints(texts[0]) & text_fingerprints(texts[1]))
+        self.assertEqual(text_fingerprints('too short'), set())
+        self.assertEqual(text_fingerprints(self.TEXT), text_fingerprints(self.TEXT.upper()))
+
+    # returns the item assignment of the first step of participant p
+    def item_assignment(self, p):
+        return ItemAssignment.objects.get(assignment__participant=p, assignment__leg__number=1)
+
+    def test_index(self):
+        ias = [self.item_assignment(p) for p in self.parts[:3]]
+        for ia, c in zip(ias, ['<p>' + self.TEXT + '</p>', 'Not the same at all', '']):
+            ia.comment = c
+            ia.save()
+            fingerprint_text(ia)
+        eid = self.relay.id
+        self.assertEqual(texts_sharing_fingerprints(eid, self.TEXT), [(ias[0].id, None)])
+        # fingerprints are replaced when the text is saved again
+        ias[0].comment = ''
+        ias[0].save()
+        fingerprint_text(ias[0])
+        self.assertEqual(texts_sharing_fingerprints(eid, self.TEXT), [])
+        pr = PeerReview.objects.filter(reviewer__estafette=self.relay).first()
+        pr.grade_motivation = 'I think that ' + self.TEXT
+        pr.save()
+        fingerprint_text(pr)
+        self.assertEqual(texts_sharing_fingerprints(eid, self.TEXT), [(None, pr.id)])
+        self.assertEqual(texts_sharing_fingerprints(eid + 1, self.TEXT), [])
+
+    def test_scan_texts(self):
+        ias = [self.item_assignment(p) for p in self.parts[:2]]
+        for ia in ias:
+            ia.comment = self.TEXT
+            ia.save()
+            fingerprint_text(ia)
+        a = ias[0].assignment
+        max_perc, min_perc, reports = scan_texts(a, [])
+        self.assertEqual((max_perc, min_perc), (100, 0))
+        self.assertEqual(len(reports), 1)
+        self.assertIn('comment on item `u1` of #{}'.format(ias[1].assignment_id), reports[0])
+        # matches with related work are reported as such
+        max_perc, min_perc, reports = scan_texts(a, [ias[1].assignment_id])
+        self.assertEqual((max_perc, min_perc), (0, -100))
+        self.assertIn('RELATED', reports[0])
+
+
+class TellTaleTest(PrestoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = temp_dir(self, 'MEDIA_ROOT')
+        relay, parts = build_relay(nlegs=2, nparts=4, final_reviews=0)
+        # the first steps of different participants are unrelated
+        # NOTE: the first of these has a successor
+        self.a_list = sorted(Assignment.objects.filter(participant__estafette=relay,
+            leg__number=1).order_by('id'), key=lambda a: a.successor_id is None)
+        self.images = []
+        for color in ['red', 'blue', 'green']:
+            buf = BytesIO()
+            Image.new('RGB', (32, 32), color).save(buf, 'PNG')
+            self.images.append(buf.getvalue())
+
+    # uploads a document with the given images and creation time for assignment a,
+    # and returns the tell-tales that have been recorded
+    def upload(self, a, images, created):
+        doc = Document()
+        doc.core_properties.created = created
+        doc.add_paragraph('Text of assignment #{}'.format(a.id))
+        for img in images:
+            doc.add_picture(BytesIO(img), width=Inches(1))
+        buf = BytesIO()
+        doc.save(buf)
+        pu = ParticipantUpload.objects.create(assignment=a, file_name='report',
+            upload_file=ContentFile(buf.getvalue(), name='report.docx'))
+        Assignment.objects.filter(pk=a.pk).update(time_uploaded=pu.time_uploaded)
+        record_telltales(pu)
+        return sorted(TellTale.objects.filter(upload=pu).values_list('kind', 'value'))
+
+    def report(self, **options):
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('telltale_report', **options)
+        return out.getvalue()
+
+    def test_record(self):
+        tt = self.upload(self.a_list[0], self.images[:2], datetime(2022, 3, 4, 5, 6, 7))
+        self.assertEqual([k for k, v in tt], ['created', 'image', 'image'])
+        self.assertEqual(tt[0][1], '2022-03-04T05:06')
+        self.assertTrue(tt[1][1].startswith('.png='))
+        # the tell-tales are also appended to the text of the document
+        text = doc_text(ParticipantUpload.objects.get(assignment=self.a_list[0]).upload_file.path)
+        self.assertEqual(sorted(text.split(TELLTALE_SEPARATOR)[1].split('\n')[1:]),
+            [v for k, v in tt[1:]] + ['created=2022-03-04T05:06'])
+
+    def test_report(self):
+        t = datetime(2022, 3, 4, 5, 6, 7)
+        a = self.a_list
+        image = self.upload(a[0], self.images[:1], t)[1][1]
+        self.upload(a[1], self.images[:1], t + timedelta(days=1))
+        self.upload(a[2], [], t)
+        self.upload(a[3], self.images[1:], t + timedelta(days=2))
+        out = self.report()
+        self.assertIn('image {} shared by 2 participants'.format(image), out)
+        self.assertIn('created 2022-03-04T05:06 shared by 2 participants', out)
+        self.assertEqual(out.count('shared by'), 2)
+        self.assertNotIn('created', self.report(kind='image'))
+        self.assertIn('No shared tell-tales', self.report(max_participants=1))
+        self.assertIn('No shared tell-tales', self.report(relay=a[0].participant.estafette_id + 1))
+        # tell-tales shared with related work (here: the work the first upload builds on)
+        # are listed only when asked for
+        TellTale.objects.all().delete()
+        self.upload(a[0].successor, self.images[2:], t + timedelta(days=3))
+        self.upload(a[0], self.images[2:], t + timedelta(days=4))
+        self.assertIn('0 shared tell-tales', self.report())
+        self.assertIn('RELATED', self.report(all=True))
+
+
+def write_docx(path, words, n=40, created=None):
+    doc = Document()
+    doc.core_properties.created = created or datetime.now()
+    for i in range(0, len(words), n):
+        doc.add_paragraph(' '.join(words[i:i + n]))
+    doc.save(path)
+
+
+# runs the tasks of a "process pool" one by one in the calling process, so that they
+# see the test database
+class InlineExecutor:
+
+    def __init__(self, workers=None, initializer=None, initargs=()):
+        if initializer:
+            initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def map(self, f, iterable, chunksize=1):
+        return list(map(f, iterable))
+
+    def submit(self, f, *args):
+        future = Future()
+        try:
+            future.set_result(f(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class ScanRelayTest(PrestoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = temp_dir(self, 'MEDIA_ROOT', 'LOG_DIR')
+        self.relay, parts = build_relay(nlegs=3, nparts=8, final_reviews=0, seed=46)
+        EstafetteLeg.objects.update(required_files='Report:report.docx')
+        # upload reports that copy some text of an earlier report of the same case
+        rnd = random.Random(46)
+        vocabulary = ['w{}{}'.format(i, 'x' * rnd.randint(0, 6)) for i in range(5000)]
+        docs = []
+        for a in Assignment.objects.filter(time_uploaded__gt=DEFAULT_DATE
+                ).order_by('time_uploaded'):
+            words = rnd.choices(vocabulary, k=600)
+            same = [w for c, w in docs if c == a.case_id]
+            if same:
+                words[100:100] = rnd.choice(same)[200:300]
+            docs.append((a.case_id, words))
+            path = os.path.join(self.dir, 'report.docx')
+            write_docx(path, words, 60, datetime(2020, 1, 1) + timedelta(minutes=len(docs)))
+            with open(path, 'rb') as f:
+                ParticipantUpload.objects.create(assignment=a, file_name='report',
+                    upload_file=ContentFile(f.read(), name='report{}.docx'.format(a.id)))
+        self.paths = [upload_path(pu.upload_file.name)
+            for pu in ParticipantUpload.objects.all()]
+        # NOTE: the corpus is opened by the scanning processes only
+        corpus = mock.patch.object(plag_scan, 'CORPUS', None)
+        corpus.start()
+        self.addCleanup(corpus.stop)
+
+    def scan_relay(self, *args):
+        out = StringIO()
+        with redirect_stdout(out), \
+                mock.patch.object(scan_relay, 'process_pool', InlineExecutor):
+            call_command('scan_relay', str(self.relay.id), *args)
+        return out.getvalue()
+
+    def scan_results(self):
+        return dict(Assignment.objects.filter(time_scanned__gt=DEFAULT_DATE
+            ).values_list('id', 'scan_result'))
+
+    def test_corpus(self):
+        texts = [(p, plag_scan.ascii_from_doc(p)) for p in self.paths]
+        corpus_path = os.path.join(self.dir, 'corpus.txt')
+        index = write_corpus(corpus_path, texts)
+        open_corpus(corpus_path, index)
+        # texts are no longer extracted from the files
+        with mock.patch.object(plag_scan, 'ascii_from_doc', None):
+            for p, text in texts:
+                self.assertEqual(doc_text(p), text)
+            self.assertEqual(doc_text(texts[0][0], [texts[0][1][:20]]), texts[0][1][20:])
+
+    def test_dry_run(self):
+        n = Assignment.objects.filter(time_uploaded__gt=DEFAULT_DATE).count()
+        out = self.scan_relay('--dry-run')
+        self.assertIn('{} assignments to scan; {} files to extract'.format(n, n), out)
+        self.assertRegex(out, r'\n[1-9][0-9]* comparisons\n')
+        self.assertIn('Estimated time with', out)
+        self.assertEqual(self.scan_results(), {})
+        out = self.scan_relay('--since', '2100-01-01')
+        self.assertIn('0 assignments to scan', out)
+
+    def test_scan(self):
+        n = Assignment.objects.filter(time_uploaded__gt=DEFAULT_DATE).count()
+        extracted = []
+        ascii_from_doc = plag_scan.ascii_from_doc
+
+        def counted_ascii_from_doc(path, *args):
+            extracted.append(path)
+            return ascii_from_doc(path, *args)
+
+        with mock.patch.object(plag_scan, 'ascii_from_doc', counted_ascii_from_doc), \
+                mock.patch.object(scan_relay, 'ascii_from_doc', counted_ascii_from_doc):
+            out = self.scan_relay('--workers', '2')
+        self.assertIn('{} assignments scanned with 2 workers; 0 errors'.format(n), out)
+        # each file has been extracted only once
+        self.assertEqual(sorted(extracted), sorted(self.paths))
+        results = self.scan_results()
+        self.assertEqual(len(results), n)
+        self.assertTrue([p for p in results.values() if p > 0])
+        # the results are those of scanning the assignments one by one
+        Assignment.objects.update(time_scanned=DEFAULT_DATE, scan_result=0)
+        plag_scan.CORPUS = None
+        for a in Assignment.objects.filter(time_uploaded__gt=DEFAULT_DATE
+                ).order_by('time_uploaded'):
+            plag_scan.scan_assignment(a.id, None)
+        self.assertEqual(self.scan_results(), results)
+        self.assertIn('0 assignments to scan', self.scan_relay())
+
+
+class BoilerplateTest(PrestoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # NOTE: the scanner logs suspect matches
+        self.dir = temp_dir(self, 'LOG_DIR')
+        rnd = random.Random(47)
+        self.vocabulary = ['w{}{}'.format(i, 'x' * rnd.randint(0, 6)) for i in range(5000)]
+        self.rnd = rnd
+        relay, parts = build_relay(nlegs=2, nparts=2, final_reviews=0)
+        self.a = Assignment.objects.filter(participant__estafette=relay).first()
+        # the case text that all participants are given
+        self.case_words = self.words(400)
+        self.a.case.description = '<p>{}</p><ul><li>{}</li></ul>'.format(
+            ' '.join(self.case_words[:200]), ' '.join(self.case_words[200:]))
+        self.a.case.save()
+
+    def words(self, n):
+        return self.rnd.choices(self.vocabulary, k=n)
+
+    # returns the percentage of text matched by scanning the file with words1 against
+    # the file with words2
+    def match(self, words1, words2, boilerplate):
+        path1 = os.path.join(self.dir, 'one.docx')
+        path2 = os.path.join(self.dir, 'two.docx')
+        # NOTE: line breaks differ from those of the case text
+        write_docx(path1, words1, 45, datetime(2026, 1, 1))
+        write_docx(path2, words2, 35, datetime(2026, 1, 2))
+        text = without_boilerplate(doc_text(path1), boilerplate)
+        return scan_report(text, 'report', path2, 0, 'Author', '', False, 20,
+            boilerplate=boilerplate)[0]
+
+    def test_boilerplate_only(self):
+        bp = boilerplate_shingles(self.a)
+        self.assertTrue(bp)
+        # both files contain (much of) the case text, but otherwise differ
+        words1 = self.case_words[10:310] + self.words(1000)
+        words2 = self.words(700) + self.case_words[40:360] + self.words(500)
+        self.assertGreater(self.match(words1, words2, set()), 0)
+        self.assertEqual(self.match(words1, words2, bp), 0)
+
+    def test_copied_text(self):
+        # text copied from the other file is still detected
+        own = self.words(1000)
+        words1 = self.case_words[10:310] + own[:500] + self.words(500)
+        words2 = self.words(300) + own[:500] + self.case_words + self.words(300)
+        self.assertGreater(self.match(words1, words2, boilerplate_shingles(self.a)), 0)
+
+    def test_rebuild(self):
+        before = case_shingles(self.a.case)
+        self.a.case.description = '<p>{}</p>'.format(' '.join(self.words(100)))
+        self.a.case.save()
+        after = case_shingles(self.a.case)
+        self.assertNotEqual(before, after)
+        self.assertTrue(after)
+
+
+# writes a workbook with a sheet of rows x cols numbers (starting at first) and a column
+# of formulas adding up each row to path
+def write_xlsx(path, rows, cols, first=0):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Name'] + ['C{}'.format(c) for c in range(cols)] + ['Total'])
+    for r in range(rows):
+        ws.append(['R{}'.format(r)] + [first + r * cols + c for c in range(cols)]
+            + ['=SUM(B{0}:{1}{0})'.format(r + 2, chr(65 + cols))])
+    wb.save(path)
+
+
+class SpreadsheetTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = temp_dir(self)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_relative_formula(self):
+        self.assertEqual(relative_formula('=SUM(A1:B2)', 3, 3), '=SUM(C[-2]R[-2]:C[-1]R[-1])')
+        # absolute references are kept, and function names are not cell references
+        self.assertEqual(relative_formula('=$A$1 * log10(b7)', 2, 2), '=C1R1*LOG10(C[0]R[5])')
+        self.assertEqual(relative_formula('=A$1+$B2', 3, 3), '=C[-2]R1+C2R[-1]')
+        # formulas copied to other cells are alike
+        self.assertEqual(relative_formula('=A1+B1', 1, 3), relative_formula('=A2+B2', 2, 3))
+        self.assertNotEqual(relative_formula('=A1+B1', 1, 3), relative_formula('=A1+B2', 2, 3))
+
+    def test_content(self):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['Name', 2.5, datetime(2026, 1, 2, 3, 4), '=B1*2', None, 1 / 3])
+        wb.create_sheet('Other').append(['More  text', 7])
+        wb.save(self.path('small.xlsx'))
+        text, layout = spreadsheet_content(self.path('small.xlsx'))
+        self.assertEqual(text, 'Name 2.5 2026-01-02T03:04:00 =B1*2 0.3333333333 More text 7')
+        # small workbooks have no structural fingerprint
+        self.assertEqual(layout, [])
+
+    def test_layout(self):
+        write_xlsx(self.path('a.xlsx'), 20, 4)
+        write_xlsx(self.path('b.xlsx'), 20, 4, first=1000)
+        write_xlsx(self.path('c.xlsx'), 20, 5)
+        layout = spreadsheet_content(self.path('a.xlsx'))[1]
+        self.assertEqual([k for k, v in layout], ['layout', 'formulas'])
+        # workbooks having the same structure but other values have the same fingerprint
+        self.assertEqual(spreadsheet_content(self.path('b.xlsx'))[1], layout)
+        self.assertNotEqual(spreadsheet_content(self.path('c.xlsx'))[1], layout)
+        # the fingerprint is appended to the text as tell-tales
+        text = plag_scan.ascii_from_doc(self.path('a.xlsx'))
+        self.assertTrue(text.startswith('Name C0 C1 C2 C3 Total R0 0 1 2 3 =SUM(B2:E2) R1 4'))
+        self.assertIn(TELLTALE_SEPARATOR + '\nlayout={}\nformulas={}'.format(
+            layout[0][1], layout[1][1]), text)
+
+    def test_cell_cap(self):
+        write_xlsx(self.path('a.xlsx'), 100, 4)
+        logged = []
+        with mock.patch.object(plag_scan, 'MAX_SHEET_CELLS', 100), \
+                mock.patch.object(plag_scan, 'log_message', lambda m, *a: logged.append(m)):
+            text = spreadsheet_content(self.path('a.xlsx'))[0]
+        # the cap applies to whole rows
+        self.assertEqual(len(text.split()), 102)
+        self.assertTrue(logged[0].startswith('WARNING: Only first 102 cells'))
+
+    def test_presentation(self):
+        prs = Presentation()
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.text = 'Title  of slide'
+        rows = slide.shapes.add_table(2, 2, Inches(1), Inches(2), Inches(4), Inches(1)).table
+        rows.cell(0, 0).text = 'In'
+        rows.cell(1, 1).text = 'table'
+        slide.notes_slide.notes_text_frame.text = 'Speaker notes'
+        prs.save(self.path('a.pptx'))
+        self.assertEqual(presentation_text(self.path('a.pptx')),
+            'Title of slide In table Speaker notes')
+
+    @benchmark
+    def test_large_workbook(self):
+        write_xlsx(self.path('large.xlsx'), 10000, 3)
+        t0 = perf_counter()
+        text, layout = spreadsheet_content(self.path('large.xlsx'))
+        t = perf_counter() - t0
+        self.assertEqual(len(text.split()), 5 + 10000 * 5)
+        self.assertEqual(len(layout), 2)
+        print('\nWorkbook of 50k cells read in {:.2f} s'.format(t))
+
+
+class ScanCheckpointTest(PrestoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = temp_dir(self, 'MEDIA_ROOT', 'LOG_DIR')
+        relay, parts = build_relay(nlegs=3, nparts=16, final_reviews=0, seed=49)
+        EstafetteLeg.objects.update(required_files='Report:report.docx')
+        # upload reports that copy some text of two earlier reports of the same case
+        rnd = random.Random(49)
+        vocabulary = ['w{}{}'.format(i, 'x' * rnd.randint(0, 6)) for i in range(5000)]
+        docs = []
+        for a in Assignment.objects.filter(time_uploaded__gt=DEFAULT_DATE
+                ).order_by('time_uploaded'):
+            words = rnd.choices(vocabulary, k=1500)
+            same = [w for c, w in docs if c == a.case_id]
+            for copied in rnd.sample(same, min(2, len(same))):
+                i = rnd.randint(0, 1000)
+                words[100:100] = copied[i:i + 120]
+            docs.append((a.case_id, words))
+            path = os.path.join(self.dir, 'report.docx')
+            write_docx(path, words, 60, datetime(2020, 1, 1) + timedelta(minutes=len(docs)))
+            with open(path, 'rb') as f:
+                ParticipantUpload.objects.create(assignment=a, file_name='report',
+                    upload_file=ContentFile(f.read(), name='report{}.docx'.format(a.id)))
+        # scan the step 3 assignment having the most files to compare with
+        self.a = max(
+            Assignment.objects.filter(time_uploaded__gt=DEFAULT_DATE, leg__number=3),
+            key=lambda a: Assignment.objects.filter(case=a.case,
+                time_uploaded__lt=a.time_uploaded).count()
+            )
+        self.percentage = plag_scan.scan_assignment(self.a.id, None)[0]
+        self.assertGreater(self.percentage, 0)
+        self.report = self.report_text()
+        Assignment.objects.update(time_scanned=DEFAULT_DATE, scan_result=0)
+        ScanReport.objects.all().delete()
+
+    # returns the scan report without the parts that differ per scan
+    def report_text(self):
+        return re.sub(r'_Scanned on .*_|took [0-9.]+ seconds', '',
+            ScanReport.objects.get(assignment=self.a).text())
+
+    def test_resume_after_lease_expiry(self):
+        scan_report = plag_scan.scan_report
+        calls = [0]
+
+        # lets the scanner "crash" after comparing four files
+        def crashing_scan_report(*args, **kwargs):
+            calls[0] += 1
+            if calls[0] > 4:
+                raise SystemExit
+            return scan_report(*args, **kwargs)
+
+        with mock.patch.object(plag_scan, 'HEARTBEAT_SECONDS', 0), \
+                mock.patch.object(plag_scan, 'scan_owner', lambda: 'crashed:1@host'), \
+                mock.patch.object(plag_scan, 'scan_report', crashing_scan_report):
+            with self.assertRaises(SystemExit):
+                plag_scan.scan_assignment(self.a.id, None)
+        cp = ScanCheckpoint.objects.get(assignment=self.a)
+        self.assertEqual(cp.owner, 'crashed:1@host')
+        self.assertEqual(len(loads(cp.state)['spuids']), 4)
+        # while the lease holds, the scan is left to the crashed scanner
+        self.assertIn('Scan in progress', plag_scan.scan_assignment(self.a.id, None)[1])
+        # when the lease has expired, the scan is resumed by another scanner
+        ScanCheckpoint.objects.filter(pk=cp.pk).update(
+            lease_expires=timezone.now() - timedelta(seconds=1))
+        logged = []
+        with mock.patch.object(plag_scan, 'log_message', lambda m, *a: logged.append(m)):
+            p = plag_scan.scan_assignment(self.a.id, None)[0]
+        self.assertTrue([m for m in logged if m.startswith('Resuming scan')])
+        self.assertEqual(p, self.percentage)
+        self.assertEqual(self.report_text(), self.report)
+        self.assertFalse(ScanCheckpoint.objects.filter(assignment=self.a).exists())
+
+
+class BlacklistTest(SimpleTestCase):
+
+    # review texts and the Dutch blacklist entries found in them
+    CORPUS = [
+        ('Het verslag is goed onderbouwd, en de analyse is helder.', []),
+        ('Wat een fokken gedoe! Dit is echt klote werk.', [' fok', 'fokken', 'klote']),
+        ('De auteur is dom en stom.', [' dom ', 'stom']),
+        ('De dominante factor is de domme aanname.', ['domm']),
+        ('Slap verhaal, <b>onzin</b>.', [' onzin ', 'slap']),
+        ('De toon is kinderachtig en een beetje zielig.', ['kinderachtig', 'zielig']),
+        ('Een goed gestructureerd betoog; de bronnen zijn zorgvuldig gekozen.', []),
+        # NOTE: punctuation is removed before matching
+        ('Wat een shit, sh1t en sh!t.', ['shit', 'sh1t'])
+        ]
+
+    # returns the entries found by searching for each entry separately
+    def searched_words(self, text, lang_code):
+        p_dict = blacklist.BLACKLIST_RE[lang_code][2]
+        return [e for e in p_dict if p_dict[e].search(text)]
+
+    def test_corpus(self):
+        for text, words in self.CORPUS:
+            self.assertEqual(blacklisted_words(normalized_text(text), 'nl-NL'), words)
+        self.assertEqual(blacklisted_words('what a load of crap', 'en-US'), [])
+
+    def test_prefix_entries(self):
+        entries = ['fokken', ' fok', 'fokking', 'fok ', 'ken']
+        bl = {'xx': compile_blacklist(entries)}
+        with mock.patch.object(blacklist, 'BLACKLIST_RE', bl):
+            # all entries that match at the same position are found, in blacklist order
+            self.assertEqual(blacklisted_words('wat een fokken gedoe', 'xx'),
+                ['fokken', ' fok', 'ken'])
+            self.assertEqual(blacklisted_words('fok', 'xx'), [' fok', 'fok '])
+            self.assertEqual(blacklisted_words('afokje', 'xx'), [])
+
+    def test_shorter_entry_first(self):
+        # a shorter entry that matches first does not hide a longer one
+        bl = {'xx': compile_blacklist(['fo', ' fokken'])}
+        with mock.patch.object(blacklist, 'BLACKLIST_RE', bl):
+            self.assertEqual(blacklisted_words('wat een fokken gedoe', 'xx'),
+                ['fo', ' fokken'])
+
+    def test_random_texts(self):
+        rnd = random.Random(28)
+        words = [e.strip() for e in blacklist.BLACKLIST_RE['nl-NL'][2]]
+        words += ['de', 'het', 'goed', 'verslag', 'analyse']
+        for i in range(1000):
+            text = ' '.join(rnd.choice(words) + ''.join(rnd.choices('aeknost 1', k=2))
+                for j in range(rnd.randint(1, 30)))
+            self.assertEqual(blacklisted_words(text, 'nl-NL'),
+                self.searched_words(text, 'nl-NL'))
+
+    @benchmark
+    def test_throughput(self):
+        rnd = random.Random(28)
+        words = [e.strip() for e in blacklist.BLACKLIST_RE['nl-NL'][2]]
+        vocabulary = ['woord{}'.format(i) for i in range(2000)]
+        texts = [' '.join(rnd.choice(words) if rnd.random() < 0.01 else rnd.choice(vocabulary)
+            for j in range(300)) for i in range(2000)]
+        t0 = perf_counter()
+        found = [blacklisted_words(t, 'nl-NL') for t in texts]
+        t1 = perf_counter()
+        searched = [self.searched_words(t, 'nl-NL') for t in texts]
+        t2 = perf_counter()
+        self.assertEqual(found, searched)
+        print('\nBlacklist: {:.0f} reviews/s in a single pass, {:.0f} reviews/s per entry'
+            .format(len(texts) / (t1 - t0), len(texts) / (t2 - t1)))
+
+
+class ArchiveTest(PrestoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = temp_dir(self, 'MEDIA_ROOT', 'LOG_DIR')
+        self.rnd = random.Random(50)
+        self.vocabulary = ['w{}{}'.format(i, 'x' * self.rnd.randint(0, 6)) for i in range(5000)]
+        # reports uploaded in an earlier relay (a year ago)
+        self.old_relay, parts = build_relay(nlegs=2, nparts=6, final_reviews=0, seed=50)
+        EstafetteLeg.objects.update(required_files='Report:report.docx')
+        self.old_words = {}
+        for a in Assignment.objects.filter(time_uploaded__gt=DEFAULT_DATE):
+            self.old_words[a.id] = self.words(600)
+            pu = self.upload(a, self.old_words[a.id])
+            ParticipantUpload.objects.filter(pk=pu.pk).update(
+                time_uploaded=a.time_uploaded - timedelta(days=365))
+        # the same relay, run again this year
+        r = self.old_relay
+        self.relay = CourseEstafette.objects.create(course=r.course, estafette=r.estafette,
+            suffix='2', start_time=r.start_time, deadline=r.deadline,
+            review_deadline=r.review_deadline, end_time=r.end_time)
+
+    def words(self, n):
+        return self.rnd.choices(self.vocabulary, k=n)
+
+    # uploads a report with the given words for assignment a
+    def upload(self, a, words):
+        path = os.path.join(self.dir, 'report.docx')
+        write_docx(path, words, 60, datetime(2020, 1, 1) + timedelta(minutes=a.id))
+        with open(path, 'rb') as f:
+            return ParticipantUpload.objects.create(assignment=a, file_name='report',
+                upload_file=ContentFile(f.read(), name='report{}.docx'.format(a.id)))
+
+    # returns a new assignment of step 1 in this year's relay, uploaded with the given words
+    # by course student cs
+    def new_assignment(self, cs, words):
+        p = Participant.objects.create(student=cs, estafette=self.relay)
+        a = Assignment.objects.create(participant=p, case=EstafetteCase.objects.first(),
+            leg=EstafetteLeg.objects.get(number=1), time_uploaded=timezone.now())
+        self.upload(a, words)
+        return a
+
+    def test_archive_fingerprints(self):
+        n = ParticipantUpload.objects.count()
+        out = StringIO()
+        with redirect_stdout(out):
+            call_command('archive_fingerprints', relay=self.old_relay.id)
+        self.assertIn('{}  files archived'.format(n), out.getvalue())
+        self.assertEqual(UploadFingerprint.objects.values('upload').distinct().count(), n)
+        # archiving again replaces the fingerprints
+        m = UploadFingerprint.objects.count()
+        with redirect_stdout(out):
+            call_command('archive_fingerprints')
+        self.assertEqual(UploadFingerprint.objects.count(), m)
+        self.assertFalse(UploadFingerprint.objects.filter(estafette=self.relay).exists())
+
+    def test_scan(self):
+        with redirect_stdout(StringIO()):
+            call_command('archive_fingerprints')
+        old = Assignment.objects.filter(time_uploaded__gt=DEFAULT_DATE).first()
+        old_words = self.old_words[old.id]
+        copied = self.words(500)
+        copied[200:200] = old_words[100:250]
+        students = []
+        for i in range(3):
+            u = User.objects.create(username='n{}'.format(i))
+            students.append(CourseStudent.objects.create(user=u, course=self.relay.course))
+        a_list = [
+            self.new_assignment(students[0], self.words(600)),
+            self.new_assignment(students[1], copied),
+            # a student who takes the course again reuses own work
+            self.new_assignment(old.participant.student, old_words[300:] + self.words(300))
+            ]
+        compared = []
+        scan_report = plag_scan.scan_report
+
+        def counted_scan_report(text, req_file, path, aid, *args):
+            compared.append(aid)
+            return scan_report(text, req_file, path, aid, *args)
+
+        with mock.patch.object(plag_scan, 'scan_report', counted_scan_report):
+            results = [plag_scan.scan_assignment(a.id, None)[0] for a in a_list]
+        self.assertEqual(results[0], 0)
+        self.assertGreater(results[1], 10)
+        # NOTE: only a very large match with related work counts
+        self.assertEqual(results[2], 0)
+        report = ScanReport.objects.get(assignment=a_list[1]).text()
+        self.assertIn(self.old_relay.title_text(), report)
+        self.assertIn('RELATED', ScanReport.objects.get(assignment=a_list[2]).text())
+        # only the archived files that share fingerprints are compared in full
+        self.assertEqual([aid for aid in compared if aid in self.old_words], [old.id, old.id])
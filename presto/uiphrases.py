@@ -1451,3 +1451,20 @@ UI_BLACKDICT = {
             ' ziek', 'zielig', 'zijk '
     ]
 }
+
+# Frequent function words per language: when a text contains a large enough
+# share of these, its language is evident and need not be detected.
+UI_STOPWORDS = {
+    'en-US': [
+        'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from',
+        'has', 'have', 'he', 'i', 'in', 'is', 'it', 'not', 'of', 'on', 'or',
+        'she', 'that', 'the', 'their', 'there', 'they', 'this', 'to', 'was',
+        'were', 'which', 'will', 'with', 'would', 'you', 'your'
+    ],
+    'nl-NL': [
+        'aan', 'als', 'bij', 'dan', 'dat', 'de', 'deze', 'die', 'dit', 'een',
+        'en', 'er', 'het', 'hij', 'ik', 'is', 'je', 'jij', 'maar', 'met',
+        'niet', 'nog', 'of', 'om', 'ook', 'op', 'te', 'uit', 'van', 'voor',
+        'was', 'wat', 'wel', 'zijn', 'zij', 'ze', 'zo'
+    ]
+}
@@ -27,13 +27,18 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from django.conf import settings
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import io
 import os
 import re
+from shutil import which
 import subprocess
+from threading import Lock
 
 from datetime import date, datetime, time, timedelta
-from hashlib import md5
+from hashlib import md5, sha256
 from math import fabs, modf
 from random import randrange
 from string import hexdigits
@@ -128,59 +133,91 @@ def random_hex(n=16):
     return format(randrange(0, 1 << (n*4)), 'x').zfill(n)
 
 
-# encodes a 64-bit integer n as a 32 hex digit string using a 32 hex digit key k as mask
-# NOTE: if deterministic=True, the encoding should not include random elements
-def encode(n, k, deterministic=False):
-    # first convert integer to 16-digit hexadecimal string
-    s = format(n, 'x').zfill(16)
-    # then to a 16-entry 0-based array of integer (0-15)
-    hx = []
-    for c in s:
-        hx.append(int(c, 16))
-    # also convert the 32-digit session key to a 0-based array of integer (0-15)
-    key = []
-    for c in k:
-        key.append(int(c, 16))
-    # hx and key now both hold nibbles as integer values
-    # code will hold 32 encoded digits in pseudo-random order
-    code = {}
-    # p serves as starting point for pseudo-random sequences (CANNOT BE ZERO!)
-    if deterministic:
-        p = 15
-    else:
-        p = randrange(1, 16)
-    # this seed will be the first digit of the encoded number
-    code[0] = format(p, 'x')
-    # start the random walk
-    q = p
-    for i in range (1, 17):
-        p = (p * 199) % 31
-        q = (q * 197) % 17
-        code[p] = format(hx[q - 1] ^ key[p], 'x')  # xor with mask
-    for i in range(17, 31):
+# hexadecimal digits and their values
+HEX_DIGITS = '0123456789abcdef'
+HEX_VALUES = {c: int(c, 16) for c in hexdigits}
+# number of set bits (1's) for each nibble value
+# NOTE: the count for 14 is (and has always been) 2; as codes depend on it, it must stay so
+BIT_COUNTS = [0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 2, 4]
+
+
+# returns list of 30 tuples (code position p, number position q, filler value) for the
+# pseudo-random walk through a code that starts with seed digit s
+# NOTE: q is None for filler digits (having a fixed value only for deterministic encodings)
+def nibble_walk(s):
+    walk = []
+    p = s
+    q = s
+    for i in range(1, 31):
         p = (p * 199) % 31
         q = (q * 197) % 17
         r, odd = divmod(i, 2)
-        if odd:
-            # odd digits are "fillers"
-            if deterministic:
-                code[p] = format(r & 15 ^ 11, 'x')
-            else:
-                # random value (to add noise to the code)
-                code[p] = format(randrange(0, 15), 'x')
+        if i > 16 and odd:
+            walk.append((p, None, r & 15 ^ 11))
+        else:
+            walk.append((p, q, 0))
+    return walk
+
+
+# the walks for all seeds (NOTE: seed 0 occurs only in invalid codes)
+NIBBLE_WALKS = [nibble_walk(s) for s in range(16)]
+
+
+# returns tuple (number digits, fillers) for codes with seed s and key k, where number digits
+# is a list of tuples (code position, number position, key nibble) in the order of the walk
+# (the first 16 encode the number, the other 7 are used for validation), and fillers is
+# a list of tuples (code position, deterministic value)
+# NOTE: as session keys are used for a series of encodings, these tables are cached
+@lru_cache(maxsize=2048)
+def key_table(k, s):
+    digits = []
+    fillers = []
+    for p, q, v in NIBBLE_WALKS[s]:
+        if q is None:
+            fillers.append((p, v))
         else:
-            # 7 even digits of the code are duplicate hx values that will be used for validation
-            code[p] = format(hx[q - 1] ^ key[p], 'x')
-    # count the number of set bits (1's) in the first 31 hex digits
-    sb = {'0': 0, '1': 1, '2': 1, '3': 2, '4': 1, '5': 2, '6': 2, '7': 3,
-          '8': 1, '9': 2, 'a': 2, 'b': 3, 'c': 2, 'd': 3, 'e': 2, 'f': 4}
-    b = 0
-    for c in code.values():
-        b += sb[c]
-    # store this count (modulo 16) as the last hex digit to allow data integrity checking
-    code[31] = format(b % 16, 'x')
-    # string the digits together in the order of their dictionary index
-    return ''.join(code[c] for c in sorted(code))
+            digits.append((p, q, int(k[p], 16)))
+    return (digits, fillers)
+
+
+# returns the 32 hex digit code for the hex digits of a number, using key table t
+def encoded_hex(hx, s, t, deterministic):
+    digits, fillers = t
+    code = [0] * 32
+    # the seed is the first digit of the code
+    code[0] = s
+    for p, q, m in digits:
+        code[p] = HEX_VALUES[hx[q - 1]] ^ m  # xor with mask
+    for p, v in fillers:
+        # filler digits have a random value (to add noise to the code)
+        code[p] = v if deterministic else randrange(0, 15)
+    # store the number of set bits (modulo 16) in the first 31 hex digits as the last
+    # hex digit to allow data integrity checking
+    code[31] = sum(BIT_COUNTS[c] for c in code) % 16
+    return ''.join(HEX_DIGITS[c] for c in code)
+
+
+# encodes a 64-bit integer n as a 32 hex digit string using a 32 hex digit key k as mask
+# NOTE: if deterministic=True, the encoding should not include random elements
+def encode(n, k, deterministic=False):
+    # the seed serves as starting point for pseudo-random walk (CANNOT BE ZERO!)
+    s = 15 if deterministic else randrange(1, 16)
+    return encoded_hex(format(n, 'x').zfill(16), s, key_table(k, s), deterministic)
+
+
+# returns list of codes for the integers in list ns using the 32 hex digit key k
+# NOTE: this is faster than calling encode for each integer, as the key tables are
+#       looked up only once
+def encode_many(ns, k, deterministic=False):
+    if deterministic:
+        t = key_table(k, 15)
+        return [encoded_hex(format(n, 'x').zfill(16), 15, t, True) for n in ns]
+    tables = [None] + [key_table(k, s) for s in range(1, 16)]
+    codes = []
+    for n in ns:
+        s = randrange(1, 16)
+        codes.append(encoded_hex(format(n, 'x').zfill(16), s, tables[s], False))
+    return codes
 
 
 # decodes an encoded 64-bit integer from an encoded 32 hex digit string s
@@ -189,37 +226,25 @@ def decode(s, k):
     # reject strings that ar not 32-digit hexadecimal strings
     if (len(s) != 32) or (all(c in hexdigits for c in s) == False):
         raise ValueError(INCORRECT_SESSION_KEY)
-    # convert characters to numbers while counting the 1-bits
-    sb = [0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 2, 4]
-    b = 0
-    hx = []
-    for c in s:
-        i = int(c, 16)
-        b += sb[i]
-        hx.append(i)
+    hx = [HEX_VALUES[c] for c in s]
     # check data integrity: # of 1-bits (modulo 16) of first 31 nibbles
     # should equal the value of the last hex digit
-    if (b - sb[hx[31]]) % 16 != hx[31]:
+    if sum(BIT_COUNTS[i] for i in hx[:31]) % 16 != hx[31]:
         raise ValueError(INCONSISTENT_SESSION_KEY)
-    key = []
-    for c in k:
-        key.append(int(c, 16))
-    # hx and key now hold nibbles as integer values
-    number = {}  # will hold 16 hex digits of the encoded number
-    p = hx[0]
-    q = p
-    for i in range(1, 17):
-        p = (p * 199) % 31
-        q = (q * 197) % 17
-        number[q - 1] = format(hx[p] ^ key[p], 'x')
-    for i in range(17, 31):  # ignore the 32nd digit, as it is noise
-        p = (p * 199) % 31
-        q = (q * 197) % 17
-        if i % 2 == 0:
-            # the even nibbles should match; the odd ones are noise
-            if number[q - 1] != format(hx[p] ^ key[p], 'x'):
-                raise ValueError(EXPIRED_SESSION_KEY)
-    return int(''.join(number[c] for c in sorted(number)), 16)
+    digits = key_table(k, hx[0])[0]
+    # will hold the hex digits of the encoded number (at positions 1 - 16)
+    number = [-1] * 17
+    for p, q, m in digits[:16]:
+        number[q] = hx[p] ^ m
+    # the other digits should match
+    for p, q, m in digits[16:]:
+        if number[q] != hx[p] ^ m:
+            raise ValueError(EXPIRED_SESSION_KEY)
+    n = 0
+    for d in number:
+        if d >= 0:
+            n = n * 16 + d
+    return n
 
 
 # for testing purposes only: compare random number with the result of decoding its encoding
@@ -299,14 +324,6 @@ def half_points_if_any(f):
     return signed_half_points(f)
 
 
-# returns disk usage for directory "path" in kilobytes (as a string)
-def disk_usage(path):
-    try:
-        return subprocess.check_output(['du','-sh', path]).split()[0]  #  .decode('utf-8')
-    except:
-        return ''
-
-
 # returns number n followed by phrase, which is pluralized unless n = 1
 def plural_s(n, phrase):
     if n == 1:
@@ -341,54 +358,137 @@ def ui_img(s):
     return s.replace('<img ', '<img class="ui large image" ')
 
 
+# returns tuple (sha256 hex digest, size in bytes) for the file at path
+def file_digest(path):
+    h = sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(65536), b''):
+            h.update(data)
+            size += len(data)
+    return (h.hexdigest(), size)
+
+
+# PDF conversions run in a pool of threads that is shared by all requests handled by this
+# process, so that the number of pdftotext processes running at the same time is bounded
+PDF_POOL = ThreadPoolExecutor(max_workers=settings.PDF_TO_TEXT_WORKERS)
+
+# recently extracted texts (by file hash), as the same PDF is typically converted more than once
+# (for upload validation, and again for plagiarism scanning)
+PDF_TEXT_CACHE = OrderedDict()
+PDF_TEXT_CACHE_SIZE = 200
+PDF_TEXT_CACHE_LOCK = Lock()
+
+
+# a forked process (e.g., a worker of the scan_relay command) does not inherit the threads
+# of the PDF pool, and may inherit a lock that was held at the time of the fork, so it gets
+# a pool and lock of its own
+def reset_pdf_pool():
+    global PDF_POOL, PDF_TEXT_CACHE_LOCK
+    PDF_POOL = ThreadPoolExecutor(max_workers=settings.PDF_TO_TEXT_WORKERS)
+    PDF_TEXT_CACHE_LOCK = Lock()
+
+
+os.register_at_fork(after_in_child=reset_pdf_pool)
+
+
+# returns the full path to pdftotext, or None if it is not installed
+def pdf_to_text_cmd():
+    return which(settings.PDF_TO_TEXT_CMD, path=settings.PDF_TO_TEXT_DIR or None)
+
+
 def pdf_to_text(path):
     """
     Extract text from PDF as 7-bit ASCII.
+
+    NOTE: the conversion is performed by a worker thread of the PDF pool, and
+          its result is cached by file hash. When pdftotext is not installed,
+          the text is extracted with PyPDF2 (slower, and less accurate).
     """
     try:
-        # On Windows, change to the directory where the application is
-        # installed, or check_output throws an "Access denied" error.
-        cwd = ''
-        if settings.PDF_TO_TEXT_DIR:
-            # save corrent working directory
-            cwd = os.getcwd()
-            # temporarily move to the directory containing pdftotext.exe
-            os.chdir(settings.PDF_TO_TEXT_DIR)
-
-        cmd = [settings.PDF_TO_TEXT_CMD, '-enc', 'ASCII7', path, '-']
-        ascii = subprocess.check_output(cmd)
-
-        # If changed, change back to the original current working directory.
-        if cwd:
-            os.chdir(cwd)
-
-        # Remove all footers, assuming that these are single short lines
-        # (typically "Page #" or just "#") that immediately preced a page
-        # separator (form feed).
-        pages = ascii.split('\f')
-        ascii = ''
-        # See what line separator is used.
-        if pages:
-            newline = '\r\n'
-            if not (newline in pages[0]):
-                newline = '\n'
-        # Add page text without footer text.
-        for p in pages:
-            pars = p.split(newline)
-            # Discard trailing blank lines.
-            while pars and len(pars[-1]) == 0:
-                pars.pop()
-            # Discard last line if it is short.
-            if (len(pars) > 1 and len(pars[-1]) < 20):
-                pars.pop()
-            # Add remaining paragraphs to result (using Unix newline).
-            ascii += '\n'.join(pars)
+        sha = file_digest(path)[0]
+    except Exception as e:
+        log_message('ERROR: Failed to read PDF file {}\n{}'.format(path, str(e)))
+        return ''
+    with PDF_TEXT_CACHE_LOCK:
+        if sha in PDF_TEXT_CACHE:
+            PDF_TEXT_CACHE.move_to_end(sha)
+            return PDF_TEXT_CACHE[sha]
+    ascii = PDF_POOL.submit(converted_pdf, path).result()
+    # NOTE: do not cache failed conversions, as these may have been caused by a time-out
+    if not ascii:
+        return ascii
+    with PDF_TEXT_CACHE_LOCK:
+        PDF_TEXT_CACHE[sha] = ascii
+        if len(PDF_TEXT_CACHE) > PDF_TEXT_CACHE_SIZE:
+            PDF_TEXT_CACHE.popitem(last=False)
+    return ascii
+
 
+# returns text of PDF file at path (without page footers)
+# NOTE: to be called only via the PDF pool
+def converted_pdf(path):
+    cmd = pdf_to_text_cmd()
+    try:
+        if cmd:
+            # NOTE: on Windows, pdftotext must be run in the directory where it is installed,
+            #       or check_output throws an "Access denied" error
+            ascii = subprocess.check_output(
+                [cmd, '-enc', 'ASCII7', '-l', str(settings.PDF_TO_TEXT_MAX_PAGES), path, '-'],
+                cwd=settings.PDF_TO_TEXT_DIR or None,
+                timeout=settings.PDF_TO_TEXT_TIMEOUT,
+                stderr=subprocess.DEVNULL
+                ).decode('ascii', 'ignore')
+        else:
+            ascii = python_pdf_to_text(path)
+    except subprocess.TimeoutExpired:
+        log_message('WARNING: Conversion of PDF file {} timed out'.format(path))
+        return ''
     except Exception as e:
         log_message(
-            'ERROR: Failed to execute command line {}\n{}'.format(
-                ' '.join(cmd),
-                str(e)
-                )
+            'ERROR: Failed to convert PDF file {}\n{}'.format(path, str(e))
             )
+        return ''
+
+    # Remove all footers, assuming that these are single short lines
+    # (typically "Page #" or just "#") that immediately preced a page
+    # separator (form feed).
+    pages = ascii.split('\f')
+    ascii = ''
+    # See what line separator is used.
+    if pages:
+        newline = '\r\n'
+        if not (newline in pages[0]):
+            newline = '\n'
+    # Add page text without footer text.
+    for p in pages:
+        pars = p.split(newline)
+        # Discard trailing blank lines.
+        while pars and len(pars[-1]) == 0:
+            pars.pop()
+        # Discard last line if it is short.
+        if (len(pars) > 1 and len(pars[-1]) < 20):
+            pars.pop()
+        # Add remaining paragraphs to result (using Unix newline).
+        ascii += '\n'.join(pars)
     return ascii
+
+
+# returns text of PDF file at path as extracted by PyPDF2, with pages separated by form feeds
+# NOTE: fallback for when pdftotext is not installed
+def python_pdf_to_text(path):
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        # older versions of PyPDF2
+        from PyPDF2 import PdfFileReader as PdfReader
+    pages = []
+    with open(path, 'rb') as f:
+        pdf = PdfReader(f)
+        for page in pdf.pages[:settings.PDF_TO_TEXT_MAX_PAGES]:
+            if hasattr(page, 'extract_text'):
+                txt = page.extract_text()
+            else:
+                txt = page.extractText()
+            pages.append(txt.encode('ascii', 'ignore').decode('ascii'))
+    return '\f'.join(pages)
@@ -27,7 +27,6 @@ from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.db.models import Count
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.template.loader import render_to_string
@@ -35,9 +34,7 @@ from django.utils import timezone
 from django.utils.decorators import method_decorator
 
 # python modules
-import codecs
 import os
-import re
 import tempfile
 from urllib.parse import unquote
 import zipfile
@@ -48,6 +45,7 @@ from presto.awards import awards
 from presto.administrator import administrator
 from presto.ajax import ajax
 from presto.badge import badge
+from presto.cache import cache_statistics
 from presto.course import course
 from presto.course_estafette import course_estafette
 from presto.demo import demo, demo_login
@@ -59,6 +57,7 @@ from presto.generic import decode, generic_context, has_role, report_error
 from presto.guest import guest, guest_login
 from presto.history_view import history_view, set_history_properties
 from presto.instructor import instructor
+from presto.logindex import log_page
 from presto.lti_view import lti_view
 from presto.picture_queue import picture_queue
 from presto.plag_scan import scan_one_assignment
@@ -70,7 +69,7 @@ from presto.test_file_type import test_file_type
 from presto.utils import log_message
 from presto.verify import verify
 
-from .models import DEFAULT_DATE, Assignment, Participant, ParticipantUpload
+from .models import DEFAULT_DATE, Assignment, Participant
 
 @login_required(login_url=settings.LOGIN_URL)
 def index(request):
@@ -100,13 +99,20 @@ def announcements(request):
 def setting_view(request):
     context = generic_context(request)
     context['page_title'] = 'Presto Settings'
+    # administrators can see how effective the cache is
+    if has_role(context, 'Administrator'):
+        context['cache_backend'] = settings.CACHES['default']['BACKEND'].split('.')[-1]
+        context['cache_stats'] = cache_statistics()
     return render(request, 'presto/setting_view.html', context)
 
 
 @login_required(login_url=settings.LOGIN_URL)
 def log_file(request, **kwargs):
     """
-    Return contents of Presto log file as plain text.
+    Return a page of entries of a Presto log file as plain text.
+    The entries are selected via the log index, optionally filtered by user,
+    level and text pattern; the parameters "after" and "before" are cursors
+    (entry IDs) for paging through the selection.
     """
     ymd = kwargs.get('date', '')
     if ymd == '':
@@ -117,23 +123,34 @@ def log_file(request, **kwargs):
         if not has_role(context, 'Administrator'):
             raise IOError('No permission to view log files')
         path = os.path.join(settings.LOG_DIR, 'presto-{}.log'.format(ymd))
-        with codecs.open(path, 'r', encoding='utf8') as log:
-            content = log.read()
-            lines = kwargs.get('lines', '')
-            # pattern = unquote(kwargs.get('pattern', '')).decode('utf8')
-            pattern = unquote(kwargs.get('pattern', ''))
-            if lines:
-                # Show last N lines.
-                content = '\n'.join(content.split('\n')[int(lines):])
-            elif pattern:
-                # Show pattern-matching lines, separated by blank line.
-                content = '\n\n'.join(
-                    re.findall(
-                        '^.*' + re.escape(pattern) + '.*$',
-                        content,
-                        re.MULTILINE
-                        )
-                    )
+        if not os.path.isfile(path):
+            raise IOError('No log file for ' + ymd)
+        lines = kwargs.get('lines', '')
+        pattern = unquote(kwargs.get('pattern', ''))
+        filters = {
+            'user': request.GET.get('user', ''),
+            'level': request.GET.get('level', ''),
+            'pattern': pattern
+            }
+        try:
+            after = int(request.GET.get('after', 0))
+            before = int(request.GET.get('before', 0))
+        except ValueError:
+            raise IOError('Invalid log cursor')
+        if lines:
+            # Show last N entries.
+            entries, first, last = log_page(ymd, tail=True, size=-int(lines), **filters)
+        else:
+            entries, first, last = log_page(ymd, after=after, before=before,
+                tail=(not after and not before and not pattern), **filters)
+        # Show pattern-matching entries separated by blank line.
+        content = ('\n\n' if pattern else '\n').join(entries)
+        # Add cursors for the previous and the next page.
+        q = ''.join(['&{}={}'.format(k, v) for k, v in filters.items() if v and k != 'pattern'])
+        content += '\n\n-- {} entries'.format(len(entries))
+        if first:
+            content += ' -- previous page: ?before={}{} -- next page: ?after={}{}'.format(
+                first, q, last, q)
     except IOError as e:
         report_error(context, e)
         return render(request, 'presto/error.html', context)
@@ -201,67 +218,8 @@ def scan(request, **kwargs):
     content = 'One scan completed'
     try:
         scan_one_assignment()
-        # below is a provisionary patch to remedy double assignments
-        # (it is added here so that it will be executed after each student action)
-        # NOTE: the uniqueness constraint on Assignment is NOT effectuated because
-        #       the "cloneOf" foreign key field can be NULL (a Django-specific issue)
-        doubles = Assignment.objects.filter(is_rejected=False, clone_of__isnull=True,
-            # NOTE: ignore early relays
-            participant__estafette__id__gt=40
-            ).values('participant__id', 'leg__id'
-            ).annotate(same_leg_cnt=Count('id')
-            ).values('participant__id', 'leg__id', 'same_leg_cnt'
-            ).order_by().filter(same_leg_cnt__gt=1)
-        for d in doubles:
-            a_set = Assignment.objects.filter(participant__id=d['participant__id'],
-                leg__id=d['leg__id']).order_by('-id')
-            # double-check that there is a duplicate assignment
-            if len(a_set) > 1:
-                # get the latest one
-                a = a_set.first()
-                # also get the one to keep
-                b = a_set[1]
-                # log that we found a duplicate
-                log_message(
-                    'WATCHDOG: Found duplicate assignment #{}-{}{}--{}'.format(
-                        a.id,
-                        a.case.letter,
-                        a.leg.number,
-                        a.participant.student.dummy_name()
-                        )
-                    )
-                log_message(
-                    '-- original assignment: #{}-{}{}--{}'.format(
-                        b.id,
-                        b.case.letter,
-                        b.leg.number,
-                        b.participant.student.dummy_name()
-                        )
-                    )
-                # also log the name of the relay
-                log_message('-- Relay: ' + a.participant.estafette.title())
-                # ensure that there are NO uploads (because these CASCADE delete)
-                puc = ParticipantUpload.objects.filter(assignment=a).count()
-                if puc > 0:
-                    log_message('-- NOT deleted because it has associated uploads')
-                else:
-                    try:
-                        # NOTE: Deleting duplicate will set its predecessor's
-                        #       successor field to NULL.
-                        a.delete()
-                        log_message('-- duplicate now deleted')
-                    except:
-                        # signal that assignment ID is a foreign key of some other record
-                        log_message('-- NOT deleted (probably related assignments or reviews)')
-                    try:
-                        # NOTE: we must now restore predecessor's successor field!!
-                        b.predecessor.successor = b
-                        b.predecessor.save()
-                        log_message('-- predecessor-successor restored')
-                    except:
-                        # signal that assignment ID is a foreign key of some other record
-                        log_message('-- failed to restore pred-succ relation')
-
+        # NOTE: double assignments are no longer "repaired" here, as the unique
+        #       constraint on active assignments now prevents them
     except Exception as e:
         content = 'ERROR during scan: ' + str(e)
     return HttpResponse(content, content_type='text/plain; charset=utf-8')
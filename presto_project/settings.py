@@ -171,6 +171,43 @@ else:
             }
         },
     }
+    # MySQL ignores the condition of the unique constraint on active assignments;
+    # the migration that adds this constraint creates an equivalent key for MySQL
+    SILENCED_SYSTEM_CHECKS = ['models.W036']
+
+
+# Cache for data that rarely changes (see presto/cache.py)
+# NOTE: by default, a file-based cache is used, as it is shared by all server processes
+#       on the host (a local-memory cache would not see invalidations by other processes);
+#       set CACHE_URL to redis://host:port/db to use a Redis server instead
+
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL.startswith('redis://') or CACHE_URL.startswith('rediss://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+            'KEY_PREFIX': 'presto',
+        }
+    }
+elif CACHE_URL == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'KEY_PREFIX': 'presto',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+            'KEY_PREFIX': 'presto',
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            }
+        }
+    }
 
 
 if USE_SAML is False:
@@ -345,6 +382,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = 'static/'
+# "manage.py collectstatic" writes hashed file names (so they can be cached "forever"),
+# losslessly recompressed images and precompressed .gz/.br variants (see static_storage.py)
+STATICFILES_STORAGE = 'presto.static_storage.PrecompressedManifestStaticFilesStorage'
 MEDIA_ROOT = '/upload/'
 PRESTO_URL = 'https://presto.tudelft.nl'
 
@@ -355,8 +395,24 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # path to pdftotext (must be empty string for Unix)
 PDF_TO_TEXT_DIR = ''
-# command to execute pdftotext (must be installed)
+# command to execute pdftotext (when not installed, a slower Python extractor is used)
 PDF_TO_TEXT_CMD = 'pdftotext'
+# maximum number of PDF conversions that run at the same time
+PDF_TO_TEXT_WORKERS = 4
+# maximum time (in seconds) that the conversion of one PDF file may take
+PDF_TO_TEXT_TIMEOUT = 60
+# only this many pages of a PDF file are converted to text
+PDF_TO_TEXT_MAX_PAGES = 250
+
+# keep a closure table of the "builds on" relation between assignments, so that the
+# plagiarism scanner finds related work with a single indexed query (otherwise, it uses
+# a recursive query); run "manage.py build_closure" before switching this on
+ASSIGNMENT_CLOSURE_TABLE = False
+
+# text matcher for plagiarism scans: 'gst' (greedy string tiling of words, see
+# presto/string_tiling.py) or 'sequence' (difflib.SequenceMatcher on characters, which
+# may take quadratic time on long texts)
+PLAG_SCAN_MATCHER = 'gst'
 
 # path to directory for images
 IMAGE_DIR = os.path.join(BASE_DIR, 'static', 'presto', 'images')